@@ -16,6 +16,7 @@ import analitico.status
 import analitico.logging
 
 import analitico.sdk
+import analitico.asyncsdk
 
 # classes used to represent items in the service
 from analitico.models import Item, Dataset, Recipe, Notebook
@@ -0,0 +1,67 @@
+"""
+Artifacts like samples of the training data, test predictions or the status logs of each
+step in a pipeline help inspecting a recipe but are not needed to complete it. They can be
+written by a background thread while the main thread continues training, eg. catboost
+releases the interpreter while it fits a model so samples are saved at the same time.
+
+Artifacts are queued in order and written one at a time. The queue is bounded (configured
+with ANALITICO_ARTIFACTS_QUEUE_SIZE) so that a slow disk blocks the producer instead of
+keeping an unbounded number of samples in memory. Errors while writing an artifact are
+logged and do not fail the training.
+"""
+
+import os
+import queue
+import threading
+
+from analitico.utilities import logger
+
+# maximum number of artifacts waiting to be written unless configured with ANALITICO_ARTIFACTS_QUEUE_SIZE
+ARTIFACTS_QUEUE_SIZE = 8
+
+
+class ArtifactsWriter:
+    """ Writes artifacts in order with a background thread fed by a bounded queue """
+
+    def __init__(self, max_queued: int = None):
+        if max_queued is None:
+            max_queued = os.environ.get("ANALITICO_ARTIFACTS_QUEUE_SIZE", ARTIFACTS_QUEUE_SIZE)
+        self._queue = queue.Queue(int(max_queued))
+        self._thread = None
+        self._lock = threading.Lock()
+        self.errors = 0
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                writer, args, kwargs = job
+                writer(*args, **kwargs)
+            except Exception as exc:
+                self.errors += 1
+                name = getattr(writer, "__name__", repr(writer))
+                logger.warning(f"ArtifactsWriter - could not write artifact with {name}: {exc}")
+            finally:
+                self._queue.task_done()
+
+    def submit(self, writer, *args, **kwargs):
+        """ Queues a call to writer(*args, **kwargs) that will save an artifact, blocks while the queue is full """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="analitico-artifacts", daemon=True)
+                self._thread.start()
+        self._queue.put((writer, args, kwargs))
+
+    def flush(self):
+        """ Waits until all queued artifacts have been written """
+        self._queue.join()
+
+    def close(self):
+        """ Writes all queued artifacts then stops the background thread """
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                self._queue.put(None)
+                self._thread.join()
+            self._thread = None
@@ -0,0 +1,541 @@
+"""
+An asyncio version of the SDK for analitico.ai/api. Calls can be awaited and run concurrently,
+for example to download many datasets at once with asyncio.gather. Requires aiohttp.
+"""
+
+import os
+import io
+import asyncio
+import contextlib
+import pandas as pd
+
+from pathlib import Path
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None  # optional package, pip install aiohttp
+
+import analitico
+import analitico.models
+
+from analitico.exceptions import AnaliticoException
+from analitico.sdk import AnaliticoSDK
+from analitico.models import Workspace, Item, Dataset, Recipe, Notebook
+from analitico.models.item import _open_source
+from analitico.utilities import id_generator, get_dict_dot, logger
+from analitico.constants import CSV_SUFFIXES, PARQUET_SUFFIXES
+from analitico.pandas import pd_read_csv, pd_to_bytes
+from analitico.streams import IterableStream, HTTP_STREAM_BUFFER_SIZE
+from analitico.network import (
+    HTTP_POOL_SIZE,
+    HTTP_RETRIES,
+    HTTP_BACKOFF_FACTOR,
+    HTTP_RETRY_STATUSES,
+    HTTP_IDEMPOTENT_METHODS,
+    HTTP_TIMEOUT,
+)
+
+
+class AsyncAnaliticoSDK(AnaliticoSDK):
+    """
+    An asyncio SDK for analitico.ai/api with the same methods as AnaliticoSDK which
+    should be awaited, eg: items = await sdk.get_items("dataset"). Items created by this
+    sdk also have methods that return coroutines, eg: df = await dataset.download("data.csv", df=True).
+    Calls share a pool of connections whose size can be configured with http_pool_size.
+    Use as: async with AsyncAnaliticoSDK(token=...) as sdk: ...
+    """
+
+    # methods of items created by this sdk return coroutines
+    is_async = True
+
+    def __init__(self, token=None, endpoint=None, workspace_id: str = None, **kwargs):
+        if not aiohttp:
+            raise AnaliticoException("AsyncAnaliticoSDK requires aiohttp, please install it with: pip install aiohttp")
+        # default workspace is retrieved the first time it is needed
+        super().__init__(token=token, endpoint=endpoint, **kwargs)
+        self._workspace_id = workspace_id
+
+    ##
+    ## Session
+    ##
+
+    # aiohttp session created on demand (must be created while the event loop is running)
+    _async_session = None
+
+    def get_async_session(self) -> "aiohttp.ClientSession":
+        """ Returns aiohttp session with a limited pool of keep-alive connections used for all calls """
+        if not self._async_session or self._async_session.closed:
+            connect_timeout, read_timeout = self.get_attribute("http_timeout", HTTP_TIMEOUT)
+            self._async_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.get_attribute("http_pool_size", HTTP_POOL_SIZE)),
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout),
+            )
+        return self._async_session
+
+    async def close(self):
+        """ Closes pooled connections """
+        if self._async_session:
+            await self._async_session.close()
+            self._async_session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exception_type, exception_value, traceback):
+        await self.close()
+
+    async def _request(self, method: str, url: str, retry: bool = True, timeout=None, data=None, **kwargs):
+        """
+        Makes a call and returns its response, retries idempotent calls with exponential backoff on errors.
+        Data can be a function returning a context manager with the body of the request so that a new body
+        (eg. a file that is opened again) is sent each time the call is retried and is closed once sent.
+        """
+        session = self.get_async_session()
+        if timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+        retries = 0
+        if retry and method in HTTP_IDEMPOTENT_METHODS:
+            retries = self.get_attribute("http_retries", HTTP_RETRIES)
+        for attempt in range(retries + 1):
+            try:
+                with data() if callable(data) else contextlib.nullcontext(data) as body:
+                    response = await session.request(method, url, data=body, **kwargs)
+                if response.status not in HTTP_RETRY_STATUSES or attempt == retries:
+                    return response
+                response.release()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt == retries:
+                    raise
+            await asyncio.sleep(HTTP_BACKOFF_FACTOR * (2 ** attempt))
+
+    ##
+    ## Calls
+    ##
+
+    async def get_url_stream(
+        self,
+        url: str,
+        data=None,
+        json: dict = None,
+        binary: bool = False,
+        cache: bool = True,
+        method: str = "GET",
+        status_code: int = 200,
+        chunk_size: int = 1024 * 1024,
+        timeout=None,
+        offset: int = None,
+        length: int = None,
+    ):
+        """
+        Returns an async iterator of chunks from the given url, eg: async for chunk in sdk.get_url_stream(url).
+        Like AnaliticoSDK.get_url_stream, GET calls are cached on disk and revalidated with conditional requests
+        and a part of the content can be requested with offset and length.
+        """
+        url, headers = self.get_url_headers(url)
+        if offset is not None or length is not None:
+            offset = offset if offset else 0
+            headers["Range"] = f"bytes={offset}-{offset + length - 1}" if length else f"bytes={offset}-"
+            headers["Accept-Encoding"] = "identity"
+            status_code = 206 if status_code == 200 else status_code
+            cache = False
+        cacheable = cache and method == "GET" and not (data or json)
+        cache_file = self.cache.get_filename(url) if cacheable else None
+        request_headers = dict(headers)
+        if cacheable:
+            request_headers.update(self.cache.get_conditional_headers(url))
+
+        response = await self._request(method, url, data=data, json=json, headers=request_headers, timeout=timeout)
+        async with response:
+            revalidated = cacheable and response.status == 304
+            if revalidated and os.path.isfile(cache_file):
+                with open(cache_file, "rb") as cached_stream:
+                    self.cache.record_hit(cache_file)
+                    for chunk in iter(lambda: cached_stream.read(chunk_size), b""):
+                        yield chunk
+                return
+
+            if not revalidated:
+                if status_code and response.status != status_code:
+                    msg = f"The response from {url} should have been {status_code} but instead it is {response.status}."
+                    raise AnaliticoException(msg, status_code=response.status)
+
+                if not (cacheable and (response.headers.get("etag") or response.headers.get("last-modified"))):
+                    async for chunk in response.content.iter_chunked(chunk_size):
+                        yield chunk
+                    return
+
+                # copy chunks into the cache as they are yielded, the cached copy is
+                # saved only once the content has been received completely
+                temp_file = cache_file + ".tmp_" + id_generator()
+                try:
+                    with open(temp_file, "wb") as f:
+                        async for chunk in response.content.iter_chunked(chunk_size):
+                            f.write(chunk)
+                            yield chunk
+                    os.replace(temp_file, cache_file)
+                    self.cache.save_validators(url, response.headers)
+                    self.cache.record_miss(cache_file)
+                finally:
+                    if os.path.isfile(temp_file):
+                        os.remove(temp_file)
+                return
+
+        # cached copy was removed after we revalidated it, fetch it again
+        async for chunk in self.get_url_stream(url, cache=False, chunk_size=chunk_size, timeout=timeout):
+            yield chunk
+
+    async def get_url_json(
+        self, url: str, json: dict = None, method: str = "GET", status_code: int = 200, timeout=None
+    ) -> dict:
+        """ Get a json response from given url, see AnaliticoSDK.get_url_json """
+        url, headers = self.get_url_headers(url)
+        response = await self._request(method, url, headers=headers, json=json, timeout=timeout)
+        async with response:
+            if status_code and response.status != status_code:
+                msg = f"The response from {url} should have been {status_code} but instead it is {response.status}."
+                raise AnaliticoException(msg, status_code=response.status)
+            try:
+                return await response.json(content_type=None)
+            except Exception:
+                return None
+
+    ##
+    ## SDK v1 methods
+    ##
+
+    async def create_item(self, item_type: str, workspace: Workspace = None, **kwargs) -> Item:
+        if not workspace:
+            workspace = await self.get_workspace()
+
+        data = {"data": kwargs}
+        data["data"]["workspace_id"] = workspace.id
+        if "type" in kwargs:
+            kwargs.pop("type")
+        if "id" in kwargs:
+            data["id"] = kwargs.pop("id")
+
+        json = await self.get_url_json(f"analitico://{item_type}s", json=data, method="POST", status_code=201)
+        assert "data" in json
+        return analitico.models.models_factory(self, json["data"])
+
+    async def create_dataset(self, workspace: Workspace = None, **kwargs) -> Dataset:
+        return await self.create_item(workspace=workspace, item_type=analitico.DATASET_TYPE, **kwargs)
+
+    async def create_recipe(self, workspace: Workspace = None, **kwargs) -> Recipe:
+        return await self.create_item(workspace=workspace, item_type=analitico.RECIPE_TYPE, **kwargs)
+
+    async def create_notebook(self, workspace: Workspace = None, **kwargs) -> Notebook:
+        return await self.create_item(workspace=workspace, item_type=analitico.NOTEBOOK_TYPE, **kwargs)
+
+    ##
+    ## Retrieve specific items by id
+    ##
+
+    async def get_items(self, item_type: str) -> [Item]:
+        """ Retrieves items of the given type from the server """
+        json = await self.get_url_json(f"analitico://{item_type}s")
+        return [analitico.models.models_factory(self, item_data) for item_data in json["data"]]
+
+    async def get_item(self, item_id: str) -> Item:
+        """ Retrieves item from the server by item_id """
+        json = await self.get_url_json(f"analitico://{self.get_item_type(item_id)}s/{item_id}")
+        assert "data" in json
+        return analitico.models.models_factory(self, json["data"])
+
+    async def get_workspace(self, workspace_id: str = None) -> Workspace:
+        """ Returns the workspace with the given id (or the default workspace). """
+        if not workspace_id:
+            if not self.workspace:
+                if self._workspace_id:
+                    self.workspace = await self.get_item(self._workspace_id)
+                else:
+                    workspaces = await self.get_items(analitico.WORKSPACE_TYPE)
+                    if len(workspaces) != 1:
+                        raise AnaliticoException("You do not have a default workspace, please assign sdk.workspace")
+                    self.workspace = workspaces[0]
+            return self.workspace
+
+        workspace = await self.get_item(workspace_id)
+        assert isinstance(workspace, Workspace)
+        return workspace
+
+    async def get_item_workspace(self, item: Item) -> Workspace:
+        """ Returns the workspace that owns the item (the item itself if it is a workspace), see Item.get_workspace """
+        if item.type == "workspace":
+            return item
+        workspace_id = item.get_attribute("workspace_id")
+        return await self.get_workspace(workspace_id) if workspace_id else None
+
+    async def get_dataset(self, dataset_id) -> Dataset:
+        dataset = await self.get_item(dataset_id)
+        assert isinstance(dataset, Dataset)
+        return dataset
+
+    async def get_recipe(self, recipe_id) -> Recipe:
+        recipe = await self.get_item(recipe_id)
+        assert isinstance(recipe, Recipe)
+        return recipe
+
+    async def get_notebook(self, notebook_id) -> Notebook:
+        notebook = await self.get_item(notebook_id)
+        assert isinstance(notebook, Notebook)
+        return notebook
+
+    ##
+    ## Items (called by items created by this sdk, eg: await item.download(...))
+    ##
+
+    # webdav storage of each workspace as tasks returning (url, auth), retrieved once per workspace
+    _storages = None
+
+    async def _fetch_storage(self, item: Item):
+        workspace = await self.get_item_workspace(item)
+        storage = workspace.get_attribute("storage") if workspace else None
+        if storage and "webdav" in storage.get("driver"):
+            auth = aiohttp.BasicAuth(
+                get_dict_dot(storage, "credentials.username"), get_dict_dot(storage, "credentials.password")
+            )
+            return storage["url"], auth
+        return None, None
+
+    async def _get_storage(self, item: Item):
+        """ Returns url and auth of the item's webdav storage or (None, None), see Item._get_storage """
+        if self._storages is None:
+            self._storages = {}
+        workspace_id = item.id if item.type == "workspace" else item.get_attribute("workspace_id")
+        # concurrent uploads to the same workspace all wait on the same request
+        if workspace_id not in self._storages:
+            self._storages[workspace_id] = asyncio.ensure_future(self._fetch_storage(item))
+        task = self._storages[workspace_id]
+        try:
+            return await task
+        except Exception:
+            if self._storages.get(workspace_id) is task:
+                del self._storages[workspace_id]  # retrieve again on the next call
+            raise
+
+    async def _make_storage_directories(self, server: str, auth, remotepath: str, directories: set = None):
+        """ Creates the directories containing the given path on webdav storage, see Item._make_storage_directories """
+        parts_url = server + "/"
+        for part in remotepath.split("/")[:-1]:
+            parts_url += part + "/"
+            if directories is not None and parts_url in directories:
+                continue
+            async with await self._request("MKCOL", parts_url, auth=auth) as response:
+                if response.status not in (405, 200, 201, 204):
+                    msg = f"An error occoured while creating directory {parts_url}"
+                    raise AnaliticoException(msg, status_code=response.status)
+            if directories is not None:
+                directories.add(parts_url)
+
+    async def _upload_directly_to_storage(
+        self, item: Item, source, remotepath: str, storage: tuple = None, directories: set = None
+    ) -> bool:
+        """
+        Upload a file (or bytes) directly to storage using webdav, see Item._upload_directly_to_storage.
+        Unlike uploads made with AnaliticoSDK, large files are not sent in resumable chunks: each file is
+        sent with a single PUT which is repeated from the start if it fails. Use AnaliticoSDK to upload
+        files that are too large to be sent again if the connection drops.
+        """
+        server, auth = storage if storage else await self._get_storage(item)
+        if not server:
+            return False
+
+        remotepath = f"{item.type}s/{item.id}/{remotepath}"
+        url = f"{server}/{remotepath}"
+
+        # make sure the containing directory exists before sending the file's contents
+        await self._make_storage_directories(server, auth, remotepath, directories)
+
+        # the file is opened again if the call is retried
+        async with await self._request("PUT", url, data=lambda: _open_source(source), auth=auth) as response:
+            if response.status in (200, 201, 204):
+                return True
+            msg = f"An error occoured while uploading {url}"
+            raise AnaliticoException(msg, status_code=response.status)
+
+    async def _upload_file(
+        self, item: Item, source, remotepath: str, direct: bool, storage: tuple = None, directories: set = None
+    ) -> bool:
+        """ Upload a single file (filepath or bytes) directly to storage or via /files APIs, see Item._upload_file """
+        # no absolute paths
+        assert not remotepath.startswith("/"), "remotepath should be relative, eg: flower.jpg or flowers/flower.jpg"
+
+        if direct:
+            try:
+                # see if we can upload directly to storage
+                if await self._upload_directly_to_storage(item, source, remotepath, storage, directories):
+                    return True
+            except AnaliticoException as exc:
+                logger.error(f"upload - direct to storage failed, will try via /files APIs, exc: {exc}")
+
+        @contextlib.contextmanager
+        def get_form():
+            with _open_source(source) as f:
+                form = aiohttp.FormData()
+                form.add_field("file", f, filename=Path(remotepath).name)
+                yield form
+
+        url, headers = self.get_url_headers(item.url + "/files/" + remotepath)
+        async with await self._request("PUT", url, data=get_form, headers=headers) as response:
+            if response.status not in (200, 204):
+                msg = f"Could not upload {remotepath} to {url}, status: {response.status}"
+                raise AnaliticoException(msg, status_code=response.status)
+        return True
+
+    async def _gather_bounded(self, coroutines, max_workers: int = None):
+        """ Awaits the given coroutines concurrently, at most max_workers at a time """
+        max_workers = max_workers if max_workers else self.get_attribute("http_pool_size", HTTP_POOL_SIZE)
+        semaphore = asyncio.Semaphore(max_workers)
+
+        async def bounded(coroutine):
+            async with semaphore:
+                return await coroutine
+
+        return await asyncio.gather(*[bounded(coroutine) for coroutine in coroutines])
+
+    async def upload(
+        self,
+        item: Item,
+        filepath: str = None,
+        df: pd.DataFrame = None,
+        remotepath: str = None,
+        direct: bool = True,
+        directory: str = None,
+        pattern: str = "**/*",
+        max_workers: int = None,
+        compression: str = "snappy",
+        row_group_size: int = None,
+    ) -> bool:
+        """ Upload a file, dataframe or directory to the storage drive associated with the item, see Item.upload """
+        if directory and not (filepath or isinstance(df, pd.DataFrame)):
+            if not os.path.isdir(directory):
+                raise AnaliticoException(f"upload - {directory} could not be found.", status_code=404)
+            prefix = remotepath.strip("/") + "/" if remotepath else ""
+            paths = [path for path in sorted(Path(directory).glob(pattern)) if path.is_file()]
+            remotepaths = [prefix + path.relative_to(directory).as_posix() for path in paths]
+            if not paths:
+                return True
+
+            storage, directories = None, None
+            if direct:
+                # create each directory on storage once, before uploading files concurrently
+                try:
+                    server, auth = await self._get_storage(item)
+                    if server:
+                        storage, directories = (server, auth), set()
+                        for path in remotepaths:
+                            await self._make_storage_directories(
+                                server, auth, f"{item.type}s/{item.id}/{path}", directories
+                            )
+                except AnaliticoException as exc:
+                    logger.error(f"upload - creating directories on storage failed, will use /files APIs, exc: {exc}")
+                    direct = False
+
+            uploads = []
+            for path, file_remotepath in zip(paths, remotepaths):
+                uploads.append(self._upload_file(item, str(path), file_remotepath, direct, storage, directories))
+            await self._gather_bounded(uploads, max_workers)
+            return True
+
+        if isinstance(df, pd.DataFrame):
+            if not remotepath:
+                remotepath = filepath if filepath else "data.parquet"
+            suffix = Path(remotepath).suffix
+
+            # encode dataframe in memory in a worker thread so the event loop is not blocked
+            encode = lambda: pd_to_bytes(df, suffix, compression=compression, row_group_size=row_group_size)
+            data = await asyncio.get_running_loop().run_in_executor(None, encode)
+            return await self._upload_file(item, data, remotepath, direct)
+
+        if filepath and os.path.isfile(filepath):
+            if not remotepath:
+                remotepath = Path(filepath).name
+            return await self._upload_file(item, filepath, remotepath, direct)
+
+        raise AnaliticoException(f"upload - {filepath} could not be found.", status_code=404)
+
+    async def download(
+        self,
+        item: Item,
+        remotepath: str,
+        filepath: str = None,
+        stream: bool = False,
+        binary: bool = True,
+        df=None,
+        offset: int = None,
+        length: int = None,
+        columns: [str] = None,
+    ):
+        """ Downloads a file asset of the item to a file, async iterator of chunks or dataframe, see Item.download """
+        url = item.url + "/files/" + remotepath
+        url_stream = self.get_url_stream(url, binary=binary, offset=offset, length=length)
+        if stream:
+            return url_stream
+
+        if filepath:
+            with open(filepath, "w+b") as f:
+                async for chunk in url_stream:
+                    f.write(chunk)
+
+        elif df:
+            suffix = Path(remotepath).suffix
+            if suffix not in CSV_SUFFIXES + PARQUET_SUFFIXES:
+                msg = f"Can't read {df} to a pandas dataframe, please load .csv or .parquet files."
+                raise AnaliticoException(msg, status_code=400)
+
+            loop = asyncio.get_running_loop()
+            if suffix in CSV_SUFFIXES:
+                # parse csv incrementally in a worker thread which pulls chunks from the event loop as it needs them
+                def iter_chunks():
+                    while True:
+                        try:
+                            yield asyncio.run_coroutine_threadsafe(url_stream.__anext__(), loop).result()
+                        except StopAsyncIteration:
+                            return
+
+                def read_csv():
+                    with io.BufferedReader(IterableStream(iter_chunks()), HTTP_STREAM_BUFFER_SIZE) as f:
+                        return pd_read_csv(f, usecols=columns)
+
+                try:
+                    return await loop.run_in_executor(None, read_csv)
+                finally:
+                    await url_stream.aclose()  # release the connection if the parser stopped early
+
+            # parquet needs random access, chunks are collected in memory (and copied to the cache as they
+            # are received) then read from the in-memory buffer without writing a temporary file
+            buffer = io.BytesIO()
+            async for chunk in url_stream:
+                buffer.write(chunk)
+            buffer.seek(0)
+            read_parquet = lambda: pd.read_parquet(buffer, columns=columns)
+            return await loop.run_in_executor(None, read_parquet)
+
+    async def download_many(
+        self, item: Item, remotepaths: [str], directory: str, binary: bool = True, max_workers: int = None
+    ) -> [str]:
+        """ Downloads multiple file assets of the item to a local directory concurrently, see Item.download_many """
+        filepaths = []
+        for remotepath in remotepaths:
+            filepath = os.path.join(directory, *remotepath.strip("/").split("/"))
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            filepaths.append(filepath)
+        downloads = [
+            self.download(item, remotepath, filepath=filepath, binary=binary)
+            for remotepath, filepath in zip(remotepaths, filepaths)
+        ]
+        await self._gather_bounded(downloads, max_workers)
+        return filepaths
+
+    async def save(self, item: Item) -> bool:
+        """ Save any changes to the item to the service. """
+        json = await self.get_url_json(item.url, method="PUT", json=item.to_dict(), status_code=200)
+        item.attributes = json["data"]["attributes"]
+        return True
+
+    async def delete(self, item: Item) -> bool:
+        """ Delete the item from the service. """
+        await self.get_url_json(item.url, method="DELETE", status_code=204)
+        return True
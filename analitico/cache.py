@@ -0,0 +1,370 @@
+"""
+A disk cache for files downloaded over http. Each cached response is stored in the cache
+directory together with its validators (ETag and Last-Modified headers). When the same url
+is requested again, the validators are sent with the request as If-None-Match and
+If-Modified-Since headers and if the server replies with 304 Not Modified the content is
+served from disk without being transferred again.
+
+The cache is bounded: when its contents exceed the configured size (ANALITICO_CACHE_SIZE
+environment variable, eg: 2Gi) the least recently used entries are evicted. Eviction is
+serialized with a lock file so that multiple processes can share the same cache directory.
+
+Models loaded from files for predictions are kept in a separate in-memory cache so that
+warm endpoints do not load the same model from disk on each request.
+"""
+
+import os
+import io
+import time
+import hashlib
+import tempfile
+import threading
+import contextlib
+import collections
+import requests
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # no lock files on windows
+
+from analitico.utilities import save_json, read_json, size_to_bytes, logger
+from analitico.streams import TeeStream, IterableStream, get_response_stream, HTTP_STREAM_BUFFER_SIZE
+
+# Tip: if cache contents need to be invalidated for whatever reason, you can change the prefix below...
+CACHE_PREFIX = "cache_v2_"
+
+# validators (etag, last-modified) of a cached response are stored next to it with this suffix
+CACHE_HEADERS_SUFFIX = ".headers"
+
+# lock file used to serialize eviction among processes sharing the cache directory
+CACHE_LOCK_FILENAME = ".lock"
+
+# maximum size of the cache unless configured with ANALITICO_CACHE_SIZE
+CACHE_DEFAULT_SIZE = "2Gi"
+
+# partial downloads older than this are considered abandoned and removed
+CACHE_STALE_TEMP_SECS = 24 * 60 * 60
+
+# maximum number of models kept in memory unless configured with ANALITICO_MODEL_CACHE_COUNT
+MODEL_CACHE_DEFAULT_COUNT = 8
+
+# maximum size of the files of models kept in memory unless configured with ANALITICO_MODEL_CACHE_SIZE
+MODEL_CACHE_DEFAULT_SIZE = "1Gi"
+
+
+class HttpCache:
+    """ A bounded disk cache for http downloads which are revalidated with conditional requests """
+
+    def __init__(self, directory: str = None, max_size=None):
+        self._directory = directory
+        if max_size is None:
+            max_size = os.environ.get("ANALITICO_CACHE_SIZE", CACHE_DEFAULT_SIZE)
+        self.max_size = size_to_bytes(max_size)
+        self._stats_lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "hit_bytes": 0, "miss_bytes": 0, "evictions": 0, "evicted_bytes": 0}
+
+    @property
+    def directory(self) -> str:
+        """ Directory where cached files are stored (created if needed) """
+        if not self._directory:
+            self._directory = os.path.join(tempfile.gettempdir(), "analitico_cache")
+        if not os.path.isdir(self._directory):
+            os.makedirs(self._directory, exist_ok=True)
+        return self._directory
+
+    def get_filename(self, unique_id: str) -> str:
+        """ Returns the fullpath in cache for an item with the given unique_id (eg: a url, an md5 or etag, etc) """
+        return os.path.join(self.directory, CACHE_PREFIX + hashlib.sha256(unique_id.encode()).hexdigest())
+
+    ##
+    ## Statistics
+    ##
+
+    def _count(self, **kwargs):
+        with self._stats_lock:
+            for key, value in kwargs.items():
+                self._stats[key] += value
+
+    def record_hit(self, cache_file: str):
+        """ Records a cache hit and marks the entry as recently used """
+        try:
+            os.utime(cache_file)
+            self._count(hits=1, hit_bytes=os.path.getsize(cache_file))
+        except OSError:
+            pass
+
+    def record_miss(self, cache_file: str):
+        """ Records a cache miss whose content has now been saved, trims cache if needed (keeping the new entry) """
+        try:
+            self._count(misses=1, miss_bytes=os.path.getsize(cache_file))
+        except OSError:
+            pass
+        self.trim(keep=cache_file)
+
+    def get_stats(self) -> dict:
+        """ Returns hits, misses and bytes served or downloaded by this process plus current size of the cache """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["size"] = sum(size for _, size, _ in self._get_entries())
+        stats["max_size"] = self.max_size
+        return stats
+
+    ##
+    ## Eviction
+    ##
+
+    @contextlib.contextmanager
+    def _lock(self):
+        """ Exclusive lock on the cache directory shared with other processes """
+        with open(os.path.join(self.directory, CACHE_LOCK_FILENAME), "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _get_entries(self):
+        """ Returns cache entries as a list of (last used, size, filename), removes abandoned partial downloads """
+        entries = []
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            try:
+                if not entry.name.startswith(CACHE_PREFIX) or entry.name.endswith(CACHE_HEADERS_SUFFIX):
+                    continue
+                stat = entry.stat()
+                if ".tmp_" in entry.name:
+                    if now - stat.st_mtime > CACHE_STALE_TEMP_SECS:
+                        os.remove(entry.path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+            except OSError:
+                pass  # removed by another process while scanning
+        return entries
+
+    def trim(self, max_size: int = None, keep: str = None) -> int:
+        """
+        Evicts least recently used entries until the cache fits the given size in bytes, returns number evicted.
+        The entry in keep is never evicted, eg: a file which was just cached and is about to be read.
+        """
+        max_size = self.max_size if max_size is None else max_size
+        evicted = 0
+        with self._lock():
+            entries = self._get_entries()
+            size = sum(entry[1] for entry in entries)
+            for _, entry_size, entry_path in sorted(entries):
+                if size <= max_size:
+                    break
+                if entry_path == keep:
+                    continue
+                try:
+                    os.remove(entry_path)
+                    if os.path.isfile(entry_path + CACHE_HEADERS_SUFFIX):
+                        os.remove(entry_path + CACHE_HEADERS_SUFFIX)
+                except OSError:
+                    pass
+                size -= entry_size
+                evicted += 1
+                self._count(evictions=1, evicted_bytes=entry_size)
+        if evicted:
+            logger.info(f"HttpCache.trim - evicted {evicted} entries, cache size is now {size} bytes")
+        return evicted
+
+    ##
+    ## Validators
+    ##
+
+    def get_validators(self, url: str) -> dict:
+        """ Returns the etag and last_modified validators of the cached copy of url, or None if not cached """
+        cache_file = self.get_filename(url)
+        headers_file = cache_file + CACHE_HEADERS_SUFFIX
+        if os.path.isfile(cache_file) and os.path.isfile(headers_file):
+            try:
+                return read_json(headers_file)
+            except Exception:
+                pass
+        return None
+
+    def save_validators(self, url: str, headers) -> None:
+        """ Saves the etag and last-modified headers of a response whose content has been cached """
+        validators = {"url": url, "etag": headers.get("etag"), "last_modified": headers.get("last-modified")}
+        headers_file = self.get_filename(url) + CACHE_HEADERS_SUFFIX
+        save_json(validators, headers_file)
+
+    def get_conditional_headers(self, url: str) -> dict:
+        """ Returns If-None-Match and If-Modified-Since headers to revalidate the cached copy of url (if any) """
+        headers = {}
+        validators = self.get_validators(url)
+        if validators:
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+        return headers
+
+    ##
+    ## Streams
+    ##
+
+    def get_cached_stream(self, stream, unique_id: str):
+        """ Will cache a stream on disk based on a unique_id (like md5 or etag) and return file stream and filename """
+        cache_file = self.get_filename(unique_id)
+        if os.path.isfile(cache_file):
+            self.record_hit(cache_file)
+            return open(cache_file, "rb"), cache_file
+
+        # if not cached already, download and cache
+        if not hasattr(stream, "read"):
+            stream = IterableStream(stream)
+        with TeeStream(stream, cache_file) as tee:
+            while tee.read(HTTP_STREAM_BUFFER_SIZE):
+                pass
+        # open stream from cached file before the cache is trimmed
+        cached_stream = open(cache_file, "rb")
+        self.record_miss(cache_file)
+        return cached_stream, cache_file
+
+    def get_url_stream(
+        self, url: str, headers: dict = None, session=None, buffer_size: int = HTTP_STREAM_BUFFER_SIZE, **kwargs
+    ):
+        """
+        Issues a conditional GET for the given url and returns a file-like stream with its content
+        and the status code of the response. If the server replies that our cached copy is still
+        valid the stream reads from the cache and the status code returned is 200. Otherwise the
+        content is streamed from the network and copied into the cache as it is read. The request
+        is made with the given session (if any) and additional arguments like timeout.
+        """
+        session = session if session else requests
+        request_headers = dict(headers) if headers else {}
+        conditional = self.get_conditional_headers(url)
+        request_headers.update(conditional)
+
+        response = session.get(url, stream=True, headers=request_headers, **kwargs)
+        if response.status_code == 304:
+            response.close()
+            cache_file = self.get_filename(url)
+            try:
+                cached_stream = open(cache_file, "rb")
+                self.record_hit(cache_file)
+                return cached_stream, 200
+            except FileNotFoundError:
+                # cached copy was removed after we revalidated it, fetch it again
+                logger.warning(f"HttpCache.get_url_stream - {url} was removed from cache, retrying")
+                response = session.get(url, stream=True, headers=headers, **kwargs)
+
+        cacheable = response.status_code == 200 and (
+            response.headers.get("etag") or response.headers.get("last-modified")
+        )
+        if cacheable:
+            # copy chunks into the cache as they are read by the caller, validators
+            # are saved only once the content has been completely read and cached
+            def on_completed():
+                self.save_validators(url, response.headers)
+                self.record_miss(cache_file)
+
+            cache_file = self.get_filename(url)
+            response.raw.decode_content = True
+            tee = TeeStream(response.raw, cache_file, on_completed=on_completed)
+            return io.BufferedReader(tee, buffer_size), response.status_code
+        return get_response_stream(response, buffer_size), response.status_code
+
+    def get_url_buffer(self, url: str, headers: dict = None, session=None, **kwargs):
+        """
+        Returns the content of the given url in a form that can be read with random access (eg. by pyarrow)
+        and the status code of the response. If the content is cached, or can be cached as it is downloaded,
+        the path of the cached file is returned and no other copy is made. Otherwise the content is returned
+        in an in-memory buffer. Errors are returned as an in-memory buffer with the response's status code.
+        """
+        stream, status_code = self.get_url_stream(url, headers=headers, session=session, **kwargs)
+        with stream:
+            raw = getattr(stream, "raw", None)
+            if status_code == 200:
+                if isinstance(raw, io.FileIO):
+                    return raw.name, status_code  # served from cache
+                if isinstance(raw, TeeStream):
+                    while stream.read(HTTP_STREAM_BUFFER_SIZE):
+                        pass  # copied into the cache as it is read
+                    if raw.completed:
+                        return raw.filepath, status_code
+            return io.BytesIO(stream.read()), status_code
+
+
+##
+## ModelCache
+##
+
+
+class ModelCache:
+    """
+    An in-memory cache of models loaded from files, eg. a CatBoost model.cbm. Models are cached by the path
+    of their file and are reloaded if the file is modified (its modification time or size change), eg. after
+    a new training. Least recently used models are evicted when the cache has more than max_count models or
+    when their files add up to more than max_size bytes.
+    """
+
+    def __init__(self, max_count: int = None, max_size=None):
+        if max_count is None:
+            max_count = os.environ.get("ANALITICO_MODEL_CACHE_COUNT", MODEL_CACHE_DEFAULT_COUNT)
+        if max_size is None:
+            max_size = os.environ.get("ANALITICO_MODEL_CACHE_SIZE", MODEL_CACHE_DEFAULT_SIZE)
+        self.max_count = int(max_count)
+        self.max_size = size_to_bytes(max_size)
+        self._lock = threading.Lock()
+        self._models = collections.OrderedDict()  # path: (mtime and size of file, model, size)
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get_model(self, model_path: str, loader):
+        """
+        Returns the model saved in the given file and True if it was cached or False if it had to be loaded.
+        On a miss the model is loaded by calling loader(model_path), the loading is done outside of the lock
+        so that other threads can use cached models in the meantime.
+        """
+        stat = os.stat(model_path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._models.get(model_path)
+            if entry and entry[0] == key:
+                self._models.move_to_end(model_path)
+                self._stats["hits"] += 1
+                return entry[1], True
+
+        model = loader(model_path)
+        with self._lock:
+            self._models[model_path] = (key, model, stat.st_size)
+            self._models.move_to_end(model_path)
+            self._stats["misses"] += 1
+            self._trim()
+        return model, False
+
+    def _trim(self):
+        """ Evicts least recently used models until the cache fits its limits (called with lock held) """
+        size = sum(entry[2] for entry in self._models.values())
+        while len(self._models) > 1 and (len(self._models) > self.max_count or size > self.max_size):
+            model_path, (_, _, model_size) = self._models.popitem(last=False)
+            size -= model_size
+            self._stats["evictions"] += 1
+            logger.info(f"ModelCache - evicted {model_path} ({model_size} bytes)")
+
+    def clear(self):
+        """ Removes all models from the cache """
+        with self._lock:
+            self._models.clear()
+
+    def get_stats(self) -> dict:
+        """ Returns hits, misses and evictions plus the number and size of the models currently cached """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["count"] = len(self._models)
+            stats["size"] = sum(entry[2] for entry in self._models.values())
+        stats["max_count"] = self.max_count
+        stats["max_size"] = self.max_size
+        return stats
+
+
+# cache shared by factories and sdks in this process
+http_cache = HttpCache()
+
+# models loaded for predictions in this process
+model_cache = ModelCache()
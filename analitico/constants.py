@@ -57,11 +57,12 @@ WORKER_PREFIX = "wk_"  # worker process
 # files suffixes
 PARQUET_SUFFIXES = (".parquet",)  # Apache Parquet
 CSV_SUFFIXES = (".csv",)  # Comma Separated Values
+FEATHER_SUFFIXES = (".feather", ".arrow")  # Apache Arrow IPC
 EXCEL_SUFFIXES = (".xlsx", ".xls")  # Microsoft Excel
 HDF_SUFFIXES = (".h5", ".hdf5", ".he5", ".hdf", ".h4", ".hdf4", ".he2")  # Hierarchical Data Format
 
 # suffixes for files that we can load in pandas dataframes
-PANDAS_SUFFIXES = PARQUET_SUFFIXES + CSV_SUFFIXES + EXCEL_SUFFIXES + HDF_SUFFIXES
+PANDAS_SUFFIXES = PARQUET_SUFFIXES + FEATHER_SUFFIXES + CSV_SUFFIXES + EXCEL_SUFFIXES + HDF_SUFFIXES
 
 # APIs query parameters
 QUERY_PARAM = "query"  # query parameter used to search and filter records, etc
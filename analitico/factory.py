@@ -19,6 +19,11 @@ from .status import STATUS_FAILED
 import analitico.utilities
 from analitico.dataset import Dataset
 from analitico.utilities import id_generator
+from analitico.pandas import pd_to_bytes
+from analitico.cache import http_cache
+from analitico.artifacts import ArtifactsWriter
+from analitico.streams import get_response_stream
+from analitico.network import HttpSession
 
 # read http streams in chunks
 HTTP_BUFFER_SIZE = 32 * 1024 * 1024  # 32 MiBs
@@ -27,7 +32,7 @@ HTTP_BUFFER_SIZE = 32 * 1024 * 1024  # 32 MiBs
 class Factory(AttributeMixin):
     """ A base class providing runtime services like notebook and plugin creation, storage, network, etc """
 
-    def __init__(self, token=None, endpoint=None, **kwargs):
+    def __init__(self, token=None, endpoint=None, artifacts_directory: str = None, **kwargs):
         super().__init__(**kwargs)
         if token:
             assert token.startswith("tok_")
@@ -36,10 +41,10 @@ class Factory(AttributeMixin):
             assert endpoint.startswith("http")
             self.set_attribute("endpoint", endpoint)
 
-        # use current working directory at the time when the factory
-        # is created so that the caller can setup a temp directory we
-        # should work in
-        self._artifacts_directory = os.getcwd()
+        # unless given, use current working directory at the time when
+        # the factory is created so that the caller can setup a temp
+        # directory we should work in
+        self._artifacts_directory = artifacts_directory if artifacts_directory else os.getcwd()
 
     ##
     ## Properties and factory context
@@ -75,6 +80,16 @@ class Factory(AttributeMixin):
         """ Request used as context when running on the server or running async jobs (optional) """
         return self.get_attribute("request")
 
+    # http session created on demand
+    _session = None
+
+    @property
+    def session(self) -> HttpSession:
+        """ Http session with a pool of keep-alive connections used for all network calls made by the factory """
+        if not self._session:
+            self._session = HttpSession()
+        return self._session
+
     ##
     ## Temp and cache directories
     ##
@@ -100,17 +115,38 @@ class Factory(AttributeMixin):
         """
         return self._artifacts_directory
 
+    # Writes artifacts that are not needed to complete a run in the background
+    _artifacts_writer = None
+
+    def write_artifact(self, writer, *args, background=True, **kwargs):
+        """
+        Calls writer(*args, **kwargs) to save an artifact like samples of the data, status logs, etc.
+        Unless background is False the call is queued and made by a background thread so the caller
+        can continue, in which case the arguments should not be modified afterwards.
+        """
+        if not background:
+            return writer(*args, **kwargs)
+        if not self._artifacts_writer:
+            self._artifacts_writer = ArtifactsWriter()
+        self._artifacts_writer.submit(writer, *args, **kwargs)
+
+    def flush_artifacts(self):
+        """ Waits until artifacts queued with write_artifact have been written """
+        if self._artifacts_writer:
+            self._artifacts_writer.flush()
+
+    @property
+    def cache(self):
+        """ Disk cache used for downloads, shared with other factories and sdks in this process """
+        return http_cache
+
     def get_cache_directory(self):
         """ Returns directory to be used for caches """
-        cache_dir = os.path.join(tempfile.gettempdir(), "analitico_cache")
-        if not os.path.isdir(cache_dir):
-            os.mkdir(cache_dir)
-        return cache_dir
+        return self.cache.directory
 
     def get_cache_filename(self, unique_id):
         """ Returns the fullpath in cache for an item with the given unique_id (eg: a unique url, an md5 or etag, etc) """
-        # Tip: if cache contents need to be invalidated for whatever reason, you can change the prefix below...
-        return os.path.join(self.get_cache_directory(), "cache_v2_" + hashlib.sha256(unique_id.encode()).hexdigest())
+        return self.cache.get_filename(unique_id)
 
     ##
     ## URL retrieval, authorization and caching
@@ -119,35 +155,18 @@ class Factory(AttributeMixin):
     # regular expression used to detect assets using analitico:// scheme
     ANALITICO_ASSET_RE = r"(analitico://workspaces/(?P<workspace_id>[-\w.]{4,256})/)"
 
-    # TODO could check if it would be possible to switch to an external caching library, eg:
-    # https://github.com/ionrock/cachecontrol
-
     def get_cached_stream(self, stream, unique_id):
         """ Will cache a stream on disk based on a unique_id (like md5 or etag) and return file stream and filename """
-        cache_file = self.get_cache_filename(unique_id)
-        if not os.path.isfile(cache_file):
-            # if not cached already, download and cache
-            cache_temp_file = cache_file + ".tmp_" + id_generator()
-
-            with open(cache_temp_file, "wb") as f:
-                if hasattr(stream, "read"):
-                    for chunk in iter(lambda: stream.read(HTTP_BUFFER_SIZE), b""):
-                        f.write(chunk)
-                else:
-                    for b in stream:
-                        f.write(b)
-
-            # TODO add progress bar for slow downloads https://github.com/tqdm/tqdm#iterable-based
-
-            os.rename(cache_temp_file, cache_file)
-        # return stream from cached file
-        return open(cache_file, "rb"), cache_file
-
-    def get_url_stream(self, url, binary=False, cache=True):
+        return self.cache.get_cached_stream(stream, unique_id)
+
+    def get_cache_stats(self) -> dict:
+        """ Returns cache hits, misses, bytes served from cache or downloaded, evictions and current cache size """
+        return self.cache.get_stats()
+
+    def get_url_headers(self, url: str) -> (str, dict):
         """
-        Returns a stream to the given url. This works for regular http:// or https://
-        and also works for analitico:// assets which are converted to calls to the given
-        endpoint with proper authorization tokens. The stream is returned as an iterator.
+        Converts analitico:// urls to the endpoint's https:// urls and returns the url and the headers
+        to be used to fetch it (with authorization for analitico.ai). Headers are None for local files.
         """
         assert url and isinstance(url, str)
         # If the url uses the analitico:// scheme for assets stored on the cloud
@@ -172,22 +191,52 @@ class Factory(AttributeMixin):
             if url_parse.hostname and url_parse.hostname.endswith("analitico.ai") and self.token:
                 # if url is connecting to analitico.ai add token
                 headers = {"Authorization": "Bearer " + self.token}
+            return url, headers
+        return url, None
 
-            # we should not take the raw response stream here as it could be gzipped or encoded.
-            # we take the decoded content as a text string and turn it into a stream or we take the
-            # decompressed binary content and also turn it into a stream.
-            response = requests.get(url, stream=True, headers=headers)
-
-            # always treat content as binary, utf-8 encoding is done by readers
-            response_stream = io.BytesIO(response.content)
-
-            if cache and "etag" in response.headers:
-                etag = response.headers["etag"]
-                if etag:
-                    return self.get_cached_stream(response_stream, url + etag)[0]
+    def get_url_stream(self, url, binary=False, cache=True, stream=True):
+        """
+        Returns a stream to the given url. This works for regular http:// or https://
+        and also works for analitico:// assets which are converted to calls to the given
+        endpoint with proper authorization tokens. When stream is True (default) the
+        returned file-like object reads directly from the network connection, decoding
+        gzip or deflate content as needed, so that memory usage does not grow with the
+        size of the download. When cache is True, responses with an etag or last-modified
+        header are copied into the cache as they are read and later requests are made
+        conditional so that unchanged content is served from disk. When stream is False
+        the whole response is downloaded and returned as an in memory, seekable stream.
+        """
+        url, headers = self.get_url_headers(url)
+        if headers is not None:
+            if cache:
+                response_stream, _ = self.cache.get_url_stream(url, headers=headers, session=self.session)
+            else:
+                response = self.session.get(url, stream=True, headers=headers)
+                response_stream = get_response_stream(response)
+
+            if not stream:
+                # read the decoded content completely (caching it if needed) and
+                # return it as an in memory stream. always treat content as binary,
+                # utf-8 encoding is done by readers
+                with response_stream:
+                    return io.BytesIO(response_stream.read())
             return response_stream
         return open(url, "rb")
 
+    def get_url_buffer(self, url):
+        """
+        Returns the content of the given url in a form that can be read with random access, eg. by pyarrow:
+        the path of the cached (or local) file if possible or an in-memory buffer. Raises an AnaliticoException
+        with the response's status code if the url cannot be retrieved (eg. 404 if it does not exist).
+        """
+        url, headers = self.get_url_headers(url)
+        if headers is None:
+            return url
+        buffer, status_code = self.cache.get_url_buffer(url, headers=headers, session=self.session)
+        if status_code != 200:
+            raise AnaliticoException(f"Could not retrieve {url}, status: {status_code}", status_code=status_code)
+        return buffer
+
     def get_url_json(self, url):
         assert url and isinstance(url, str)
         url_stream = self.get_url_stream(url)
@@ -371,8 +420,13 @@ class Factory(AttributeMixin):
         return self
 
     def __exit__(self, exception_type, exception_value, traceback):
-        """ Leave any temporary files upon exiting """
-        pass
+        """ Leave any temporary files upon exiting, write queued artifacts, close pooled connections """
+        if self._artifacts_writer:
+            self._artifacts_writer.close()
+            self._artifacts_writer = None
+        if self._session:
+            self._session.close()
+            self._session = None
 
     ##
     ## SDK utility methods
@@ -394,16 +448,14 @@ class Factory(AttributeMixin):
         url = f"{self.endpoint}{item_type}s/{item_id}/assets/{filename}"
 
         if filename.endswith(".parquet"):
-            with tempfile.TemporaryDirectory() as tmpdir:
-                filepath = os.path.join(tmpdir, filename)
-                df.to_parquet(filepath)
-                response = requests.post(
-                    url, files={"file": filepath}, headers={"Authorization": "Bearer " + self.token}
+            # encode dataframe in memory and post its contents (not the name of a temporary file)
+            data = pd_to_bytes(df, ".parquet")
+            files = {"file": (os.path.basename(filename), data)}
+            response = self.session.post(url, files=files, headers={"Authorization": "Bearer " + self.token})
+            if response.status_code != 201:
+                raise AnaliticoException(
+                    f"Asset {filename} could not be uploaded to item {item_id}", response=response.json()
                 )
-                if response.status_code != 201:
-                    raise AnaliticoException(
-                        f"Asset {filename} could not be uploaded to item {item_id}", response=response.json()
-                    )
         else:
             raise AnaliticoException(f"Did not recognize file format for {filename}")
         return self.get_item(item_id)
@@ -1,22 +1,44 @@
 import os
 import pandas as pd
-import tempfile
 import urllib
 import requests
 import base64
 import io
+import time
+import hashlib
+import concurrent.futures
 
 from analitico import AnaliticoException, logger
 from analitico.mixin import AttributeMixin
-from analitico.utilities import save_text, subprocess_run, get_dict_dot
+from analitico.utilities import save_text, subprocess_run, get_dict_dot, size_to_bytes
 from analitico.constants import CSV_SUFFIXES, PARQUET_SUFFIXES
-from analitico.pandas import pd_read_csv
+from analitico.pandas import pd_read_csv, pd_to_bytes
+from analitico.streams import IterableStream, HTTP_STREAM_BUFFER_SIZE
+from analitico.network import (
+    HTTP_POOL_SIZE,
+    HTTP_RETRIES,
+    HTTP_BACKOFF_FACTOR,
+    HTTP_RETRY_STATUSES,
+    HTTP_UPLOAD_CHUNK_SIZE,
+)
 
 from collections import OrderedDict
 from pathlib import Path
 
 DF_SUPPORTED_FORMATS = (".parquet", ".csv")
 
+MB_SIZE = 1024 * 1024
+
+
+def _open_source(source):
+    """ Returns a readable file for an upload's source which is either a filepath or bytes """
+    return open(source, "rb") if isinstance(source, str) else io.BytesIO(source)
+
+
+def _get_source_size(source) -> int:
+    """ Returns the size of an upload's source which is either a filepath or bytes """
+    return os.path.getsize(source) if isinstance(source, str) else len(source)
+
 
 class Item(AttributeMixin):
     """ Base class for items like datasets, recipes and notebooks on Analitico. """
@@ -57,6 +79,15 @@ class Item(AttributeMixin):
     @property
     def workspace(self):
         """ Returns the workspace that owns this item (or None if this is a workspace). """
+        if self.sdk.is_async:
+            msg = "item.workspace can't be retrieved synchronously with an async sdk, use: await item.get_workspace()"
+            raise AnaliticoException(msg)
+        return self.get_workspace()
+
+    def get_workspace(self):
+        """ Returns the workspace that owns this item, a coroutine to be awaited for items of an async sdk. """
+        if self.sdk.is_async:
+            return self.sdk.get_item_workspace(self)
         if self.type == "workspace":
             return self
         workspace_id = self.get_attribute("workspace_id")
@@ -66,123 +97,297 @@ class Item(AttributeMixin):
     ## Internals
     ##
 
-    def _upload_directly_to_storage(self, filepath: str = None, remotepath: str = None) -> bool:
+    def _get_storage(self):
+        """ Returns the url and (username, password) credentials of the workspace's webdav storage or (None, None) """
+        workspace = self.workspace
+        storage = workspace.get_attribute("storage") if workspace else None
+        if storage and "webdav" in storage.get("driver"):
+            credentials = (get_dict_dot(storage, "credentials.username"), get_dict_dot(storage, "credentials.password"))
+            return storage["url"], credentials
+        return None, None
+
+    def _make_storage_directories(self, server: str, auth, remotepath: str, directories: set = None):
         """
-        Upload a file directly to storage using webdav. This puts less load on the server
-        for larger uploads but has a few drawbacks including not generating automatic triggers
-        on the service, notifications, etc.
+        Creates the directories containing the given path on webdav storage. If a set of directories
+        is passed, directories already in the set are skipped and those that are created are added
+        so that uploading many files will only create each directory once.
         """
-        workspace = self.workspace
-        if workspace:
-            storage = workspace.get_attribute("storage")
-            if "webdav" in storage.get("driver"):
-                # storage configuration for this workspace
-                server = storage["url"]
-                user = get_dict_dot(storage, "credentials.username")
-                password = get_dict_dot(storage, "credentials.password")
-
-                remotepath = f"{self.type}s/{self.id}/{remotepath}"
-
-                with open(filepath, "rb") as f:
-                    # direct upload implies the containing directory already exists
-                    url = f"{server}/{remotepath}"
-                    response = requests.put(url, data=f, auth=(user, password))
-                    if response.status_code in (200, 201, 204):
-                        return True
-
-                # probably missing the directory
-                if response.status_code == 403:
-                    parts = remotepath.split("/")[:-1]
-                    parts_url = server + "/"
-                    for part in parts:
-                        parts_url += part + "/"
-                        response = requests.request("MKCOL", parts_url, auth=(user, password))
-                        if response.status_code not in (405, 200, 201, 204):
-                            msg = f"An error occoured while creating directory {parts_url}"
-                            raise AnaliticoException(msg, status_code=response.status_code)
-
-                    # now we can retry uploading the file as we know for sure its directory exists
-                    with open(filepath, "rb") as f:
-                        response = requests.put(url, data=f, auth=(user, password))
-                        if response.status_code in (200, 201, 204):
-                            return True
-
-                msg = f"An error occoured while uploading {url}"
+        parts_url = server + "/"
+        for part in remotepath.split("/")[:-1]:
+            parts_url += part + "/"
+            if directories is not None and parts_url in directories:
+                continue
+            response = self.sdk.session.request("MKCOL", parts_url, auth=auth)
+            if response.status_code not in (405, 200, 201, 204):
+                msg = f"An error occoured while creating directory {parts_url}"
                 raise AnaliticoException(msg, status_code=response.status_code)
+            if directories is not None:
+                directories.add(parts_url)
+
+    def _upload_directly_to_storage(
+        self, source=None, remotepath: str = None, storage: tuple = None, directories: set = None
+    ) -> bool:
+        """
+        Upload a file (or bytes) directly to storage using webdav. This puts less load on the server
+        for larger uploads but has a few drawbacks including not generating automatic triggers
+        on the service, notifications, etc. When uploading many files the storage's (server, auth)
+        and the set of directories already created can be passed in to avoid repeating calls.
+        Files larger than the sdk's http_upload_chunk_size are uploaded in resumable chunks, or with
+        a single PUT like smaller files if storage can't write chunks.
+        """
+        server, auth = storage if storage else self._get_storage()
+        if server:
+            remotepath = f"{self.type}s/{self.id}/{remotepath}"
+            url = f"{server}/{remotepath}"
+
+            # make sure the containing directory exists before sending the file's contents
+            self._make_storage_directories(server, auth, remotepath, directories)
+
+            chunk_size = size_to_bytes(self.sdk.get_attribute("http_upload_chunk_size") or HTTP_UPLOAD_CHUNK_SIZE)
+            if _get_source_size(source) > chunk_size and self._upload_chunks_to_storage(source, url, auth, chunk_size):
+                return True
+
+            with _open_source(source) as f:
+                response = self.sdk.session.put(url, data=f, auth=auth)
+                if response.status_code in (200, 201, 204):
+                    return True
+
+            msg = f"An error occoured while uploading {url}"
+            raise AnaliticoException(msg, status_code=response.status_code)
         return False
 
+    def _upload_chunks_to_storage(self, source, url: str, auth, chunk_size: int) -> bool:
+        """
+        Uploads a large file (or bytes) to webdav storage in chunks using PUT with Content-Range into a
+        temporary file which is then moved to its final url. The name of the temporary file depends on the
+        local file's name, size and modification time (or on the contents of bytes) so if the upload is
+        interrupted (or the call is repeated) it resumes from the bytes that are already on storage.
+        The size on storage is checked once, after the first chunk written past the start of the file
+        (the first chunk looks the same either way), to detect servers that ignore Content-Range. Returns
+        False without sending the rest of the file if storage ignores or rejects chunks, so the caller
+        can upload the file with a single PUT instead.
+        """
+        total = _get_source_size(source)
+        if isinstance(source, str):
+            upload_id = f"{os.path.abspath(source)}:{total}:{os.path.getmtime(source)}".encode()
+        else:
+            upload_id = source
+        upload_id = hashlib.sha256(upload_id).hexdigest()[:16]
+        temp_url = f"{url}.upload_{upload_id}"
+
+        def get_uploaded():
+            """ Number of bytes of the temporary file already on storage """
+            response = self.sdk.session.head(temp_url, auth=auth)
+            return int(response.headers.get("content-length", 0)) if response.status_code == 200 else 0
+
+        offset = min(get_uploaded(), total)
+        if offset:
+            logger.info(f"upload - resuming upload of {url} from byte {offset} of {total}")
+
+        attempt = 0
+        verified = False
+        with _open_source(source) as f:
+            while offset < total:
+                try:
+                    f.seek(offset)
+                    chunk = f.read(chunk_size)
+                    headers = {"Content-Range": f"bytes {offset}-{offset + len(chunk) - 1}/{total}"}
+                    response = self.sdk.session.put(temp_url, data=chunk, headers=headers, auth=auth)
+                    if response.status_code not in (200, 201, 204):
+                        logger.warning(f"upload - storage rejected chunk of {temp_url}, status: {response.status_code}")
+                        self.sdk.session.delete(temp_url, auth=auth)
+                        return False
+                    offset += len(chunk)
+                    attempt = 0
+
+                    # servers that ignore Content-Range overwrite the file with each chunk instead of
+                    # appending to it, check what storage holds once before sending the rest
+                    if not verified and offset > len(chunk):
+                        uploaded = get_uploaded()
+                        if uploaded != offset:
+                            logger.warning(f"upload - storage ignored Content-Range, {temp_url} has {uploaded} bytes")
+                            self.sdk.session.delete(temp_url, auth=auth)
+                            return False
+                        verified = True
+                except requests.RequestException as exc:
+                    # connection dropped, resume from what storage has actually received
+                    if attempt == HTTP_RETRIES:
+                        raise
+                    logger.warning(f"upload - chunk of {temp_url} failed, will resume, exc: {exc}")
+                    time.sleep(HTTP_BACKOFF_FACTOR * (2 ** attempt))
+                    attempt += 1
+                    offset = min(get_uploaded(), offset)
+
+        response = self.sdk.session.request("MOVE", temp_url, headers={"Destination": url, "Overwrite": "T"}, auth=auth)
+        if response.status_code not in (200, 201, 204):
+            msg = f"An error occoured while moving {temp_url} to {url}"
+            raise AnaliticoException(msg, status_code=response.status_code)
+        return True
+
+    def _upload_file(
+        self, source, remotepath: str, direct: bool = True, storage: tuple = None, directories: set = None
+    ) -> bool:
+        """ Upload a single file (filepath or bytes) directly to storage if possible or via /files APIs otherwise """
+        # no absolute paths
+        assert not remotepath.startswith("/"), "remotepath should be relative, eg: flower.jpg or flowers/flower.jpg"
+
+        if direct:
+            try:
+                # see if we can upload directly to storage
+                if self._upload_directly_to_storage(source, remotepath, storage=storage, directories=directories):
+                    return True
+            except AnaliticoException as exc:
+                logger.error(f"upload - direct to storage failed, will try via /files APIs, exc: {exc}")
+
+        url = self.url + "/files/" + remotepath
+        url, headers = self.sdk.get_url_headers(url)
+
+        with _open_source(source) as f:
+            # multipart encoded upload
+            response = self.sdk.session.put(url, files={"file": (Path(remotepath).name, f)}, headers=headers)
+
+            # raw upload
+            # response = requests.put(url, data=f, headers=headers)
+
+            if response.status_code not in (200, 204):
+                msg = f"Could not upload {remotepath} to {url}, status: {response.status_code}"
+                raise AnaliticoException(msg, status_code=response.status_code)
+            return True
+
+    def _transfer_many(self, action: str, transfer, filepaths: dict, max_workers: int = None):
+        """
+        Calls transfer(filepath, remotepath) for each item in the filepaths dictionary concurrently
+        using a bounded pool of workers. Each transfer is retried with exponential backoff if it fails
+        with a network error or a transient server error. Logs the aggregate throughput when done.
+        """
+
+        def transfer_with_retries(filepath, remotepath):
+            for attempt in range(HTTP_RETRIES + 1):
+                try:
+                    return transfer(filepath, remotepath)
+                except (requests.RequestException, AnaliticoException) as exc:
+                    status_code = getattr(exc, "status_code", None)
+                    if attempt == HTTP_RETRIES or (status_code and status_code not in HTTP_RETRY_STATUSES):
+                        raise
+                    logger.warning(f"{action} - {remotepath} failed, will retry, exc: {exc}")
+                    time.sleep(HTTP_BACKOFF_FACTOR * (2 ** attempt))
+
+        started_on = time.time()
+        max_workers = max_workers if max_workers else self.sdk.get_attribute("http_pool_size", HTTP_POOL_SIZE)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(transfer_with_retries, fp, rp) for fp, rp in filepaths.items()]
+            for future in concurrent.futures.as_completed(futures):
+                future.result()  # raises if a transfer failed
+
+        elapsed = max(time.time() - started_on, 0.001)
+        size_mb = sum(os.path.getsize(filepath) for filepath in filepaths) / MB_SIZE
+        throughput = size_mb / elapsed
+        logger.info(f"{action} - {len(filepaths)} files, {size_mb:.1f} MB in {elapsed:.1f}s, {throughput:.1f} MB/s")
+
     ##
     ## Methods
     ##
 
     def upload(
-        self, filepath: str = None, df: pd.DataFrame = None, remotepath: str = None, direct: bool = True
+        self,
+        filepath: str = None,
+        df: pd.DataFrame = None,
+        remotepath: str = None,
+        direct: bool = True,
+        directory: str = None,
+        pattern: str = "**/*",
+        max_workers: int = None,
+        compression: str = "snappy",
+        row_group_size: int = None,
     ) -> bool:
         """
         Upload a file to the storage drive associated with this item. You can upload a file by indicating its
-        filepath on the local disk or by handing a Pandas dataframe which is automatically saved to a file and
-        then uploaded.
+        filepath on the local disk or by handing a Pandas dataframe which is automatically encoded in memory
+        and then uploaded. You can also upload all the files in a directory which are transferred concurrently.
         
         Keyword Arguments:
             filepath {str} -- Local filepath (or None if passing a dataframe)
             df {pd.DataFrame} -- A dataframe that should be saved and uploaded (or None if passing a filepath)
             remotepath {str} -- Path on remote driver, eg: file.txt, datasets/customers.csv, etc...
             direct {bool} -- False if loaded via analitico APIs, true if loaded directly to storage.
+            directory {str} -- Local directory whose files should be uploaded (remotepath is used as a prefix).
+            pattern {str} -- Glob pattern of files to be uploaded from directory (default: all files).
+            max_workers {int} -- Maximum number of concurrent uploads (default: size of the sdk's connection pool).
+            compression {str} -- Compression used for parquet dataframes, eg: snappy, gzip, brotli or None.
+            row_group_size {int} -- Number of rows in each row group of parquet dataframes (default: all rows).
         
         Returns:
             bool -- True if the file was uploaded or an Exception explaining the problem.
         """
+        if self.sdk.is_async:
+            return self.sdk.upload(
+                self,
+                filepath=filepath,
+                df=df,
+                remotepath=remotepath,
+                direct=direct,
+                directory=directory,
+                pattern=pattern,
+                max_workers=max_workers,
+                compression=compression,
+                row_group_size=row_group_size,
+            )
+
         if isinstance(df, pd.DataFrame):
             if not remotepath:
                 remotepath = filepath if filepath else "data.parquet"
 
-            # encode dataframe to disk temporarily
-            suffix = Path(remotepath).suffix
-            with tempfile.NamedTemporaryFile(mode="w+", prefix="df_", suffix=suffix) as f:
-                if suffix in PARQUET_SUFFIXES:
-                    df.to_parquet(f.name)
-                elif suffix in CSV_SUFFIXES:
-                    df.to_csv(f.name)
-                else:
-                    msg = f"{remotepath} is not in a supported format."
-                    raise AnaliticoException(msg, status_code=400)
-                return self.upload(filepath=f.name, remotepath=remotepath)
+            # encode dataframe in memory and upload it from there
+            data = pd_to_bytes(df, Path(remotepath).suffix, compression=compression, row_group_size=row_group_size)
+            return self._upload_file(data, remotepath, direct=direct)
 
         # uploading a single file?
-        if os.path.isfile(filepath):
+        if filepath and os.path.isfile(filepath):
             if not remotepath:
                 remotepath = Path(filepath).name
+            return self._upload_file(filepath, remotepath, direct=direct)
+
+        # uploading all files in a directory?
+        if directory and os.path.isdir(directory):
+            prefix = remotepath.strip("/") + "/" if remotepath else ""
+            filepaths = OrderedDict()
+            for path in sorted(Path(directory).glob(pattern)):
+                if path.is_file():
+                    filepaths[str(path)] = prefix + path.relative_to(directory).as_posix()
+            if not filepaths:
+                return True
 
-            # no absolute paths
-            assert not remotepath.startswith("/"), "remotepath should be relative, eg: flower.jpg or flowers/flower.jpg"
-
+            storage, directories = None, None
             if direct:
+                # create each directory on storage once, before uploading files concurrently
                 try:
-                    # see if we can upload directly to storage
-                    if self._upload_directly_to_storage(filepath, remotepath):
-                        return True
+                    server, auth = self._get_storage()
+                    if server:
+                        storage, directories = (server, auth), set()
+                        for path in filepaths.values():
+                            self._make_storage_directories(server, auth, f"{self.type}s/{self.id}/{path}", directories)
                 except AnaliticoException as exc:
-                    logger.error(f"upload - direct to storage failed, will try via /files APIs, exc: {exc}")
-
-            url = self.url + "/files/" + remotepath
-            url, headers = self.sdk.get_url_headers(url)
+                    logger.error(f"upload - creating directories on storage failed, will use /files APIs, exc: {exc}")
+                    direct = False
 
-            with open(filepath, "rb") as f:
-                # multipart encoded upload
-                response = requests.put(url, files={"file": f}, headers=headers)
+            def upload_file(filepath, remotepath):
+                return self._upload_file(filepath, remotepath, direct, storage=storage, directories=directories)
 
-                # raw upload
-                # response = requests.put(url, data=f, headers=headers)
+            self._transfer_many("upload", upload_file, filepaths, max_workers)
+            return True
 
-                if response.status_code not in (200, 204):
-                    msg = f"Could not upload {filepath} to {url}, status: {response.status_code}"
-                    raise AnaliticoException(msg, status_code=response.status_code)
-                return True
-
-        raise NotImplementedError("Uploading multiple files at once is not yet implemented.")
+        raise AnaliticoException(f"upload - {filepath or directory} could not be found.", status_code=404)
 
     def download(
-        self, remotepath: str, filepath: str = None, stream: bool = False, binary: bool = True, df: str = None
+        self,
+        remotepath: str,
+        filepath: str = None,
+        stream: bool = False,
+        binary: bool = True,
+        df: str = None,
+        offset: int = None,
+        length: int = None,
+        columns: [str] = None,
     ):
         """
         Downloads the file asset associated with this item to a file, stream or dataframe.
@@ -195,14 +400,44 @@ class Item(AttributeMixin):
             stream {bool} -- True if file should be returned as a stream.
             df {bool} -- True if file should be returned as pandas dataframe.
             binary {bool} -- True for binary downloads, false for text. (default: {True})
+            offset {int} -- Download only the part of the file starting at this byte (default: {None})
+            length {int} -- Download only this number of bytes (default: {None})
+            columns {[str]} -- Read only these columns when downloading a dataframe (default: all columns)
 
         Returns:
             The download stream or dataframe or nothing if saved to file.
         """
+        if self.sdk.is_async:
+            return self.sdk.download(
+                self,
+                remotepath,
+                filepath=filepath,
+                stream=stream,
+                binary=binary,
+                df=df,
+                offset=offset,
+                length=length,
+                columns=columns,
+            )
+
         url = self.url + "/files/" + remotepath
-        url_stream = self.sdk.get_url_stream(url, binary=binary)
         # TODO if we're running serverless or in jupyter the assets may already be on a locally mounted drive (optimize)
 
+        if df and not filepath:
+            suffix = Path(remotepath).suffix
+            if suffix in CSV_SUFFIXES:
+                # parse csv incrementally as it streams in (and is copied into the cache)
+                url_stream = self.sdk.get_url_stream(url, binary=binary)
+                with io.BufferedReader(IterableStream(url_stream), HTTP_STREAM_BUFFER_SIZE) as f:
+                    return pd_read_csv(f, usecols=columns)
+            elif suffix in PARQUET_SUFFIXES:
+                # parquet needs random access, read it from the cached file (memory mapped) or from memory
+                return pd.read_parquet(self.sdk.get_url_buffer(url), columns=columns, memory_map=True)
+            else:
+                msg = f"Can't read {df} to a pandas dataframe, please load .csv or .parquet files."
+                raise AnaliticoException(msg, status_code=400)
+
+        url_stream = self.sdk.get_url_stream(url, binary=binary, offset=offset, length=length)
         if stream:
             return url_stream
 
@@ -210,22 +445,69 @@ class Item(AttributeMixin):
             with open(filepath, "w+b") as f:
                 for chunk in iter(url_stream):
                     f.write(chunk)
-
-        if df:
-            suffix = Path(remotepath).suffix
-            with tempfile.NamedTemporaryFile(prefix="df_", suffix=suffix) as f:
-                for chunk in iter(url_stream):
-                    f.write(chunk)
+            if df:
+                suffix = Path(remotepath).suffix
                 if suffix in CSV_SUFFIXES:
-                    return pd_read_csv(f.name)
+                    return pd_read_csv(filepath, usecols=columns)
                 elif suffix in PARQUET_SUFFIXES:
-                    return pd.read_parquet(f.name)
+                    return pd.read_parquet(filepath, columns=columns)
                 else:
                     msg = f"Can't read {df} to a pandas dataframe, please load .csv or .parquet files."
                     raise AnaliticoException(msg, status_code=400)
 
+    def open(self, remotepath: str, buffer_size: int = HTTP_STREAM_BUFFER_SIZE):
+        """
+        Opens the file asset associated with this item as a seekable read-only file whose contents
+        are read on demand with range requests. Only the parts of the file that are actually read
+        are downloaded, eg: pd.read_parquet(item.open("data.parquet"), columns=["a"]) reads the
+        footer and a single column, pd_read_csv(item.open("data.csv"), nrows=100) stops after a
+        few blocks.
+
+        Arguments:
+            remotepath {str} -- The path of the file asset, eg. data.parquet
+
+        Keyword Arguments:
+            buffer_size {int} -- Size of blocks that are read ahead (default: 1 MB)
+
+        Returns:
+            A file-like object that can be read and seeked.
+        """
+        return self.sdk.open_url(self.url + "/files/" + remotepath, buffer_size=buffer_size)
+
+    def download_many(self, remotepaths: [str], directory: str, binary: bool = True, max_workers: int = None) -> [str]:
+        """
+        Downloads multiple file assets associated with this item to a local directory concurrently.
+
+        Arguments:
+            remotepaths {[str]} -- The paths of the file assets, eg. ["data.csv", "model/model.cbm"]
+            directory {str} -- Local directory where the files are saved using the same relative paths
+
+        Keyword Arguments:
+            binary {bool} -- True for binary downloads, false for text. (default: {True})
+            max_workers {int} -- Maximum number of concurrent downloads (default: size of the sdk's connection pool).
+
+        Returns:
+            [str] -- The paths of the downloaded files.
+        """
+        if self.sdk.is_async:
+            return self.sdk.download_many(self, remotepaths, directory, binary=binary, max_workers=max_workers)
+
+        filepaths = OrderedDict()
+        for remotepath in remotepaths:
+            filepath = os.path.join(directory, *remotepath.strip("/").split("/"))
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            filepaths[filepath] = remotepath
+
+        def download_file(filepath, remotepath):
+            self.download(remotepath, filepath=filepath, binary=binary)
+
+        self._transfer_many("download_many", download_file, filepaths, max_workers)
+        return list(filepaths.keys())
+
     def save(self) -> bool:
         """ Save any changes to the service. """
+        if self.sdk.is_async:
+            return self.sdk.save(self)
         json = self.sdk.get_url_json(self.url, method="PUT", json=self.to_dict(), status_code=200)
         self.attributes = json["data"]["attributes"]
         return True
@@ -237,6 +519,8 @@ class Item(AttributeMixin):
         Returns:
             bool -- True if item was deleted.
         """
+        if self.sdk.is_async:
+            return self.sdk.delete(self)
         self.sdk.get_url_json(self.url, method="DELETE", status_code=204)
         return True
 
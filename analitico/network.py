@@ -0,0 +1,62 @@
+""" Http sessions shared by sdks, factories and items to make calls to the service and its storage """
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# number of keep-alive connections kept open for each host
+HTTP_POOL_SIZE = 16
+
+# number of times a failed call is retried (connection errors and statuses below)
+HTTP_RETRIES = 3
+
+# retries wait backoff_factor * (2 ** (retry - 1)) seconds, eg: 0.5, 1, 2...
+HTTP_BACKOFF_FACTOR = 0.5
+
+# response statuses that are retried (too many requests and transient server errors)
+HTTP_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# methods which can be safely retried
+HTTP_IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS", "TRACE")
+
+# files larger than this are uploaded to storage in resumable chunks of this size
+HTTP_UPLOAD_CHUNK_SIZE = "32Mi"
+
+# default timeouts in seconds for connecting and for reading from the server
+HTTP_TIMEOUT = (10, 300)
+
+
+class HttpSession(requests.Session):
+    """
+    A requests session with a pool of keep-alive connections that are reused across calls,
+    retries with exponential backoff on connection errors and on 429/5xx responses and
+    default timeouts. Retries are only made for idempotent methods (GET, PUT, DELETE, etc).
+    """
+
+    def __init__(
+        self,
+        pool_size: int = HTTP_POOL_SIZE,
+        retries: int = HTTP_RETRIES,
+        backoff_factor: float = HTTP_BACKOFF_FACTOR,
+        timeout=HTTP_TIMEOUT,
+    ):
+        super().__init__()
+        self.timeout = timeout
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=HTTP_RETRY_STATUSES,
+            allowed_methods=HTTP_IDEMPOTENT_METHODS,
+            raise_on_status=False,
+            respect_retry_after_header=True,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    def request(self, method, url, **kwargs):
+        """ Makes a request using the session's default timeout unless a timeout is specified for the call """
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().request(method, url, **kwargs)
@@ -1,14 +1,25 @@
+import io
+import numpy as np
 import pandas as pd
 import json
 import dateutil
 from io import StringIO
 
+try:
+    import pyarrow
+    import pyarrow.csv
+    import pyarrow.feather
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None  # optional package, pyarrow engine falls back to pandas
+
 import analitico
 import analitico.schema
 import analitico.utilities
 
 from analitico import AnaliticoException, logger
 from analitico.schema import analitico_to_pandas_type, NA_VALUES
+from analitico.constants import CSV_SUFFIXES, PARQUET_SUFFIXES, FEATHER_SUFFIXES
 
 ##
 ## Pandas utilities
@@ -158,27 +169,168 @@ def pd_columns_to_string(df):
     return columns[:-2]
 
 
-def pd_read_csv(filepath_or_buffer, schema=None, skiprows=None, nrows=None):
-    """ Read csv file from file or stream and apply optional schema """
+# number of rows read at a time when reading csv files in chunks
+PD_CSV_CHUNKSIZE = 250000
+
+
+def _pd_csv_dtype(schema) -> dict:
+    """ Returns the dtype of each column to be used when reading a csv with the given schema (or None) """
+    columns = schema.get("columns") if schema else None
+    if not columns:
+        return None
+    dtype = {}
+    for column in columns:
+        if "type" in column:  # type is optionally defined
+            if column["type"] == "datetime":
+                dtype[column["name"]] = "object"
+            elif column["type"] == "timespan":
+                dtype[column["name"]] = "object"
+            elif column["type"] == "integer":
+                pass  # do not cast so we can deal with nulls later
+            else:
+                dtype[column["name"]] = analitico_to_pandas_type(column["type"])
+    return dtype
+
+
+def pd_read_csv_chunks(
+    filepath_or_buffer, schema=None, chunksize: int = PD_CSV_CHUNKSIZE, skiprows=None, nrows=None, usecols=None
+):
+    """
+    Reads a csv file from file or stream in chunks of rows and yields each chunk with the optional schema
+    already applied, so only one chunk of raw values is held in memory at a time. Categorical columns are
+    unified across chunks: the categories of each chunk are those of the previous chunks followed by any
+    new values found in the chunk, so chunks can be concatenated without losing their categorical dtype.
+    """
+    dtype = _pd_csv_dtype(schema)
+    plan = analitico.schema.compile_schema(schema) if schema else None
+    categories = {}
     try:
-        dtype = None
+        reader = pd.read_csv(
+            filepath_or_buffer,
+            dtype=dtype,
+            encoding="utf-8",
+            na_values=NA_VALUES,
+            skiprows=skiprows,
+            nrows=nrows,
+            usecols=usecols,
+            chunksize=chunksize,
+        )
+        for chunk in reader:
+            if plan:
+                # reorder, filter, apply types, rename columns as requested in schema
+                chunk = plan.apply(chunk)
+            for column in chunk.columns:
+                if pd.api.types.is_categorical_dtype(chunk[column]):
+                    known = categories.get(column, pd.Index([], dtype=chunk[column].cat.categories.dtype))
+                    known = known.append(chunk[column].cat.categories.difference(known, sort=False))
+                    categories[column] = known
+                    chunk[column] = chunk[column].cat.set_categories(known)
+            yield chunk
 
-        if schema:
-            # array of types for each column in the source
-            columns = schema.get("columns")
-            if columns:
-                dtype = {}
-                for column in columns:
-                    if "type" in column:  # type is optionally defined
-                        if column["type"] == "datetime":
-                            dtype[column["name"]] = "object"
-                        elif column["type"] == "timespan":
-                            dtype[column["name"]] = "object"
-                        elif column["type"] == "integer":
-                            pass  # do not cast so we can deal with nulls later
-                        else:
-                            dtype[column["name"]] = analitico_to_pandas_type(column["type"])
+    except Exception as exc:
+        logger.error(f"Could not read csv file from {filepath_or_buffer}, schema: {schema}, dtype: {dtype}")
+        raise exc
+
+
+# arrow types produced while parsing columns of the given analitico types
+PD_CSV_ARROW_TYPES = {
+    "float": "float64",
+    "string": "string",
+    "boolean": "bool",
+    "category": "category",
+    "datetime": "string",  # parsed with apply_schema like in pandas
+    "timespan": "string",
+}
+
+
+def _pd_read_csv_arrow(filepath_or_buffer, schema=None, usecols=None) -> pd.DataFrame:
+    """
+    Reads csv with pyarrow's multithreaded reader. Types known from the schema are given to the reader
+    so columns are typed as they are parsed (integers are inferred so that nulls can be dealt with later).
+    """
+    column_types = {}
+    for column in schema.get("columns", []) if schema else []:
+        arrow_type = PD_CSV_ARROW_TYPES.get(column.get("type"))
+        if arrow_type == "category":
+            column_types[column["name"]] = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+        elif arrow_type:
+            column_types[column["name"]] = pyarrow.type_for_alias(arrow_type)
+
+    convert_options = pyarrow.csv.ConvertOptions(
+        column_types=column_types, null_values=NA_VALUES, strings_can_be_null=True, include_columns=usecols
+    )
+    read_options = pyarrow.csv.ReadOptions(use_threads=True)
+    table = pyarrow.csv.read_csv(filepath_or_buffer, read_options=read_options, convert_options=convert_options)
+    df = table.to_pandas()
+
+    # missing values and categories like pandas would have them
+    for column in df.columns:
+        if df[column].dtype == object:
+            df[column] = df[column].where(df[column].notna(), np.nan)
+        elif pd.api.types.is_categorical_dtype(df[column]):
+            df[column] = df[column].cat.reorder_categories(sorted(df[column].cat.categories))
+    return df
 
+
+def _pd_empty_csv(schema=None, usecols=None) -> pd.DataFrame:
+    """ Returns an empty dataframe with the columns and types of the given schema (or the given columns) """
+    columns = [column["name"] for column in schema.get("columns", [])] if schema else []
+    if usecols is not None:
+        columns = [column for column in columns if column in usecols] if columns else list(usecols)
+    df = pd.DataFrame(columns=columns)
+    return analitico.schema.apply_schema(df, schema) if schema else df
+
+
+def pd_read_csv(
+    filepath_or_buffer, schema=None, skiprows=None, nrows=None, usecols=None, chunksize: int = None, engine: str = None
+):
+    """
+    Read csv file from file or stream and apply optional schema, optionally reads only the given columns.
+    If a chunksize is given, the file is read and typed in chunks of rows which are then concatenated,
+    which uses much less memory than reading all the raw values first and then applying the schema.
+    Typed chunks are kept until they are concatenated so memory peaks at about twice the size of the
+    resulting dataframe (concatenating incrementally would copy the growing dataframe with each chunk
+    and peak just the same), categorical columns are unified as chunks are read so they stay compact.
+    With engine="pyarrow" the file is parsed by multiple threads and columns are typed while parsed
+    (chunksize is not needed), falls back to pandas if pyarrow is not available or cannot read the file.
+    """
+    if engine == "pyarrow":
+        binary = not isinstance(filepath_or_buffer, io.TextIOBase)
+        if pyarrow and binary and not (skiprows or nrows):
+            seekable = isinstance(filepath_or_buffer, str) or filepath_or_buffer.seekable()
+            try:
+                df = _pd_read_csv_arrow(filepath_or_buffer, schema, usecols)
+                return analitico.schema.apply_schema(df, schema) if schema else df
+            except (pyarrow.ArrowException, NotImplementedError) as exc:
+                if not seekable:
+                    raise
+                logger.warning(f"pd_read_csv - pyarrow could not read {filepath_or_buffer}, using pandas, exc: {exc}")
+                if not isinstance(filepath_or_buffer, str):
+                    filepath_or_buffer.seek(0)
+        else:
+            logger.info("pd_read_csv - pyarrow engine is not available for this source, will use pandas")
+
+    if chunksize:
+        chunks = list(pd_read_csv_chunks(filepath_or_buffer, schema, chunksize, skiprows, nrows, usecols))
+        if not chunks:
+            # no rows were read (eg. nrows=0) and a stream can't be read again
+            return _pd_empty_csv(schema, usecols)
+        # give all chunks the same categories, sorted like they would be if read in a single pass
+        for column in chunks[-1].columns:
+            if pd.api.types.is_categorical_dtype(chunks[-1][column]):
+                known = chunks[-1][column].cat.categories
+                try:
+                    known = known.sort_values()
+                except TypeError:
+                    pass  # mixed types are left in order of appearance
+                for chunk in chunks:
+                    chunk[column] = chunk[column].cat.set_categories(known)
+        df = pd.concat(chunks, copy=False)
+        del chunks
+        return df
+
+    dtype = _pd_csv_dtype(schema)
+    try:
         # read csv from file or stream
         df = pd.read_csv(
             filepath_or_buffer,
@@ -188,6 +340,7 @@ def pd_read_csv(filepath_or_buffer, schema=None, skiprows=None, nrows=None):
             low_memory=False,
             skiprows=skiprows,
             nrows=nrows,
+            usecols=usecols,
         )
 
         if schema:
@@ -215,6 +368,76 @@ def pd_to_csv(df: pd.DataFrame, filename, schema=False, samples=0):
         samples.to_csv(samplesname, encoding="utf-8")
 
 
+# key under which a dataframe's analitico schema is embedded in parquet and feather metadata
+PD_SCHEMA_METADATA_KEY = b"analitico.schema"
+
+
+def _pd_to_arrow_table(df: pd.DataFrame, schema: dict = None, index: bool = None):
+    """ Converts a dataframe to an arrow table with its analitico schema embedded in the table's metadata """
+    if pyarrow is None:
+        raise AnaliticoException("pyarrow is required to write parquet and feather files", status_code=501)
+    table = pyarrow.Table.from_pandas(df, preserve_index=index)
+    metadata = dict(table.schema.metadata or {})
+    metadata[PD_SCHEMA_METADATA_KEY] = json.dumps(schema or analitico.schema.generate_schema(df)).encode("utf-8")
+    return table.replace_schema_metadata(metadata)
+
+
+def pd_to_parquet(
+    df: pd.DataFrame,
+    filepath_or_buffer,
+    schema: dict = None,
+    compression: str = "snappy",
+    row_group_size: int = None,
+    index: bool = None,
+):
+    """
+    Writes a dataframe as parquet with its schema embedded in the file's metadata. Columns keep
+    their types (categories, datetimes, etc) so the file can be read back without any parsing.
+    Smaller row groups let readers skip data they don't need at the cost of a slightly larger file.
+    """
+    table = _pd_to_arrow_table(df, schema, index)
+    pyarrow.parquet.write_table(table, filepath_or_buffer, compression=compression, row_group_size=row_group_size)
+
+
+def pd_to_feather(df: pd.DataFrame, filepath_or_buffer, schema: dict = None, compression: str = None, index=None):
+    """
+    Writes a dataframe in feather (Arrow IPC) format with its schema embedded in the file's metadata.
+    Uncompressed files can be memory mapped by readers, eg. pyarrow.feather.read_feather(path, memory_map=True).
+    """
+    table = _pd_to_arrow_table(df, schema, index)
+    pyarrow.feather.write_feather(table, filepath_or_buffer, compression=compression or "uncompressed")
+
+
+def pd_read_schema(filepath: str) -> dict:
+    """ Returns the analitico schema embedded in a parquet or feather file's metadata, or None if not found """
+    if pyarrow is None:
+        return None
+    if filepath.endswith(PARQUET_SUFFIXES):
+        metadata = pyarrow.parquet.read_schema(filepath).metadata
+    elif filepath.endswith(FEATHER_SUFFIXES):
+        with pyarrow.memory_map(filepath) as source:
+            metadata = pyarrow.ipc.open_file(source).schema.metadata
+    else:
+        return None
+    if metadata and PD_SCHEMA_METADATA_KEY in metadata:
+        return json.loads(metadata[PD_SCHEMA_METADATA_KEY].decode("utf-8"))
+    return None
+
+
+def pd_to_bytes(df: pd.DataFrame, suffix: str, compression: str = "snappy", row_group_size: int = None) -> bytes:
+    """ Encodes a dataframe as parquet, feather or csv (based on the file suffix) in memory """
+    with io.BytesIO() as buffer:
+        if suffix in PARQUET_SUFFIXES:
+            pd_to_parquet(df, buffer, compression=compression, row_group_size=row_group_size)
+        elif suffix in FEATHER_SUFFIXES:
+            pd_to_feather(df, buffer)
+        elif suffix in CSV_SUFFIXES:
+            buffer.write(df.to_csv().encode("utf-8"))
+        else:
+            raise AnaliticoException(f"{suffix} is not a supported format.", status_code=400)
+        return buffer.getvalue()
+
+
 def pd_drop_column(df, column, inplace=False):
     """ Drops a column, no exceptions if it's not there """
     try:
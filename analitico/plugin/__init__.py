@@ -15,6 +15,7 @@ from .transformdataframeplugin import TransformDataframePlugin
 from .catboostplugin import CatBoostPlugin
 from .catboostplugin import CatBoostRegressorPlugin
 from .catboostplugin import CatBoostClassifierPlugin
+from .catboosttunerplugin import CatBoostTunerPlugin
 
 # plugin workflows
 from .pipelineplugin import PipelinePlugin
@@ -31,6 +32,7 @@ TRANSFORM_DATAFRAME_PLUGIN = TransformDataframePlugin.Meta.name
 CATBOOST_PLUGIN = CatBoostPlugin.Meta.name
 CATBOOST_REGRESSOR_PLUGIN = CatBoostRegressorPlugin.Meta.name
 CATBOOST_CLASSIFIER_PLUGIN = CatBoostClassifierPlugin.Meta.name
+CATBOOST_TUNER_PLUGIN = CatBoostTunerPlugin.Meta.name
 PIPELINE_PLUGIN = PipelinePlugin.Meta.name
 DATAFRAME_PIPELINE_PLUGIN = DataframePipelinePlugin.Meta.name
 RECIPE_PIPELINE_PLUGIN = RecipePipelinePlugin.Meta.name
@@ -2,7 +2,9 @@
 
 import pandas as pd
 import numpy as np
+import os
 import os.path
+import hashlib
 
 import sklearn.metrics
 from sklearn.model_selection import train_test_split
@@ -20,7 +22,8 @@ from sklearn.metrics import (
 import catboost
 from catboost import CatBoostClassifier, CatBoostRegressor
 
-from analitico.utilities import time_ms
+from analitico.utilities import time_ms, size_to_bytes, get_cpu_limit, get_memory_limit
+from analitico.cache import model_cache
 
 import analitico.pandas
 import analitico.schema
@@ -34,6 +37,25 @@ from .interfaces import (
     ALGORITHM_TYPE_MULTICLASS_CLASSIFICATION,
 )
 
+# catboost parameters that can be configured in the recipe's parameters in addition to
+# iterations, learning_rate, depth and the resources (thread_count, used_ram_limit)
+CATBOOST_OPTIONAL_PARAMETERS = (
+    "border_count",
+    "max_ctr_complexity",
+    "early_stopping_rounds",
+    "l2_leaf_reg",
+    "random_strength",
+    "bagging_temperature",
+    "one_hot_max_size",
+    "feature_border_type",
+)
+
+# number of records of training and test data saved as samples unless configured with artifacts.samples
+CATBOOST_SAMPLES = 200
+
+# parameters that change how features are quantized, a pool quantized with different values cannot be reused
+CATBOOST_QUANTIZATION_PARAMETERS = ("border_count", "feature_border_type")
+
 ##
 ## CatBoostPlugin
 ##
@@ -53,6 +75,20 @@ class CatBoostPlugin(IAlgorithmPlugin):
             ALGORITHM_TYPE_MULTICLASS_CLASSIFICATION,
         ]
 
+    def get_resources(self) -> dict:
+        """
+        Returns the catboost parameters that control the resources used for training and predictions.
+        The number of threads defaults to the cpus available to the container (or ANALITICO_CPU_LIMIT)
+        and can be set with parameters.thread_count. The memory catboost tries to stay within is set
+        with parameters.used_ram_limit (eg. 4Gi) and defaults to the container's memory limit if any.
+        """
+        resources = {"thread_count": self.get_attribute("parameters.thread_count", max(1, int(get_cpu_limit())))}
+        used_ram_limit = self.get_attribute("parameters.used_ram_limit")
+        used_ram_limit = size_to_bytes(used_ram_limit) if used_ram_limit else get_memory_limit()
+        if used_ram_limit:
+            resources["used_ram_limit"] = "{}kb".format(used_ram_limit // 1024)
+        return resources
+
     def create_model(self, results):
         """ Creates actual CatBoostClassifier or CatBoostRegressor model """
         iterations = self.get_attribute("parameters.iterations", 50)
@@ -63,28 +99,57 @@ class CatBoostPlugin(IAlgorithmPlugin):
             results["parameters"]["learning_rate"] = learning_rate
             results["parameters"]["depth"] = depth
 
+        # optional parameters are passed to catboost only when configured, training stops
+        # early when the validation score has not improved for early_stopping_rounds iterations
+        params = self.get_resources()
+        for param in CATBOOST_OPTIONAL_PARAMETERS:
+            value = self.get_attribute("parameters." + param)
+            if value is not None:
+                params[param] = value
+        if results:
+            results["parameters"].update(params)
+
         algo = results.get("algorithm", ALGORITHM_TYPE_REGRESSION)
         if algo == ALGORITHM_TYPE_REGRESSION:
-            return CatBoostRegressor(iterations=iterations, learning_rate=learning_rate, depth=depth)
+            return CatBoostRegressor(iterations=iterations, learning_rate=learning_rate, depth=depth, **params)
         elif algo == ALGORITHM_TYPE_BINARY_CLASSICATION:
             # task_type="GPU", # runtime will pick up the GPU even if we don't specify it here
             return CatBoostClassifier(
-                iterations=iterations, learning_rate=learning_rate, depth=depth, loss_function="Logloss"
+                iterations=iterations, learning_rate=learning_rate, depth=depth, loss_function="Logloss", **params
             )
         elif algo == ALGORITHM_TYPE_MULTICLASS_CLASSIFICATION:
             return CatBoostClassifier(
-                iterations=iterations, learning_rate=learning_rate, depth=depth, loss_function="MultiClass"
+                iterations=iterations, learning_rate=learning_rate, depth=depth, loss_function="MultiClass", **params
             )
         else:
             raise PluginError("CatBoostPlugin.create_model - can't handle algorithm type: %s", results["algorithm"])
 
+    def get_fold_metric(self, results) -> str:
+        """ Folds are compared on cv.metric or by default on log loss for classifiers and rmse for regressors """
+        regression = results.get("algorithm", ALGORITHM_TYPE_REGRESSION) == ALGORITHM_TYPE_REGRESSION
+        return self.get_attribute("cv.metric", "sqrt_mean_squared_error" if regression else "log_loss")
+
+    def load_model(self, training, model_path):
+        """ Creates the CatBoostClassifier or CatBoostRegressor model then loads its trained state from file """
+        # training is cached and reused by later predictions, parameters are recorded in a copy
+        model = self.create_model(dict(training, parameters={}))
+        model.load_model(model_path)
+        return model
+
     def get_categorical_idx(self, df):
-        """ Return indexes of the columns that should be considered categorical for the purpose of catboost training """
+        """
+        Return indexes of the columns that should be considered categorical for the purpose of catboost training.
+        Missing values in these columns are replaced in place with an empty string since catboost cannot take NaNs.
+        """
         categorical_idx = []
         for i, column in enumerate(df.columns):
             if analitico.schema.get_column_type(df, column) is analitico.schema.ANALITICO_TYPE_CATEGORY:
                 categorical_idx.append(i)
-                df[column].replace(np.nan, "", regex=True, inplace=True)
+                series = df[column]
+                if series.hasnans:
+                    if "" not in series.cat.categories:
+                        series = series.cat.add_categories("")
+                    df[column] = series.fillna("")
                 self.factory.debug("%3d %s (%s/categorical)", i, column, df[column].dtype.name)
             else:
                 self.factory.debug("%3d %s (%s)", i, column, df[column].dtype.name)
@@ -93,7 +158,7 @@ class CatBoostPlugin(IAlgorithmPlugin):
     def validate_schema(self, train_df, test_df):
         """ Checks training and test dataframes to make sure they have matching schemas """
         train_schema = generate_schema(train_df)
-        if test_df:
+        if test_df is not None:
             test_schema = generate_schema(test_df)
             train_columns = train_schema["columns"]
             test_columns = test_schema["columns"]
@@ -125,7 +190,8 @@ class CatBoostPlugin(IAlgorithmPlugin):
     ):
         """ Scores the results of this training """
         for key, value in model.get_params().items():
-            results["parameters"][key] = value
+            if key != "train_dir":  # where training logs were written is not a parameter of the model
+                results["parameters"][key] = value
 
         results["scores"]["best_iteration"] = model.get_best_iteration()
 
@@ -149,23 +215,38 @@ class CatBoostPlugin(IAlgorithmPlugin):
         # catboost can tell which features weigh more heavily on the predictions
         self.info("features importance:")
         features_importance = results["scores"]["features_importance"] = {}
-        for label, importance in model.get_feature_importance(prettified=True):
+        for label, importance in zip(model.feature_names_, model.get_feature_importance()):
             features_importance[label] = round(importance, 5)
             self.info("%24s: %8.4f", label, importance)
 
         # make the prediction using the resulting model
-        # output test set with predictions
+        # output samples of test set with predictions
         # after moving label to the end for easier reading
-        test_predictions = model.predict(test_pool)
-        label = test_labels.name
-        test_df[label] = test_labels
-        cols = list(test_df.columns.values)
-        cols.pop(cols.index(label))
-        test_df = test_df[cols + [label]]
-        test_df["prediction"] = test_predictions
-        test_df = analitico.pandas.pd_sample(test_df, 200)  # just sampling
+        samples_rows = self.get_samples_rows(len(test_df))
+        if samples_rows is not None:
+            samples_df = test_df.iloc[samples_rows].copy()
+            samples_df[test_labels.name] = test_labels.values[samples_rows]
+            samples_df["prediction"] = model.predict(test_pool.slice(samples_rows.tolist()))
+            background = self.get_attribute("artifacts.background", True)
+            self.factory.write_artifact(self.save_samples, samples_df, ("test.csv",), background=background)
+
+    def get_samples_rows(self, rows: int) -> np.ndarray:
+        """ Returns positions of the rows saved as samples, up to artifacts.samples rows (0 for none) """
+        samples = self.get_attribute("artifacts.samples", CATBOOST_SAMPLES)
+        if not samples:
+            return None
+        return analitico.pandas.pd_sample(pd.Series(np.arange(rows)), samples).values
+
+    def save_samples(self, samples_df: pd.DataFrame, filenames):
+        """ Saves samples of the data for debugging as json records or csv files in the artifacts directory """
         artifacts_path = self.factory.get_artifacts_directory()
-        test_df.to_csv(os.path.join(artifacts_path, "test.csv"))
+        for filename in filenames:
+            samples_path = os.path.join(artifacts_path, filename)
+            if filename.endswith(".json"):
+                samples_df.to_json(samples_path, orient="records")
+            else:
+                samples_df.to_csv(samples_path)
+            self.info("saved: %s (%d bytes)", samples_path, os.path.getsize(samples_path))
 
     def score_regressor_training(self, model, test_df, test_pool, test_labels, results):
         test_preds = model.predict(test_pool)
@@ -221,137 +302,222 @@ class CatBoostPlugin(IAlgorithmPlugin):
         )
         scores["confusion_matrix"] = confusion_matrix(test_true, test_preds).tolist()
 
-    def train(self, train, test, results, *args, **kwargs):
-        """ Train with algorithm and given data to produce a trained model """
-        try:
-            assert isinstance(train, pd.DataFrame) and len(train.columns) > 1
-            train_df = train
-            test_df = test
-
-            # if not specified the prediction target will be the last column of the dataset
-            label = self.get_attribute("data.label")
-            if not label:
-                label = train_df.columns[len(train_df.columns) - 1]
-            results["data"]["label"] = label
-
-            # choose between regression, binary classification and multiclass classification
-            label_type = analitico.schema.get_column_type(train_df, label)
-            self.info("label: %s", label)
-            self.info("label_type: %s", label_type)
-            if label_type == analitico.schema.ANALITICO_TYPE_CATEGORY:
-                label_classes = list(train_df[label].cat.categories)
-                results["data"]["classes"] = label_classes
-                train_df[label] = train_df[label].cat.codes
-                results["algorithm"] = (
-                    ALGORITHM_TYPE_BINARY_CLASSICATION
-                    if len(label_classes) == 2
-                    else ALGORITHM_TYPE_MULTICLASS_CLASSIFICATION
-                )
-                self.info("classes: %s", label_classes)
+    def create_pools(self, train, test, results, cache_pool=True):
+        """
+        Prepares training and test data: picks the label and the algorithm, removes records without
+        a label, splits a test set if one was not provided, drops unsupported columns and saves some
+        samples. Returns the catboost pools for training and test plus the test records and labels.
+        Unless cache_pool is False or data.pool_cache is disabled, the training pool is quantized and
+        cached so that it can be reused by later trainings on the same data.
+        """
+        assert isinstance(train, pd.DataFrame) and len(train.columns) > 1
+
+        # if not specified the prediction target will be the last column of the dataset
+        label = self.get_attribute("data.label")
+        if not label:
+            label = train.columns[len(train.columns) - 1]
+        results["data"]["label"] = label
+
+        # make sure schemas match
+        train_schema = self.validate_schema(train, test)
+
+        # choose between regression, binary classification and multiclass classification
+        label_type = analitico.schema.get_column_type(train, label)
+        self.info("label: %s", label)
+        self.info("label_type: %s", label_type)
+        if label_type == analitico.schema.ANALITICO_TYPE_CATEGORY:
+            label_classes = list(train[label].cat.categories)
+            results["data"]["classes"] = label_classes
+            results["algorithm"] = (
+                ALGORITHM_TYPE_BINARY_CLASSICATION
+                if len(label_classes) == 2
+                else ALGORITHM_TYPE_MULTICLASS_CLASSIFICATION
+            )
+            self.info("classes: %s", label_classes)
+        else:
+            results["algorithm"] = ALGORITHM_TYPE_REGRESSION
+        self.info("algorithm: %s", results["algorithm"])
+
+        # the rows used for training (and testing) are selected as positions and the columns as names,
+        # then the data is copied only once so that wide tables are not copied for each step below
+        train_rows = np.flatnonzero(train[label].notna().values)
+        if len(train_rows) < len(train):
+            self.warning("Training data has %s rows without '%s' label", len(train) - len(train_rows), label)
+        if test is not None:
+            test_rows = np.flatnonzero(test[label].notna().values)
+            if len(test_rows) < len(test):
+                self.warning("Test data has %s rows without '%s' label", len(test) - len(test_rows), label)
+
+        # shortened training was requested?
+        tail = self.get_attribute("parameters.tail", 0)
+        if tail > 0:
+            self.info("Tail: %d, cutting training data", tail)
+            train_rows = train_rows[-tail:]
+
+        # create test set from training set if not provided
+        if test is None:
+            # decide how to create test set from settings variable
+            # https://scikit-learn.org/stable/modules/generated/sklearn.model_selection.TimeSeriesSplit.html
+            chronological = self.get_attribute("data.chronological", False)
+            test_size = self.get_attribute("parameters.test_size", 0.20)
+            results["data"]["chronological"] = chronological
+            results["parameters"]["test_size"] = test_size
+            if chronological:
+                # test set if from the last rows (chronological order)
+                self.info("Test set split: chronological")
+                test_count = int(len(train_rows) * test_size)
+                test_rows = train_rows[-test_count:]
+                train_rows = train_rows[:-test_count]
             else:
-                results["algorithm"] = ALGORITHM_TYPE_REGRESSION
-            self.info("algorithm: %s", results["algorithm"])
-
-            # remove rows with missing label from training and test sets
-            train_rows = len(train_df)
-            train_df = train_df.dropna(subset=[label])
-            if len(train_df) < train_rows:
-                self.warning("Training data has %s rows without '%s' label", train_rows - len(train_df), label)
-            if test_df:
-                test_rows = len(test_df)
-                test_df = test_df.dropna(subset=[label])
-                if len(test_df) < test_rows:
-                    self.warning("Test data has %s rows without '%s' label", test_rows - len(test_df), label)
-
-            # make sure schemas match
-            train_schema = self.validate_schema(train_df, test_df)
-
-            # shortened training was requested?
-            tail = self.get_attribute("parameters.tail", 0)
-            if tail > 0:
-                self.info("Tail: %d, cutting training data", tail)
-                train_df = train_df.tail(tail).copy()
-
-            # create test set from training set if not provided
-            if not test_df:
-                # decide how to create test set from settings variable
-                # https://scikit-learn.org/stable/modules/generated/sklearn.model_selection.TimeSeriesSplit.html
-                chronological = self.get_attribute("data.chronological", False)
-                test_size = self.get_attribute("parameters.test_size", 0.20)
-                results["data"]["chronological"] = chronological
-                results["parameters"]["test_size"] = test_size
-                if chronological:
-                    # test set if from the last rows (chronological order)
-                    self.info("Test set split: chronological")
-                    test_rows = int(len(train_df) * test_size)
-                    test_df = train_df[-test_rows:]
-                    train_df = train_df[:-test_rows]
-                else:
-                    # test set if from a random assortment of rows
-                    self.info("Test set split: random")
-                    train_df, test_df, = train_test_split(train_df, test_size=test_size, random_state=42)
-
-            self.info("training: %d rows", len(train_df))
-            self.info("testing: %d rows", len(test_df))
-
-            # validate data types
-            for column in train_schema["columns"]:
-                if column["type"] not in ("integer", "float", "boolean", "category"):
-                    self.warning(
-                        "Column '%s' of type '%s' is incompatible and will be dropped", column["name"], column["type"]
-                    )
-                    train_df = train_df.drop(column["name"], axis=1)
-                    test_df = test_df.drop(column["name"], axis=1)
-
-            # save schema after dropping unused columns
-            results["data"]["schema"] = generate_schema(train_df)
-            results["data"]["source_records"] = len(train)
-            results["data"]["training_records"] = len(train_df)
-            results["data"]["test_records"] = len(test_df)
-            results["data"]["dropped_records"] = len(train) - len(train_df) - len(test_df)
-
-            # save some training data for debugging
-            artifacts_path = self.factory.get_artifacts_directory()
-            self.info("artifacts_path: %s", artifacts_path)
-
-            samples_df = analitico.pandas.pd_sample(train_df, 200)
-            samples_path = os.path.join(artifacts_path, "training-samples.json")
-            samples_df.to_json(samples_path, orient="records")
-            self.info("saved: %s (%d bytes)", samples_path, os.path.getsize(samples_path))
-            samples_path = os.path.join(artifacts_path, "training-samples.csv")
-            samples_df.to_csv(samples_path)
-            self.info("saved: %s (%d bytes)", samples_path, os.path.getsize(samples_path))
-
-            # split data and labels
-            train_labels = train_df[label]
-            train_df = train_df.drop([label], axis=1)
-            test_labels = test_df[label]
-            test_df = test_df.drop([label], axis=1)
-
-            # indexes of columns that should be considered categorical
-            categorical_idx = self.get_categorical_idx(train_df)
+                # test set if from a random assortment of rows
+                self.info("Test set split: random")
+                train_rows, test_rows = train_test_split(train_rows, test_size=test_size, random_state=42)
+            test = train
+
+        self.info("training: %d rows", len(train_rows))
+        self.info("testing: %d rows", len(test_rows))
+
+        # validate data types
+        columns = []
+        for column in train_schema["columns"]:
+            if column["type"] not in ("integer", "float", "boolean", "category"):
+                self.warning(
+                    "Column '%s' of type '%s' is incompatible and will be dropped", column["name"], column["type"]
+                )
+            elif column["name"] != label:
+                columns.append(column["name"])
+
+        # split data and labels, labels of classifiers are the codes of the classes
+        train_df = train.iloc[train_rows, train.columns.get_indexer(columns)]
+        test_df = test.iloc[test_rows, test.columns.get_indexer(columns)]
+        train_labels = train[label].iloc[train_rows]
+        test_labels = test[label].iloc[test_rows]
+        if results["algorithm"] != ALGORITHM_TYPE_REGRESSION:
+            train_labels = train_labels.cat.codes.rename(label)
+            test_labels = test_labels.cat.codes.rename(label)
+
+        # save schema after dropping unused columns
+        schema = {"columns": []}
+        for column in train_schema["columns"]:
+            if column["name"] in columns:
+                schema["columns"].append(column)
+            elif column["name"] == label:
+                label_type = analitico.schema.pandas_to_analitico_type(train_labels.dtype)
+                schema["columns"].append(dict(column, type=label_type))
+        results["data"]["schema"] = schema
+        results["data"]["source_records"] = len(train)
+        results["data"]["training_records"] = len(train_df)
+        results["data"]["test_records"] = len(test_df)
+        results["data"]["dropped_records"] = len(train) - len(train_df) - len(test_df)
+
+        # save some training data for debugging, in the background while training
+        self.info("artifacts_path: %s", self.factory.get_artifacts_directory())
+        samples_rows = self.get_samples_rows(len(train_df))
+        if samples_rows is not None:
+            samples_df = train_df.iloc[samples_rows].copy()
+            samples_df[label] = train_labels.values[samples_rows]
+            samples_files = ("training-samples.json", "training-samples.csv")
+            background = self.get_attribute("artifacts.background", True)
+            self.factory.write_artifact(self.save_samples, samples_df, samples_files, background=background)
+
+        # indexes of columns that should be considered categorical
+        categorical_idx = self.get_categorical_idx(train_df)
+        self.get_categorical_idx(test_df)
+        pool_on = time_ms()
+        if cache_pool and self.get_attribute("data.pool_cache", True):
+            train_pool = self.get_quantized_pool(train_df, train_labels, categorical_idx, results)
+        else:
             train_pool = catboost.Pool(train_df, train_labels, cat_features=categorical_idx)
-            test_pool = catboost.Pool(test_df, test_labels, cat_features=categorical_idx)
-
-            # create regressor or classificator then train
-            training_on = time_ms()
-            model = self.create_model(results)
-            model.fit(train_pool, eval_set=test_pool)
-            results["performance"]["training_ms"] = time_ms(training_on)
-
-            # score test set, add related metrics to results
-            self.score_training(model, test_df, test_pool, test_labels, results)
-            if results["algorithm"] == ALGORITHM_TYPE_REGRESSION:
-                self.score_regressor_training(model, test_df, test_pool, test_labels, results)
-            else:
-                self.score_classifier_training(model, test_df, test_pool, test_labels, results)
+        test_pool = catboost.Pool(test_df, test_labels, cat_features=categorical_idx)
+        results["performance"]["pool_ms"] = time_ms(pool_on)
+        return train_pool, test_pool, test_df, test_labels
+
+    def get_quantization_params(self) -> dict:
+        """ Returns the configured parameters used to quantize features, catboost defaults are used if missing """
+        params = {}
+        for param in CATBOOST_QUANTIZATION_PARAMETERS:
+            value = self.get_attribute("parameters." + param)
+            if value is not None:
+                params[param] = value
+        return params
+
+    def get_pool_key(self, df: pd.DataFrame, labels: pd.Series, categorical_idx: list) -> str:
+        """ Returns a key identifying a quantized pool from the contents of its data and labels and its settings """
+        key = hashlib.sha256()
+        key.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+        key.update(pd.util.hash_pandas_object(labels, index=False).values.tobytes())
+        settings = {
+            "columns": [(str(column), df[column].dtype.name) for column in df.columns],
+            "label": str(labels.name),
+            "categorical_idx": categorical_idx,
+            "quantization": self.get_quantization_params(),
+            "catboost": catboost.__version__,
+        }
+        key.update(repr(sorted(settings.items())).encode())
+        return key.hexdigest()
+
+    def get_quantized_pool(self, df: pd.DataFrame, labels: pd.Series, categorical_idx: list, results: dict):
+        """
+        Returns a quantized catboost pool for the given data. Quantized pools are saved in the factory's
+        cache directory keyed by a hash of the data, labels, categorical columns and quantization settings
+        so that retraining on the same dataset does not recompute the features' borders each time.
+        """
+        pool_path = self.factory.get_cache_filename("catboost.pool:" + self.get_pool_key(df, labels, categorical_idx))
+        if os.path.isfile(pool_path):
+            try:
+                pool = catboost.Pool("quantized://" + pool_path)
+                self.factory.cache.record_hit(pool_path)
+                results["performance"]["pool_cached"] = True
+                self.info("quantized pool: %s (cached)", pool_path)
+                return pool
+            except Exception as exc:
+                self.warning("quantized pool: %s cannot be loaded, %s", pool_path, str(exc))
+
+        pool = catboost.Pool(df, labels, cat_features=categorical_idx)
+        pool.quantize(**self.get_quantization_params())
+        results["performance"]["pool_cached"] = False
+        try:
+            # saved under a temporary name first so that other processes never load a partial pool
+            temp_path = pool_path + ".tmp_" + str(os.getpid())
+            pool.save(temp_path)
+            os.replace(temp_path, pool_path)
+            self.factory.cache.record_miss(pool_path)
+            self.info("quantized pool: %s (%d bytes)", pool_path, os.path.getsize(pool_path))
+        except Exception as exc:
+            self.warning("quantized pool: %s cannot be saved, %s", pool_path, str(exc))
+        return pool
+
+    def fit_model(self, train_pool, test_pool, test_df, test_labels, results):
+        """ Trains a model on the given pools then scores it and saves it as model.cbm """
+        # create regressor or classificator then train
+        training_on = time_ms()
+        model = self.create_model(results)
+        if model.get_params().get("train_dir") is None:
+            # catboost's training logs are written with the other artifacts rather than in the working directory
+            model.set_params(train_dir=os.path.join(self.factory.get_artifacts_directory(), "catboost_info"))
+        model.fit(train_pool, eval_set=test_pool)
+        results["performance"]["training_ms"] = time_ms(training_on)
+
+        # score test set, add related metrics to results
+        self.score_training(model, test_df, test_pool, test_labels, results)
+        if results["algorithm"] == ALGORITHM_TYPE_REGRESSION:
+            self.score_regressor_training(model, test_df, test_pool, test_labels, results)
+        else:
+            self.score_classifier_training(model, test_df, test_pool, test_labels, results)
 
-            # save model file and training results
-            model_path = os.path.join(artifacts_path, "model.cbm")
-            model.save_model(model_path)
-            results["scores"]["model_size"] = os.path.getsize(model_path)
-            self.info("saved: %s (%d bytes)", model_path, os.path.getsize(model_path))
-            return results
+        # save model file and training results
+        artifacts_path = self.factory.get_artifacts_directory()
+        model_path = os.path.join(artifacts_path, "model.cbm")
+        model.save_model(model_path)
+        results["scores"]["model_size"] = os.path.getsize(model_path)
+        self.info("saved: %s (%d bytes)", model_path, os.path.getsize(model_path))
+        return results
+
+    def train(self, train, test, results, *args, **kwargs):
+        """ Train with algorithm and given data to produce a trained model """
+        try:
+            train_pool, test_pool, test_df, test_labels = self.create_pools(train, test, results)
+            return self.fit_model(train_pool, test_pool, test_df, test_labels, results)
 
         except Exception as exc:
             self.exception("CatBoostPlugin - error while training: %s", str(exc), exception=exc)
@@ -366,9 +532,11 @@ class CatBoostPlugin(IAlgorithmPlugin):
         # record that we're predicting on after augmentation is added
         # to the results. if the endpoint or the jupyter notebook in
         # charge of communicating with the caller does not want to send
-        # this information back, it can always take it out. in the future
-        # we may want to optimized here and add this optionally instead.
-        results["records"] = analitico.pandas.pd_to_dict(data)
+        # this information back, it can turn it off with predict.records
+        # which saves converting all records to json on large batches.
+        # records are never echoed when predicting in batch mode
+        if not kwargs.get("batch", False) and self.get_attribute("predict.records", True):
+            results["records"] = analitico.pandas.pd_to_dict(data)
 
         # initialize data pool to be tested
         categorical_idx = self.get_categorical_idx(data)
@@ -380,37 +548,26 @@ class CatBoostPlugin(IAlgorithmPlugin):
         if not os.path.isfile(model_path):
             self.exception("CatBoostPlugin.predict - cannot find saved model in %s", model_path)
 
-        model = self.create_model(training)
-        model.load_model(model_path)
+        # models are kept in memory so warm endpoints only pay for the predictions
+        model, cached = model_cache.get_model(model_path, lambda path: self.load_model(training, path))
         results["performance"]["loading_ms"] = time_ms(loading_on)
+        results["performance"]["loading_cached"] = cached
 
         algo = training.get("algorithm", ALGORITHM_TYPE_REGRESSION)
         if algo == ALGORITHM_TYPE_REGRESSION:
             y_predictions = model.predict(data_pool)
-            y_predictions = np.around(y_predictions, decimals=3)
-            results["predictions"] = list(y_predictions)
+            results["predictions"] = np.around(y_predictions, decimals=3).tolist()
 
         else:
-            # predict class and probabilities of each class
-            y_predictions = model.predict(
-                data_pool, prediction_type="Class"
-            )  # array di array of 1 element with class index
-            y_probabilities = model.predict(data_pool, prediction_type="Probability")  # array of array of probabilities
+            # a single matrix with the probability of each class for each record (binary classifiers
+            # have two columns), the predicted class is the one with the highest probability
+            y_probabilities = model.predict(data_pool, prediction_type="Probability")
             y_classes = training["data"]["classes"]  # list of possible classes
-
-            preds = results["predictions"] = []
-            probs = results["probabilities"] = []
+            y_predictions = np.argmax(y_probabilities, axis=1)
 
             # create predictions with assigned class and probabilities
-            if algo == ALGORITHM_TYPE_MULTICLASS_CLASSIFICATION:
-                for i in range(0, len(data)):
-                    preds.append(y_classes[int(y_predictions[i][0])])
-                    probs.append({y_classes[j]: y_probabilities[i][j] for j in range(0, len(y_classes))})
-
-            elif algo == ALGORITHM_TYPE_BINARY_CLASSICATION:
-                for i in range(0, len(data)):
-                    preds.append(y_classes[int(y_predictions[i])])
-                    probs.append({y_classes[0]: y_probabilities[i][0], y_classes[1]: y_probabilities[i][1]})
+            results["predictions"] = np.asarray(y_classes, dtype=object)[y_predictions].tolist()
+            results["probabilities"] = [dict(zip(y_classes, row)) for row in y_probabilities.tolist()]
 
         return results
 
@@ -0,0 +1,182 @@
+# Hyperparameter search for CatBoost models with successive halving and parallel trials
+
+import random
+import itertools
+import numpy as np
+import multiprocessing
+import concurrent.futures
+
+from catboost import CatBoostClassifier, CatBoostRegressor
+
+from analitico.utilities import time_ms, get_cpu_limit
+
+from .interfaces import PluginError, plugin, ALGORITHM_TYPE_REGRESSION
+from .catboostplugin import CatBoostPlugin, CATBOOST_OPTIONAL_PARAMETERS, CATBOOST_QUANTIZATION_PARAMETERS
+
+# parameters searched unless configured with tuning.parameters
+CATBOOST_TUNING_PARAMETERS = {"learning_rate": [0.03, 0.1, 0.3], "depth": [4, 6, 8], "l2_leaf_reg": [1, 3, 9]}
+
+# parameters that can be searched
+CATBOOST_TUNABLE_PARAMETERS = ("learning_rate", "depth") + CATBOOST_OPTIONAL_PARAMETERS
+
+# with successive halving only the best 1/factor of the trials continue with factor times more iterations
+CATBOOST_TUNING_HALVING_FACTOR = 3
+
+# share of the training data held out to score trials unless configured with tuning.validation_size
+CATBOOST_TUNING_VALIDATION_SIZE = 0.2
+
+# training and validation pools used by trials, inherited by forked worker processes so they are built only once
+_tuning_pools = None
+
+
+def _run_trial(model_params: dict, classifier: bool) -> dict:
+    """ Trains a model with the given parameters on the tuning pools, returns its best validation score """
+    started_on = time_ms()
+    train_pool, test_pool = _tuning_pools
+    model = CatBoostClassifier(**model_params) if classifier else CatBoostRegressor(**model_params)
+    model.fit(train_pool, eval_set=test_pool)
+
+    # all catboost losses used by the plugin (RMSE, Logloss, MultiClass) are minimized
+    best_score = model.get_best_score()
+    validation = best_score.get("validation", best_score.get("validation_0"))
+    return {
+        "score": validation[model.get_params().get("loss_function", "RMSE")],
+        "best_iteration": model.get_best_iteration(),
+        "elapsed_ms": time_ms(started_on),
+    }
+
+
+##
+## CatBoostTunerPlugin
+##
+
+
+@plugin
+class CatBoostTunerPlugin(CatBoostPlugin):
+    """
+    A CatBoost regressor or classifier whose hyperparameters are searched before training the final model.
+    Candidate values are configured in tuning.parameters, eg: {"depth": [4, 6, 8], "learning_rate": [0.1, 0.3]}
+    and tuning.trials random combinations are tried (all combinations by default). Trials use successive
+    halving: all candidates are trained for tuning.min_iterations, then the best third are trained for three
+    times as many iterations and so on up to tuning.max_iterations (default: parameters.iterations).
+    Trials are scored on tuning.validation_size of the training data (the latest rows if data.chronological)
+    so that the test set is only used to score the final model, which is trained on all the training data with
+    the best parameters found. The pools are built once and shared with tuning.max_workers processes running
+    the trials, each of which uses its share of the available cpus. All trials are recorded in results.tuning.
+    """
+
+    class Meta(CatBoostPlugin.Meta):
+        name = "analitico.plugin.CatBoostTunerPlugin"
+
+    def get_candidates(self) -> list:
+        """ Returns the combinations of parameters that should be tried """
+        search = self.get_attribute("tuning.parameters", CATBOOST_TUNING_PARAMETERS)
+        for param in search:
+            if param not in CATBOOST_TUNABLE_PARAMETERS:
+                raise PluginError(f"CatBoostTunerPlugin - parameter {param} cannot be tuned", plugin=self)
+        names = list(search.keys())
+        candidates = [dict(zip(names, values)) for values in itertools.product(*search.values())]
+
+        trials = self.get_attribute("tuning.trials")
+        if trials and trials < len(candidates):
+            candidates = random.Random(self.get_attribute("tuning.seed", 42)).sample(candidates, trials)
+        return candidates
+
+    def get_validation_pools(self, train_pool, results) -> tuple:
+        """ Splits the training pool into the pools used to train and to score the trials """
+        rows = train_pool.num_row()
+        validation_size = self.get_attribute("tuning.validation_size", CATBOOST_TUNING_VALIDATION_SIZE)
+        validation_count = min(rows - 1, max(1, int(rows * validation_size)))
+        if self.get_attribute("data.chronological", False):
+            validation_rows = np.arange(rows - validation_count, rows)
+        else:
+            random_state = np.random.RandomState(self.get_attribute("tuning.seed", 42))
+            validation_rows = np.sort(random_state.choice(rows, validation_count, replace=False))
+        tuning_rows = np.setdiff1d(np.arange(rows), validation_rows)
+        results["data"]["tuning_records"] = len(tuning_rows)
+        results["data"]["validation_records"] = len(validation_rows)
+        return train_pool.slice(tuning_rows.tolist()), train_pool.slice(validation_rows.tolist())
+
+    def run_trials(self, trials: list, classifier: bool, max_workers: int) -> list:
+        """
+        Runs the trials (each a dictionary of model parameters) in parallel, returns their scores in order.
+        Workers are forked so that they inherit the pools which cannot be pickled. Forking is safe because
+        catboost joins the threads it uses to build pools and fit models before returning so the process
+        holds no catboost threads here (see test_catboost_tuner_no_threads_when_forking).
+        """
+        forkable = "fork" in multiprocessing.get_all_start_methods()
+        if max_workers < 2 or not forkable or multiprocessing.current_process().daemon:
+            return [_run_trial(params, classifier) for params in trials]
+        # no artifacts should be written by another thread while the worker processes are forked
+        self.factory.flush_artifacts()
+        context = multiprocessing.get_context("fork")
+        with concurrent.futures.ProcessPoolExecutor(max_workers, mp_context=context) as pool:
+            return list(pool.map(_run_trial, trials, [classifier] * len(trials)))
+
+    def tune(self, train_pool, validation_pool, results) -> dict:
+        """ Searches for the best parameters using the given pools, records all trials, returns best parameters """
+        global _tuning_pools
+        _tuning_pools = (train_pool, validation_pool)
+        try:
+            candidates = self.get_candidates()
+            classifier = results["algorithm"] != ALGORITHM_TYPE_REGRESSION
+            max_iterations = self.get_attribute("parameters.iterations", 50)
+            max_iterations = self.get_attribute("tuning.max_iterations", max_iterations)
+            factor = self.get_attribute("tuning.halving_factor", CATBOOST_TUNING_HALVING_FACTOR)
+            iterations = self.get_attribute("tuning.min_iterations", max(1, max_iterations // factor ** 2))
+            cpu_count = max(1, int(get_cpu_limit()))
+            max_workers = self.get_attribute("tuning.max_workers", min(cpu_count, len(candidates)))
+
+            # trials share the available cpus and do not write catboost_info files concurrently
+            base_params = self.create_model(results).get_params()
+            if not self.get_attribute("parameters.thread_count"):
+                base_params["thread_count"] = max(1, cpu_count // max_workers)
+            base_params["allow_writing_files"] = False
+            base_params["verbose"] = False
+
+            tuning = results["tuning"] = {"trials": [], "rungs": []}
+            while True:
+                self.info("tuning: %d candidates, %d iterations", len(candidates), iterations)
+                trials = [dict(base_params, iterations=iterations, **candidate) for candidate in candidates]
+                scores = self.run_trials(trials, classifier, max_workers)
+                for candidate, score in zip(candidates, scores):
+                    tuning["trials"].append(dict(score, parameters=candidate, iterations=iterations))
+                    self.info("tuning: %s, score: %f", candidate, score["score"])
+                tuning["rungs"].append({"candidates": len(candidates), "iterations": iterations})
+
+                # keep the best candidates and give them more iterations
+                if len(candidates) <= 1 or iterations >= max_iterations:
+                    break
+                ranked = sorted(zip(candidates, scores), key=lambda trial: trial[1]["score"])
+                candidates = [candidate for candidate, _ in ranked[: max(1, len(candidates) // factor)]]
+                iterations = min(max_iterations, iterations * factor)
+
+            best = min(tuning["trials"][-len(candidates) :], key=lambda trial: trial["score"])
+            tuning["best"] = best
+            self.info("tuning: best parameters %s, score: %f", best["parameters"], best["score"])
+            return best["parameters"]
+        finally:
+            _tuning_pools = None
+
+    def train(self, train, test, results, *args, **kwargs):
+        """ Search parameters then train the final model with the best ones found """
+        try:
+            tuning_on = time_ms()
+            # pools quantized once cannot be used to search parameters that change the quantization
+            search = self.get_attribute("tuning.parameters", CATBOOST_TUNING_PARAMETERS)
+            cache_pool = not any(param in search for param in CATBOOST_QUANTIZATION_PARAMETERS)
+            train_pool, test_pool, test_df, test_labels = self.create_pools(train, test, results, cache_pool=cache_pool)
+
+            # trials are scored on a split of the training data, test scores are not biased by the search
+            tuning_pool, validation_pool = self.get_validation_pools(train_pool, results)
+            best_params = self.tune(tuning_pool, validation_pool, results)
+            del tuning_pool, validation_pool
+            results["performance"]["tuning_ms"] = time_ms(tuning_on)
+
+            # final model is trained on all the training data with the best parameters and scored on the test set
+            for param, value in best_params.items():
+                self.set_attribute("parameters." + param, value)
+            return self.fit_model(train_pool, test_pool, test_df, test_labels, results)
+
+        except Exception as exc:
+            self.exception("CatBoostTunerPlugin - error while tuning: %s", str(exc), exception=exc)
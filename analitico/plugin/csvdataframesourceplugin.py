@@ -2,9 +2,8 @@
 Plugins that import dataframes from different sources
 """
 
-import pandas
 from analitico.utilities import get_dict_dot
-from analitico.schema import analitico_to_pandas_type, apply_schema, NA_VALUES
+from analitico.pandas import pd_read_csv, PD_CSV_CHUNKSIZE
 from .interfaces import IDataframeSourcePlugin, PluginError, plugin
 
 ##
@@ -35,23 +34,15 @@ class CsvDataframeSourcePlugin(IDataframeSourcePlugin):
                 info = self.factory.get_url_json(info_url)
                 schema = get_dict_dot(info, "data.schema")
 
-            # array of types for each column in the source
-            columns = schema.get("columns") if schema else None
+            # when types are known, large files are read and typed in chunks to limit memory usage
+            chunksize = PD_CSV_CHUNKSIZE if schema and "columns" in schema else None
+            chunksize = self.get_attribute("source.chunksize", chunksize)
 
-            dtype = None
-            if columns:
-                dtype = {}
-                for column in columns:
-                    if "type" in column:  # type is optionally defined
-                        if column["type"] == "datetime":
-                            dtype[column["name"]] = "object"
-                        elif column["type"] == "timespan":
-                            dtype[column["name"]] = "object"
-                        else:
-                            dtype[column["name"]] = analitico_to_pandas_type(column["type"])
+            # engine can be "pyarrow" for a multithreaded parser (default is pandas)
+            engine = self.get_attribute("source.engine")
 
             stream = self.factory.get_url_stream(url, binary=False)
-            df = pandas.read_csv(stream, dtype=dtype, encoding="utf-8", na_values=NA_VALUES)
+            df = pd_read_csv(stream, schema, chunksize=chunksize, engine=engine)
 
             tail = self.get_attribute("tail", 0)
             if tail > 0:
@@ -59,10 +50,6 @@ class CsvDataframeSourcePlugin(IDataframeSourcePlugin):
                 df = df.tail(tail)
                 self.info("tail: %d, rows before: %d, rows after: %d", tail, rows_before, len(df))
 
-            if schema:
-                # reorder, filter, apply types, rename columns as requested in schema
-                df = apply_schema(df, schema)
-
             return df
         except Exception as exc:
             self.exception("Error while processing: %s", url, exception=exc)
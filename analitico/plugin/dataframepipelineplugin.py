@@ -3,9 +3,16 @@ import pandas as pd
 import os
 
 from analitico.schema import generate_schema
+from analitico.pandas import pd_to_parquet, pd_to_feather
 from .pipelineplugin import PipelinePlugin
 from .interfaces import plugin
 
+# formats in which the resulting dataframe is saved unless configured with output.formats
+DATAFRAME_OUTPUT_FORMATS = ("csv", "parquet")
+
+# codecs supported by feather files (parquet also supports snappy, gzip, brotli, etc)
+FEATHER_COMPRESSIONS = ("uncompressed", "lz4", "zstd")
+
 ##
 ## DataframePipelinePlugin
 ##
@@ -16,7 +23,12 @@ class DataframePipelinePlugin(PipelinePlugin):
     """ 
     A ETL pipeline plugin that creates a linear workflow by chaining together other plugins 
     where the final result is a pandas dataframe + its schema (metadata). These get saved
-    as artifacts named data.csv (the data) and data.csv.info (the schema).
+    as artifacts named data.csv (the data) and data.csv.info (the schema) and as data.parquet
+    which keeps the columns' types and has the schema embedded in its metadata. The formats
+    are configured with output.formats, eg: ["parquet", "feather"] where feather files can be
+    memory mapped when read. Parquet files are written with output.compression (default snappy)
+    and output.row_group_size while feather files are uncompressed unless output.feather_compression
+    is configured (feather only supports lz4 or zstd).
     """
 
     class Meta(PipelinePlugin.Meta):
@@ -31,17 +43,32 @@ class DataframePipelinePlugin(PipelinePlugin):
             self.logger.warn("DataframePipelinePlugin.run - pipeline didn't produce a valid dataframe")
             return None
 
-        # save dataframe as data.csv
         # we will save the index column only if it is named
         # and it was created explicitely
         artifacts_path = self.factory.get_artifacts_directory()
-        csv_path = os.path.join(artifacts_path, "data.csv")
+        formats = self.get_attribute("output.formats", DATAFRAME_OUTPUT_FORMATS)
+        compression = self.get_attribute("output.compression")
+        feather_compression = self.get_attribute("output.feather_compression")
+        if "feather" in formats and feather_compression and feather_compression not in FEATHER_COMPRESSIONS:
+            msg = "DataframePipelinePlugin - output.feather_compression %s is not supported, use one of: %s"
+            self.exception(msg, feather_compression, ", ".join(FEATHER_COMPRESSIONS))
         index = bool(df.index.name)
-        df.to_csv(csv_path, index=index)
-
-        # save schema as data.csv.info
         schema = generate_schema(df)
-        csv_info_path = csv_path + ".info"
-        analitico.utilities.save_json({"schema": schema}, csv_info_path)
+
+        for output_format in formats:
+            if output_format == "csv":
+                # save dataframe as data.csv and schema as data.csv.info
+                csv_path = os.path.join(artifacts_path, "data.csv")
+                df.to_csv(csv_path, index=index)
+                analitico.utilities.save_json({"schema": schema}, csv_path + ".info")
+            elif output_format == "parquet":
+                parquet_path = os.path.join(artifacts_path, "data.parquet")
+                row_group_size = self.get_attribute("output.row_group_size")
+                pd_to_parquet(df, parquet_path, schema, compression or "snappy", row_group_size, index)
+            elif output_format == "feather":
+                feather_path = os.path.join(artifacts_path, "data.feather")
+                pd_to_feather(df, feather_path, schema, feather_compression, index)
+            else:
+                self.exception("DataframePipelinePlugin - output format %s is not supported", output_format)
 
         return df
@@ -5,6 +5,8 @@ import analitico.utilities
 
 from analitico.constants import ACTION_TRAIN
 from analitico.utilities import time_ms, timeit, get_dict_dot
+from analitico import AnaliticoException
+from analitico.schema import generate_schema, apply_schema
 
 from .interfaces import IDataframeSourcePlugin, plugin
 
@@ -20,6 +22,37 @@ class DatasetSourcePlugin(IDataframeSourcePlugin):
     class Meta(IDataframeSourcePlugin.Meta):
         name = "analitico.plugin.DatasetSourcePlugin"
 
+    def retrieve_parquet_df(self, dataset_id: str, schema: dict = None) -> pd.DataFrame:
+        """
+        Retrieves the dataset's data.parquet asset (if it exists) reading only the columns listed in the
+        dataset's schema (or source.columns) when specified. Parquet data is already typed so the csv parsing
+        is not needed, the schema is still applied so columns are renamed and indexed like when reading csv.
+        Returns None if the dataset has no parquet asset, raises if the asset could not be read.
+        """
+        parquet_url = "analitico://datasets/" + dataset_id + "/files/data.parquet"
+        columns = self.get_attribute("source.columns")
+        if schema and "columns" in schema:
+            if columns:
+                schema = dict(schema, columns=[column for column in schema["columns"] if column["name"] in columns])
+            columns = [column["name"] for column in schema["columns"]]
+        try:
+            reading_on = time_ms()
+            self.info("reading: %s", parquet_url)
+            df = pd.read_parquet(self.factory.get_url_buffer(parquet_url), columns=columns, memory_map=True)
+            self.info("%d rows in %d ms", len(df), time_ms(reading_on))
+        except (AnaliticoException, FileNotFoundError) as exc:
+            if getattr(exc, "status_code", 404) != 404:
+                self.warning("DatasetSourcePlugin - could not read %s, exc: %s", parquet_url, exc)
+                raise
+            self.info("DatasetSourcePlugin - %s is not available, will read csv", parquet_url)
+            return None
+        except Exception as exc:
+            self.warning("DatasetSourcePlugin - could not read %s, exc: %s", parquet_url, exc)
+            raise
+
+        # reorder, filter, apply types, rename columns as requested in schema
+        return apply_schema(df, schema) if schema else df
+
     @timeit
     def retrieve_df(self, *args, action=None, **kwargs):
         """ Retrieve dataframe from dataset with id set in plugin's configuration """
@@ -38,17 +71,29 @@ class DatasetSourcePlugin(IDataframeSourcePlugin):
             if not schema:
                 self.warning("DatasetSourcePlugin - %s does not contain schema information", info_url)
 
-            # save the schema for the source so it can be used to enforce it on prediction
-            self.set_attribute("source.schema", schema)
+            # prefer typed columnar data when the dataset has it, otherwise read csv
+            df = self.retrieve_parquet_df(dataset_id, schema) if self.get_attribute("source.parquet", True) else None
+            if df is None:
+                # stream data from dataset endpoint or storage as csv
+                csv_url = "analitico://datasets/" + dataset_id + "/data/csv"
+                csv_stream = self.factory.get_url_stream(csv_url, binary=False)
 
-            # stream data from dataset endpoint or storage as csv
-            csv_url = "analitico://datasets/" + dataset_id + "/data/csv"
-            csv_stream = self.factory.get_url_stream(csv_url, binary=False)
+                # when types are known, large files are read and typed in chunks to limit memory usage
+                chunksize = analitico.pandas.PD_CSV_CHUNKSIZE if schema and "columns" in schema else None
+                chunksize = self.get_attribute("source.chunksize", chunksize)
 
-            reading_on = time_ms()
-            self.info("reading: %s", csv_url)
-            df = analitico.pandas.pd_read_csv(csv_stream, schema)
-            self.info("%d rows in %d ms", len(df), time_ms(reading_on))
+                # engine can be "pyarrow" for a multithreaded parser (default is pandas)
+                engine = self.get_attribute("source.engine")
+
+                reading_on = time_ms()
+                self.info("reading: %s", csv_url)
+                df = analitico.pandas.pd_read_csv(csv_stream, schema, chunksize=chunksize, engine=engine)
+                self.info("%d rows in %d ms", len(df), time_ms(reading_on))
+            elif not schema:
+                schema = generate_schema(df)
+
+            # save the schema for the source so it can be used to enforce it on prediction
+            self.set_attribute("source.schema", schema)
 
             # https://pandas.pydata.org/pandas-docs/stable/reference/api/pandas.DataFrame.sample.html
             sample = self.get_attribute("sample", 0)
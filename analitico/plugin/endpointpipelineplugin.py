@@ -1,13 +1,62 @@
 import os
 import os.path
+import collections
+import concurrent.futures
 import pandas as pd
 
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None  # optional package, required for parquet input and output
+
 import analitico.pandas
-from analitico.utilities import read_json, get_dict_dot
+from analitico import AnaliticoException
+from analitico.factory import Factory
+from analitico.utilities import read_json, get_dict_dot, time_ms
+from analitico.constants import ACTION_PREDICT, CSV_SUFFIXES, PARQUET_SUFFIXES
 
-from .interfaces import plugin
+from .interfaces import IGroupPlugin, plugin
 from .pipelineplugin import PipelinePlugin
 
+# pipeline used by each worker process when chunks are scored in parallel
+_batch_pipeline = None
+
+
+def _get_plugin_settings(plugin) -> dict:
+    """ Returns the settings that can be used to create a copy of the given plugin (and its children) """
+    settings = {key: value for key, value in (plugin.attributes or {}).items() if key != "factory"}
+    settings["name"] = plugin.Meta.name
+    if isinstance(plugin, IGroupPlugin):
+        settings["plugins"] = [_get_plugin_settings(child) for child in plugin.plugins]
+    return settings
+
+
+def _get_plugin_classes(plugin) -> list:
+    """ Returns the classes of the given plugin and its children """
+    classes = [type(plugin)]
+    if isinstance(plugin, IGroupPlugin):
+        for child in plugin.plugins:
+            classes.extend(_get_plugin_classes(child))
+    return classes
+
+
+def _init_batch_worker(factory_class, factory_settings: dict, plugin_classes: list, settings: dict):
+    """
+    Creates the pipeline used by a worker process with a factory of the same class and settings as the parent's,
+    models are then loaded once and cached in the worker. Plugin classes are registered again since a spawned
+    worker has only imported the modules needed to unpickle its arguments.
+    """
+    global _batch_pipeline
+    for plugin_class in plugin_classes:
+        Factory.register_plugin(plugin_class)
+    _batch_pipeline = factory_class(**factory_settings).get_plugin(**settings)
+
+
+def _predict_batch_chunk(chunk: pd.DataFrame, action: str, keep_columns: list) -> pd.DataFrame:
+    return _batch_pipeline.predict_chunk(chunk, action=action, keep_columns=keep_columns)
+
+
 ##
 ## EndpointPipelinePlugin
 ##
@@ -17,8 +66,9 @@ from .pipelineplugin import PipelinePlugin
 class EndpointPipelinePlugin(PipelinePlugin):
     """
     EndpointPipelinePlugin is a base class for endpoints that take trained machine
-    learning models to deliver inferences. An endpoint subclass could implement 
+    learning models to deliver inferences. An endpoint subclass could implement
     inference APIs by taking a web request and returning predictions, etc.
+    Large files can be scored in bulk with predict_file.
     """
 
     class Meta(PipelinePlugin.Meta):
@@ -38,10 +88,10 @@ class EndpointPipelinePlugin(PipelinePlugin):
                 training = read_json(training_path)
                 assert training
                 self.set_attribute("plugins", [{"name": get_dict_dot(training, "plugins.prediction")}])
+                self.plugins = [self.factory.get_plugin(**settings) for settings in self.get_attribute("plugins")]
 
             assert isinstance(args[0], pd.DataFrame)
             df = args[0]
-            df_copy = df.copy()
 
             # run the pipeline, return predictions
             predictions = super().run(df, action=action, **kwargs)
@@ -56,3 +106,112 @@ class EndpointPipelinePlugin(PipelinePlugin):
             self.error("Error while processing prediction pipeline")
             self.logger.exception(exc)
             raise exc
+
+    def predict_chunk(self, chunk: pd.DataFrame, action: str = ACTION_PREDICT, keep_columns: list = None):
+        """
+        Runs predictions on a chunk of records and returns them as a dataframe with a prediction column,
+        a probability column for each class (classifiers only) and the input columns listed in keep_columns.
+        Predictions are run in batch mode so records are not echoed and results.json is not saved.
+        """
+        kept = chunk[keep_columns].reset_index(drop=True) if keep_columns else None
+        results = self.run(chunk, action=action, batch=True)
+
+        predictions = pd.DataFrame({"prediction": results["predictions"]})
+        if results.get("probabilities"):
+            probabilities = pd.DataFrame.from_records(results["probabilities"])
+            probabilities.columns = ["probability." + str(column) for column in probabilities.columns]
+            predictions = pd.concat([predictions, probabilities], axis=1)
+        if kept is not None:
+            predictions = pd.concat([kept, predictions], axis=1)
+        return predictions
+
+    def _read_chunks(self, input_path: str, chunksize: int):
+        """ Reads csv or parquet input file in chunks of rows """
+        if input_path.endswith(PARQUET_SUFFIXES):
+            if pyarrow is None:
+                raise AnaliticoException("pyarrow is required to read parquet files", status_code=501)
+            for batch in pyarrow.parquet.ParquetFile(input_path).iter_batches(batch_size=chunksize):
+                yield batch.to_pandas()
+        elif input_path.endswith(CSV_SUFFIXES):
+            yield from analitico.pandas.pd_read_csv_chunks(input_path, chunksize=chunksize)
+        else:
+            raise AnaliticoException(f"predict_file - {input_path} is not a csv or parquet file", status_code=400)
+
+    def _predict_chunks(self, chunks, action: str, keep_columns: list, max_workers: int):
+        """ Yields predictions for each chunk, in order, optionally scoring chunks in parallel worker processes """
+        if not max_workers or max_workers < 2:
+            for chunk in chunks:
+                yield self.predict_chunk(chunk, action=action, keep_columns=keep_columns)
+            return
+
+        # everything a worker needs is passed explicitly so that it can be pickled when workers are spawned
+        factory_settings = {
+            "token": self.factory.token,
+            "endpoint": self.factory.endpoint,
+            "artifacts_directory": self.factory.get_artifacts_directory(),
+        }
+        initargs = (type(self.factory), factory_settings, _get_plugin_classes(self), _get_plugin_settings(self))
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers, initializer=_init_batch_worker, initargs=initargs)
+        with pool:
+            # only a few chunks are read ahead of the workers so that memory stays bounded
+            pending = collections.deque()
+            for chunk in chunks:
+                pending.append(pool.submit(_predict_batch_chunk, chunk, action, keep_columns))
+                if len(pending) >= 2 * max_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def predict_file(
+        self,
+        input_path: str,
+        output_path: str,
+        chunksize: int = analitico.pandas.PD_CSV_CHUNKSIZE,
+        max_workers: int = None,
+        keep_columns: list = None,
+        action: str = ACTION_PREDICT,
+    ) -> dict:
+        """
+        Scores a large csv or parquet file in bulk. The file is read in chunks of rows which are run through
+        the prediction pipeline, the resulting predictions are appended to the output file (parquet or csv)
+        so that only a few chunks are held in memory at any time. Chunks can be scored in parallel by
+        max_workers processes, each of which loads the trained model once and keeps it cached.
+
+        Arguments:
+            input_path {str} -- Path of the csv or parquet file with the records to be scored.
+            output_path {str} -- Path of the parquet or csv file where predictions are written.
+
+        Keyword Arguments:
+            chunksize {int} -- Number of rows scored at a time (default: {PD_CSV_CHUNKSIZE}).
+            max_workers {int} -- Number of worker processes, None to score in this process (default: {None}).
+            keep_columns {list} -- Input columns copied to the output, eg. a record id (default: {None}).
+
+        Returns:
+            dict -- Number of rows and chunks scored, output path and elapsed time.
+        """
+        started_on = time_ms()
+        if not output_path.endswith(PARQUET_SUFFIXES + CSV_SUFFIXES):
+            raise AnaliticoException(f"predict_file - {output_path} is not a csv or parquet file", status_code=400)
+        if output_path.endswith(PARQUET_SUFFIXES) and pyarrow is None:
+            raise AnaliticoException("pyarrow is required to write parquet files", status_code=501)
+
+        rows, scored, writer = 0, 0, None
+        try:
+            chunks = self._read_chunks(input_path, chunksize)
+            predictions = self._predict_chunks(chunks, action, keep_columns, max_workers)
+            for chunk_predictions in predictions:
+                if output_path.endswith(PARQUET_SUFFIXES):
+                    table = pyarrow.Table.from_pandas(chunk_predictions, preserve_index=False)
+                    if writer is None:
+                        writer = pyarrow.parquet.ParquetWriter(output_path, table.schema)
+                    writer.write_table(table.cast(writer.schema))
+                else:
+                    chunk_predictions.to_csv(output_path, mode="a" if scored else "w", header=not scored, index=False)
+                rows += len(chunk_predictions)
+                scored += 1
+                self.info("predict_file - scored %d rows in %d chunks", rows, scored)
+        finally:
+            if writer:
+                writer.close()
+
+        return {"rows": rows, "chunks": scored, "output_path": output_path, "elapsed_ms": time_ms(started_on)}
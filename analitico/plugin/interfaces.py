@@ -1,10 +1,17 @@
 import collections
+import concurrent.futures
+import numbers
+import numpy as np
 import pandas as pd
 import os.path
 import multiprocessing
 import os
+import shutil
 import string
 import random
+import tempfile
+
+from sklearn.model_selection import KFold, TimeSeriesSplit
 
 from abc import ABC, abstractmethod
 
@@ -13,8 +20,9 @@ from abc import ABC, abstractmethod
 
 from analitico.mixin import AttributeMixin
 from analitico.factory import Factory
-from analitico.utilities import time_ms, save_json, read_json, get_runtime_brief
-from analitico.schema import apply_schema
+from analitico.utilities import time_ms, save_json, read_json, get_runtime_brief, get_dict_dot
+from analitico.utilities import get_cpu_limit, get_memory_limit
+from analitico.schema import compile_schema
 from analitico.constants import PLUGIN_PREFIX
 
 ##
@@ -182,6 +190,33 @@ ALGORITHM_TYPE_MULTICLASS_CLASSIFICATION = "ml/multiclass-classification"
 ALGORITHM_TYPE_ANOMALY_DETECTION = "ml/anomaly-detection"
 ALGORITHM_TYPE_CLUSTERING = "ml/clustering"
 
+# algorithm, training data and folds used for cross validation, inherited by forked worker processes
+_folds_context = None
+
+
+def _train_fold(fold: int, fold_path: str, resources: dict = None) -> dict:
+    """ Trains the algorithm on a fold of the training data saving its artifacts in fold_path, returns results """
+    started_on = time_ms()
+    algorithm, train, folds = _folds_context
+    if resources:
+        os.environ.update(resources)  # worker process uses its share of the cpus and memory
+    factory = algorithm.factory
+    try:
+        # fold's artifacts are saved in fold_path by a factory configured like the algorithm's own, the working
+        # directory is left alone since it is shared by the whole process (eg. the artifacts writer's thread)
+        fold_factory = type(factory)(token=factory.token, endpoint=factory.endpoint, artifacts_directory=fold_path)
+        with fold_factory:
+            algorithm.factory = fold_factory
+            train_rows, test_rows = folds[fold]
+            results = algorithm.get_training_results()
+            results = algorithm.train(train.iloc[train_rows], train.iloc[test_rows], results)
+            fold_factory.flush_artifacts()
+        results["performance"]["total_ms"] = time_ms(started_on)
+        return results
+    finally:
+        algorithm.factory = factory
+
+
 
 class IAlgorithmPlugin(IPlugin):
     """ An algorithm used to create machine learning models from training data """
@@ -190,15 +225,32 @@ class IAlgorithmPlugin(IPlugin):
         inputs = [{"name": "train", "type": "pandas.DataFrame"}, {"name": "test", "type": "pandas.DataFrame|none"}]
         outputs = [{"name": "model", "type": "dict"}]
 
-    def _run_train(self, *args, **kwargs):
-        """ 
-        When an algorithm runs it always takes in a dataframe with training data,
-        it may optionally have a dataframe of validation data and will return a dictionary
-        with information on the trained model plus a number of artifacts.
+    # training metadata, its compiled schema and the (path, modified time, size) of the file they were loaded from
+    _training = None
+    _training_plan = None
+    _training_key = None
+
+    def get_training(self):
         """
-        assert isinstance(args[0], pd.DataFrame)
-        started_on = time_ms()
-        results = collections.OrderedDict(
+        Returns the training metadata saved in metadata.json and the training schema compiled into
+        a CastPlan (or None if there is no schema). Both are loaded once and reused across predictions
+        until the artifacts directory changes or metadata.json is modified, eg. by a new training.
+        """
+        training_path = os.path.join(self.factory.get_artifacts_directory(), "metadata.json")
+        stat = os.stat(training_path)
+        training_key = (training_path, stat.st_mtime_ns, stat.st_size)
+        if self._training_key != training_key:
+            training = read_json(training_path)
+            assert training
+            schema = get_dict_dot(training, "data.schema")
+            self._training = training
+            self._training_plan = compile_schema(schema) if schema else None
+            self._training_key = training_key
+        return self._training, self._training_plan
+
+    def get_training_results(self) -> dict:
+        """ Returns the dictionary where the results of a training are collected """
+        return collections.OrderedDict(
             {
                 "type": "analitico/training",
                 "plugins": {
@@ -212,9 +264,125 @@ class IAlgorithmPlugin(IPlugin):
             }
         )
 
+    def get_fold_metric(self, results) -> str:
+        """ Returns the score (dot notation key in results.scores) used to pick the best cross validation fold """
+        return self.get_attribute("cv.metric")
+
+    def train_folds(self, train: pd.DataFrame, folds: int, folds_path: str):
+        """
+        Cross validates the algorithm by training it on the given number of folds of the training data.
+        Folds are random unless data.chronological is set in which case each fold is tested on a period
+        and trained on the data that precedes it. Folds are trained in parallel by up to cv.max_workers
+        processes, each using its share of the available cpus and memory, and their artifacts are saved
+        in a subdirectory of folds_path named after the fold. Returns a dictionary with the scores of each
+        fold, their mean and standard deviation and the best fold, plus the results of each fold.
+        """
+        global _folds_context
+        started_on = time_ms()
+        chronological = self.get_attribute("data.chronological", False)
+        splitter = TimeSeriesSplit(folds) if chronological else KFold(folds, shuffle=True, random_state=42)
+        splits = list(splitter.split(train))
+        folds_paths = [os.path.join(folds_path, str(fold)) for fold in range(folds)]
+        for fold_path in folds_paths:
+            os.makedirs(fold_path, exist_ok=True)
+
+        cpu_count = max(1, int(get_cpu_limit()))
+        max_workers = self.get_attribute("cv.max_workers", min(folds, cpu_count))
+        _folds_context = (self, train, splits)
+        try:
+            self.info("cv: training %d folds with %d workers", folds, max_workers)
+            forkable = "fork" in multiprocessing.get_all_start_methods()
+            if max_workers < 2 or not forkable or multiprocessing.current_process().daemon:
+                folds_results = [_train_fold(fold, folds_paths[fold]) for fold in range(folds)]
+            else:
+                resources = {"ANALITICO_CPU_LIMIT": str(max(1, cpu_count // max_workers))}
+                memory_limit = get_memory_limit()
+                if memory_limit:
+                    resources["ANALITICO_MEMORY_LIMIT"] = str(memory_limit // max_workers)
+                # no artifacts should be written by another thread while the worker processes are forked
+                self.factory.flush_artifacts()
+                context = multiprocessing.get_context("fork")
+                with concurrent.futures.ProcessPoolExecutor(max_workers, mp_context=context) as pool:
+                    folds_results = list(pool.map(_train_fold, range(folds), folds_paths, [resources] * folds))
+        finally:
+            _folds_context = None
+
+        # numeric scores of each fold with their mean and standard deviation
+        metric = self.get_fold_metric(folds_results[0])
+        cv = {"folds": folds, "chronological": chronological, "metric": metric, "scores": []}
+        for fold, fold_results in enumerate(folds_results):
+            scores = fold_results["scores"]
+            fold_scores = {
+                key: value
+                for key, value in scores.items()
+                if isinstance(value, numbers.Number) and not isinstance(value, bool)
+            }
+            cv["scores"].append(
+                {
+                    "fold": fold,
+                    "training_records": len(splits[fold][0]),
+                    "test_records": len(splits[fold][1]),
+                    "score": get_dict_dot(scores, metric) if metric else None,
+                    "scores": fold_scores,
+                    "training_ms": fold_results["performance"].get("training_ms"),
+                    "total_ms": fold_results["performance"]["total_ms"],
+                }
+            )
+            self.info("cv: fold %d, %s: %s", fold, metric, cv["scores"][-1]["score"])
+
+        keys = [key for key in cv["scores"][0]["scores"] if all(key in fold["scores"] for fold in cv["scores"])]
+        cv["mean"] = {key: round(float(np.mean([fold["scores"][key] for fold in cv["scores"]])), 5) for key in keys}
+        cv["std"] = {key: round(float(np.std([fold["scores"][key] for fold in cv["scores"]])), 5) for key in keys}
+
+        # best fold has the lowest score, eg. loss or error, unless cv.greater_is_better
+        scored = [fold for fold in cv["scores"] if fold["score"] is not None]
+        if scored:
+            pick = max if self.get_attribute("cv.greater_is_better", False) else min
+            cv["best_fold"] = pick(scored, key=lambda fold: fold["score"])["fold"]
+        cv["elapsed_ms"] = time_ms(started_on)
+        return cv, folds_results
+
+    def _run_train(self, *args, **kwargs):
+        """ 
+        When an algorithm runs it always takes in a dataframe with training data,
+        it may optionally have a dataframe of validation data and will return a dictionary
+        with information on the trained model plus a number of artifacts. When cv.folds is
+        configured the algorithm is first cross validated and the scores of the folds added
+        to results.scores.cv. The model is then trained on all the data or, if cv.keep_best
+        is set, the model and artifacts of the best fold are kept instead.
+        """
+        assert isinstance(args[0], pd.DataFrame)
+        started_on = time_ms()
+        results = self.get_training_results()
+
         train = args[0]
         test = args[1] if len(args) > 1 else None
-        results = self.train(train, test, results, *args, **kwargs)
+        folds = self.get_attribute("cv.folds")
+        if folds:
+            folds_path = tempfile.mkdtemp(prefix="folds_", dir=self.factory.get_temporary_directory())
+            try:
+                cv, folds_results = self.train_folds(train, folds, folds_path)
+                if self.get_attribute("cv.keep_best", False):
+                    if "best_fold" not in cv:
+                        raise PluginError("IAlgorithmPlugin - cv.keep_best requires cv.metric", plugin=self)
+                    # keep model and artifacts trained on the best fold instead of training again
+                    best_path = os.path.join(folds_path, str(cv["best_fold"]))
+                    for entry in os.scandir(best_path):
+                        if entry.is_file():
+                            shutil.copy(entry.path, self.factory.get_artifacts_directory())
+                    for key, value in folds_results[cv["best_fold"]].items():
+                        if key != "performance":
+                            results[key] = value
+                else:
+                    results = self.train(train, test, results, *args, **kwargs)
+                results["scores"]["cv"] = cv
+            finally:
+                shutil.rmtree(folds_path, ignore_errors=True)
+        else:
+            results = self.train(train, test, results, *args, **kwargs)
+
+        # artifacts written in the background while training should be complete when training is
+        self.factory.flush_artifacts()
 
         # finalize results and save as metadata.json
         results["performance"]["total_ms"] = time_ms(started_on)
@@ -234,8 +402,7 @@ class IAlgorithmPlugin(IPlugin):
         data = args[0]
 
         artifacts_path = self.factory.get_artifacts_directory()
-        training = read_json(os.path.join(artifacts_path, "metadata.json"))
-        assert training
+        training, training_plan = self.get_training()
 
         started_on = time_ms()
         results = collections.OrderedDict(
@@ -252,16 +419,17 @@ class IAlgorithmPlugin(IPlugin):
         )
 
         # force schema like in training data
-        if isinstance(data, pd.DataFrame):
-            schema = training["data"]["schema"]
-            data = apply_schema(data, schema)
+        if isinstance(data, pd.DataFrame) and training_plan:
+            data = training_plan.apply(data)
 
         # load model, calculate predictions
         results = self.predict(data, training, results, *args, **kwargs)
         results["performance"]["total_ms"] = time_ms(started_on)
 
-        results_path = os.path.join(artifacts_path, "results.json")
-        save_json(results, results_path)
+        # predictions made in batch mode are returned but not saved
+        if not kwargs.get("batch", False):
+            results_path = os.path.join(artifacts_path, "results.json")
+            save_json(results, results_path)
 
         return results
 
@@ -37,7 +37,14 @@ class PipelinePlugin(IGroupPlugin):
         name = "analitico.plugin.PipelinePlugin"
 
     def get_metadata(self, *args):
-        """ Transform list of arguments into a dictionary describing them (used to log status, etc) """
+        """
+        Transform list of arguments into a dictionary describing them (used to log status, etc).
+        Dataframes are described with their schema and a few samples (artifacts.samples rows, 0 for none,
+        of at most artifacts.max_columns columns). The schema is generated and the samples converted to records
+        later by log_status, in the background, from an empty copy of the dataframe and a copy of the samples.
+        """
+        samples_rows = self.get_attribute("artifacts.samples", DATAFRAME_SAMPLES)
+        samples_columns = self.get_attribute("artifacts.max_columns")
         output = []
         if args and len(args) > 0:
             for i, arg in enumerate(args):
@@ -46,37 +53,51 @@ class PipelinePlugin(IGroupPlugin):
                 if isinstance(arg, pd.DataFrame):
                     df = arg
                     meta["rows"] = len(df)
-                    meta["schema"] = generate_schema(df)
-                    samples = analitico.pandas.pd_sample(df, DATAFRAME_SAMPLES)
-                    meta["samples"] = pd_to_dict(samples)
+                    meta["schema"] = df.iloc[:0].copy()
+                    if samples_rows:
+                        samples = df.iloc[:, :samples_columns] if samples_columns else df
+                        meta["samples"] = analitico.pandas.pd_sample(samples, samples_rows).copy()
 
                     # debugging help
                     self.factory.debug("output[%d]: pd.DataFrame", i)
                     self.factory.debug("  rows: %d", len(df))
                     self.factory.debug("  columns: %d", len(df.columns))
-                    for j, column in enumerate(df.columns):
-                        self.factory.debug(
-                            "  %3d %s (%s/%s)", j, column, df.dtypes[j], pandas_to_analitico_type(df.dtypes[j])
-                        )
+                    for j, (column, dtype) in enumerate(df.dtypes.items()):
+                        self.factory.debug("  %3d %s (%s/%s)", j, column, dtype, pandas_to_analitico_type(dtype))
                 else:
                     self.factory.debug("output[%d]: %s", i, str(type(arg)))
                 output.append(meta)
         return output
 
+    def log_status(self, item, item_status, **kwargs):
+        """ Logs the status of an item, schemas and samples of dataframes in its output are generated first """
+        for meta in kwargs.get("output") or []:
+            if isinstance(meta.get("schema"), pd.DataFrame):
+                meta["schema"] = generate_schema(meta["schema"])
+            if isinstance(meta.get("samples"), pd.DataFrame):
+                meta["samples"] = pd_to_dict(meta["samples"])
+        self.factory.status(item, item_status, **kwargs)
+
     def run(self, *args, action=None, **kwargs):
-        """ Process plugins in sequence, return combined result """
+        """
+        Process plugins in sequence, return combined result. Unless artifacts.background is False,
+        status logs with the outputs of each plugin are written by a background thread while the
+        next plugin runs and are flushed when the pipeline completes.
+        """
         try:
             pipeline_on = time_ms()
+            background = self.get_attribute("artifacts.background", True)
+            output = []
 
             # logging is expensive so we don't track everything in prediction mode
             predicting = action and ACTION_PREDICT in action
             if not predicting:
-                self.factory.status(self, status.STATUS_RUNNING)
+                self.factory.write_artifact(self.log_status, self, status.STATUS_RUNNING, background=background)
 
             for p, plugin in enumerate(self.plugins):
                 plugin_on = time_ms()
                 if not predicting:
-                    self.factory.status(plugin, status.STATUS_RUNNING)
+                    self.factory.write_artifact(self.log_status, plugin, status.STATUS_RUNNING, background=background)
 
                 # a plugin can have one or more input parameters and one or more
                 # output parameters. results from a call to the next in the chain
@@ -90,20 +111,36 @@ class PipelinePlugin(IGroupPlugin):
                     if not isinstance(args, tuple):
                         args = (args,)
                 except Exception as e:
+                    self.factory.flush_artifacts()
                     self.factory.status(plugin, status.STATUS_FAILED, exception=e)
                     raise
 
                 # log outputs of plugin
-                # TODO skip when predicting
                 if not predicting:
                     output = self.get_metadata(*args)
-                    self.factory.status(plugin, status.STATUS_COMPLETED, elapsed_ms=time_ms(plugin_on), output=output)
+                    self.factory.write_artifact(
+                        self.log_status,
+                        plugin,
+                        status.STATUS_COMPLETED,
+                        background=background,
+                        elapsed_ms=time_ms(plugin_on),
+                        output=output,
+                    )
 
             if not predicting:
                 # log outputs of pipeline
-                self.factory.status(self, status.STATUS_COMPLETED, elapsed_ms=time_ms(pipeline_on), output=output)
+                self.factory.write_artifact(
+                    self.log_status,
+                    self,
+                    status.STATUS_COMPLETED,
+                    background=background,
+                    elapsed_ms=time_ms(pipeline_on),
+                    output=output,
+                )
+                self.factory.flush_artifacts()
             return args if len(args) > 1 else args[0]
 
         except Exception as e:
+            self.factory.flush_artifacts()
             self.factory.status(self, status.STATUS_FAILED)
             self.factory.exception(self.Meta.name + " failed while processing", item=self, exception=e)
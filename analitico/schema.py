@@ -108,116 +108,146 @@ def generate_schema(df: pd.DataFrame) -> dict:
     return {"columns": columns}
 
 
+# value used to create a column of the given type when it is listed in the schema but missing from the dataframe
+CAST_MISSING_VALUES = {
+    ANALITICO_TYPE_STRING: None,
+    ANALITICO_TYPE_FLOAT: np.nan,
+    ANALITICO_TYPE_BOOLEAN: False,
+    ANALITICO_TYPE_INTEGER: 0,
+    ANALITICO_TYPE_DATETIME: None,
+    ANALITICO_TYPE_TIMESPAN: None,
+    ANALITICO_TYPE_CATEGORY: None,
+}
+
+
+def cast_series(series: pd.Series, column_type: str) -> pd.Series:
+    """
+    Casts a series to the given analitico type with a single vectorised pass over its values.
+    Series that already have the requested dtype are returned as is, without making a copy.
+    """
+    if column_type == ANALITICO_TYPE_STRING:
+        return series.astype(str)
+    if column_type == ANALITICO_TYPE_FLOAT:
+        return series if series.dtype == PD_TYPE_FLOAT else series.astype(float)
+    if column_type == ANALITICO_TYPE_BOOLEAN:
+        # missing values are converted to False
+        return series if series.dtype == PD_TYPE_BOOLEAN else series.fillna(False).astype(bool)
+    if column_type == ANALITICO_TYPE_INTEGER:
+        # missing values converted to 0
+        return series if series.dtype == PD_TYPE_INTEGER else series.fillna(0).astype(int)
+    if column_type == ANALITICO_TYPE_DATETIME:
+        if series.dtype == "datetime64[ns]":
+            return series
+        if not pd.api.types.is_datetime64_any_dtype(series):
+            # strings like null, N/A, 0, etc are replaced with a single mask
+            series = series.mask(series.isin(NA_DATES))
+        return pd.to_datetime(series, utc=True).astype("datetime64[ns]")
+    if column_type == ANALITICO_TYPE_TIMESPAN:
+        return series if series.dtype == "timedelta64[ns]" else pd.to_timedelta(series)
+    if column_type == ANALITICO_TYPE_CATEGORY:
+        return series if series.dtype.name == PD_TYPE_CATEGORY else series.astype(PD_TYPE_CATEGORY)
+    raise AnaliticoException("cast_series - unknown type: " + column_type)
+
+
+class CastPlan:
+    """
+    A schema compiled into the casts, renames, index and column selection that it requires.
+    A plan is built once and then applied to any number of dataframes, for example to each
+    batch of records received for prediction, without interpreting the schema each time.
+    Columns are cast in place and the dataframe is copied only if its columns need reordering.
+    """
+
+    def __init__(self, schema: dict):
+        assert isinstance(schema, dict), "CastPlan should be passed a schema dictionary"
+        self.schema = schema
+
+        # when a schema contains the 'columns' array, it means that we should
+        # apply the given columns transformations and end up with a dataframe
+        # containing only the given columns, ordered as specified. when it contains
+        # the 'apply' array only the given columns are transformed and others left as is.
+        self.select = "columns" in schema
+        columns = schema["columns"] if self.select else schema.get("apply", [])
+
+        self.casts = []  # (name, type) of columns to be cast
+        self.renames = {}  # name: new name
+        self.index = None  # name of the column used as index (after renames)
+        self.names = []  # final names of the columns
+        for column in columns:
+            assert "name" in column, "CastPlan - should always be passed a column name"
+            column_name = column["name"]
+            column_type = column.get("type")
+            if column_type and column_type not in CAST_MISSING_VALUES:
+                raise AnaliticoException("apply_column - unknown type: " + column_type)
+            self.casts.append((column_name, column_type))
+            if "rename" in column:
+                self.renames[column_name] = column["rename"]
+                column_name = column["rename"]
+            if column.get("index", False):
+                self.index = column_name
+            self.names.append(column_name)
+
+        # if schema has a "drop" array then the columns are removed
+        self.drop = [column["name"] for column in schema.get("drop", []) if column.get("name")]
+
+    def apply(self, df: pd.DataFrame) -> pd.DataFrame:
+        """ Applies the plan to the given dataframe and returns it """
+        assert isinstance(df, pd.DataFrame), "apply_schema should be passed a pd.DataFrame, received: " + str(df)
+        for column_name, column_type in self.casts:
+            if column_type:
+                try:
+                    if column_name not in df.columns:
+                        df[column_name] = CAST_MISSING_VALUES[column_type]
+                    series = df[column_name]
+                    cast = cast_series(series, column_type)
+                    if cast is not series:
+                        df[column_name] = cast
+                except Exception as exc:
+                    msg = f"apply_column - exception while applying type {column_type} to column {column_name}"
+                    raise AnaliticoException(msg) from exc
+            elif column_name not in df.columns:
+                raise AnaliticoException(f"apply_column - could not find column {column_name}")
+
+        if self.renames:
+            df.rename(columns=self.renames, inplace=True)
+            if not self.index:
+                # renaming has always converted the index labels to strings, when a column
+                # is made index below the labels are replaced so they're not converted
+                df.index = df.index.map(str)
+
+        # we use this column as the index but do not remove it from
+        # the columns otherwise we won't be able to rename it, etc
+        if self.index:
+            df.set_index(self.index, drop=False, inplace=True)
+
+        if self.select:
+            # reorder and remove extra columns only if needed
+            return df if list(df.columns) == self.names else df[self.names]
+
+        if self.drop:
+            drop = [column_name for column_name in self.drop if column_name in df.columns]
+            if drop:
+                df.drop(columns=drop, inplace=True)
+        return df
+
+
+def compile_schema(schema) -> CastPlan:
+    """ Compiles a schema into a CastPlan that can be applied repeatedly, plans are returned as is """
+    return schema if isinstance(schema, CastPlan) else CastPlan(schema)
+
+
 def apply_column(df: pd.DataFrame, column):
     """ Apply given type to the column (parameters are type, name, etc from schema column) """
-    try:
-        assert isinstance(df, pd.DataFrame)
-        assert "name" in column, "apply_column - should always be passed a column name"
-        column_name = column["name"]
-
-        # we are being requested to apply type to the column
-        if "type" in column:
-            try:
-                column_type = column["type"]
-                missing = column_name not in df.columns
-                if column_type == "string":
-                    if missing:
-                        df[column_name] = None
-                    df[column_name] = df[column_name].astype(str)
-                elif column_type == "float":
-                    if missing:
-                        df[column_name] = np.nan
-                    df[column_name].fillna(0)
-                    df[column_name] = df[column_name].astype(float)
-                elif column_type == "boolean":
-                    if missing:
-                        df[column_name] = False
-                    # missing values are converted to False
-                    df[column_name] = df[column_name].fillna(False).astype(bool)
-                elif column_type == "integer":
-                    if missing:
-                        df[column_name] = 0
-                    # missing values converted to 0
-                    df[column_name] = df[column_name].fillna(0).astype(int)
-                elif column_type == "datetime":
-                    if missing:
-                        df[column_name] = None
-                    else:
-                        # strings like no
-                        for not_a_date in NA_DATES:
-                            df[column_name].replace(not_a_date, np.nan, inplace=True)
-                    df[column_name] = pd.to_datetime(df[column_name], utc=True).astype("datetime64[ns]")
-                elif column_type == "timespan":
-                    if missing:
-                        df[column_name] = None
-                    df[column_name] = pd.to_timedelta(df[column_name])
-                elif column_type == "category":
-                    if missing:
-                        df[column_name] = None
-                    df[column_name] = df[column_name].astype("category")
-                else:
-                    raise Exception("apply_column - unknown type: " + column_type)
-            except Exception as exc:
-                msg = f"apply_column - exception while applying type {column_type} to column {column_name}"
-                raise AnaliticoException(msg)
-
-        if "rename" in column:
-            df.rename(index=str, columns={column_name: column["rename"]}, inplace=True)
-            column_name = column["rename"]
-
-        # make requested column index
-        index = column.get("index", False)
-        if index:
-            # we use this column as the index but do not remove it from
-            # the columns otherwise we won't be able to rename it, etc
-            df.set_index(column_name, drop=False, inplace=True)
-
-        assert column_name in df.columns
-        return df[column_name]
-
-    except AnaliticoException as exc:
-        raise
-
-    except Exception as exc:
-        raise AnaliticoException(f"apply_column - could apply {column}") from exc
+    plan = CastPlan({"apply": [column]})
+    df = plan.apply(df)
+    return df[plan.names[0]]
 
 
 def apply_schema(df: pd.DataFrame, schema):
     """ 
     Applies the given schema to the dataframe. The method will scan columns
     in the schema and apply their type to columns in the dataframe. It will
-    then sort, filter and rename columns according to schema.
+    then sort, filter and rename columns according to schema. The schema can
+    also be a CastPlan compiled in advance with compile_schema.
     """
     assert isinstance(df, pd.DataFrame), "apply_schema should be passed a pd.DataFrame, received: " + str(df)
-    assert isinstance(schema, dict), "apply_schema should be passed a schema dictionary"
-
-    # when a schema contains the 'columns' array, it means that we should
-    # apply the given columns transformations and end up with a dataframe
-    # containing only the given columns, ordered as specified. if the dataframe
-    # has any additional columns not listed in 'columns' they will be dropped.
-    if "columns" in schema:
-        # select columns and apply types to columns
-        names = []
-        for column in schema["columns"]:
-            ds = apply_column(df, column)
-            names.append(ds.name)
-        # reorder and remove extra columns
-        return df[names]
-
-    # when a schema contains the 'apply' array it means that we should
-    # apply the given column transformations to the dataframe. the array
-    # may or just one or a few columns, meaning all other columns are left
-    # as is. the order of items in 'apply' does not need to match the order
-    # in the dataframe
-    if "apply" in schema:
-        for column in schema["apply"]:
-            apply_column(df, column)
-
-    # if schema has a "drop" array then the columns
-    if "drop" in schema:
-        for column in schema["drop"]:
-            column_name = column.get("name")
-            if column_name and column_name in df.columns:
-                df.drop(columns=[column_name], inplace=True)
-
-    return df
+    return compile_schema(schema).apply(df)
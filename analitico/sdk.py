@@ -20,6 +20,9 @@ import analitico.utilities
 import analitico.models
 
 from analitico.utilities import id_generator, logger
+from analitico.cache import http_cache
+from analitico.streams import open_remote_file, HTTP_STREAM_BUFFER_SIZE
+from analitico.network import HttpSession, HTTP_POOL_SIZE, HTTP_RETRIES, HTTP_TIMEOUT
 from analitico.models import Workspace, Item, Dataset, Recipe, Notebook
 
 ##
@@ -28,7 +31,16 @@ from analitico.models import Workspace, Item, Dataset, Recipe, Notebook
 
 
 class AnaliticoSDK(AttributeMixin):
-    """ An SDK for analitico.ai/api. """
+    """
+    An SDK for analitico.ai/api. Calls are made through a pooled http session whose
+    connections are kept alive and reused. The session can be configured with the optional
+    http_pool_size, http_retries and http_timeout attributes and is closed when the sdk
+    is used in a with statement and exits. Large files are uploaded to storage in resumable
+    chunks whose size can be configured with http_upload_chunk_size (eg: 64Mi).
+    """
+
+    # methods of items return results directly (see AsyncAnaliticoSDK)
+    is_async = False
 
     def __init__(self, token=None, endpoint=None, workspace_id: str = None, **kwargs):
         super().__init__(**kwargs)
@@ -80,6 +92,25 @@ class AnaliticoSDK(AttributeMixin):
         """ Endpoint used to call analitico APIs """
         return self.get_attribute("endpoint")
 
+    @property
+    def cache(self):
+        """ Disk cache used for downloads, shared with factories and other sdks in this process """
+        return http_cache
+
+    # http session created on demand
+    _session: HttpSession = None
+
+    @property
+    def session(self) -> HttpSession:
+        """ Http session with a pool of keep-alive connections used for all calls made by the sdk and its items """
+        if not self._session:
+            self._session = HttpSession(
+                pool_size=self.get_attribute("http_pool_size", HTTP_POOL_SIZE),
+                retries=self.get_attribute("http_retries", HTTP_RETRIES),
+                timeout=self.get_attribute("http_timeout", HTTP_TIMEOUT),
+            )
+        return self._session
+
     ##
     ## Internal Utilities
     ##
@@ -150,17 +181,46 @@ class AnaliticoSDK(AttributeMixin):
         method: str = "GET",
         status_code: int = 200,
         chunk_size: int = 1024 * 1024,
+        timeout=None,
+        offset: int = None,
+        length: int = None,
     ):
         """
         Returns a stream to the given url. This works for regular http:// or https://
         and also works for analitico:// assets which are converted to calls to the given
         endpoint with proper authorization tokens. The stream is returned as an iterator.
+        GET requests are cached on disk and revalidated with the server using conditional
+        requests so that content which has not changed is not downloaded again. A timeout
+        (in seconds) can be specified for the call otherwise the session's default is used.
+        A part of the content can be requested with offset and length (bytes), these range
+        requests are not cached.
         """
+        url, headers = self.get_url_headers(url)
+        if offset is not None or length is not None:
+            offset = offset if offset else 0
+            headers["Range"] = f"bytes={offset}-{offset + length - 1}" if length else f"bytes={offset}-"
+            headers["Accept-Encoding"] = "identity"
+            status_code = 206 if status_code == 200 else status_code
+            cache = False
+
+        if cache and method == "GET" and not (data or json or files):
+            cached_stream, cached_status = self.cache.get_url_stream(
+                url, headers=headers, session=self.session, timeout=timeout
+            )
+            with cached_stream:
+                if status_code and cached_status != status_code:
+                    msg = f"The response from {url} should have been {status_code} but instead it is {cached_status}."
+                    raise AnaliticoException(msg)
+                for chunk in iter(lambda: cached_stream.read(chunk_size), b""):
+                    yield chunk
+            return
+
         # we should not take the raw response stream here as it could be gzipped or encoded.
         # we take the decoded content as a text string and turn it into a stream or we take the
         # decompressed binary content and also turn it into a stream.
-        url, headers = self.get_url_headers(url)
-        response = requests.request(method, url, data=data, files=files, stream=True, headers=headers)
+        response = self.session.request(
+            method, url, data=data, json=json, files=files, stream=True, headers=headers, timeout=timeout
+        )
         if status_code and response.status_code != status_code:
             msg = f"The response from {url} should have been {status_code} but instead it is {response.status_code}."
             raise AnaliticoException(msg)
@@ -172,7 +232,30 @@ class AnaliticoSDK(AttributeMixin):
             for chunk in response.iter_content(chunk_size):
                 yield chunk
 
-    def get_url_json(self, url: str, json: dict = None, method: str = "GET", status_code: int = 200) -> dict:
+    def get_url_buffer(self, url: str, timeout=None):
+        """
+        Returns the content of the given url in a form that can be read with random access, eg. by pyarrow.
+        If the content is in the disk cache, or can be cached as it is downloaded, the path of the cached
+        file is returned and no other copy is made. Otherwise the content is returned in an in-memory buffer.
+        """
+        url, headers = self.get_url_headers(url)
+        buffer, status_code = self.cache.get_url_buffer(url, headers=headers, session=self.session, timeout=timeout)
+        if status_code != 200:
+            msg = f"The response from {url} should have been 200 but instead it is {status_code}."
+            raise AnaliticoException(msg, status_code=status_code)
+        return buffer
+
+    def open_url(self, url: str, buffer_size: int = HTTP_STREAM_BUFFER_SIZE, timeout=None):
+        """
+        Returns a seekable read-only file for the given url whose contents are read on demand with
+        range requests, eg: to read only the footer and a few columns of a large parquet file.
+        """
+        url, headers = self.get_url_headers(url)
+        return open_remote_file(url, session=self.session, headers=headers, buffer_size=buffer_size, timeout=timeout)
+
+    def get_url_json(
+        self, url: str, json: dict = None, method: str = "GET", status_code: int = 200, timeout=None
+    ) -> dict:
         """
         Get a json response from given url. If the url starts with analitico:// it will be
         substituted with the url of the actual endpoint for analitico.ai and a bearer token
@@ -184,13 +267,14 @@ class AnaliticoSDK(AttributeMixin):
         
         Keyword Arguments:
             method {str} -- HTTP method to be used (default: {"get"})
+            timeout -- Timeout in seconds for this call (default: session's timeout)
         
         Returns:
             dict -- The json response.
         """
         url, headers = self.get_url_headers(url)
 
-        response = requests.request(method, url, headers=headers, json=json)
+        response = self.session.request(method, url, headers=headers, json=json, timeout=timeout)
         if status_code and response.status_code != status_code:
             msg = f"The response from {url} should have been {status_code} but instead it is {response.status_code}."
             raise AnaliticoException(msg)
@@ -207,8 +291,10 @@ class AnaliticoSDK(AttributeMixin):
         return self
 
     def __exit__(self, exception_type, exception_value, traceback):
-        """ Leave any temporary files upon exiting """
-        pass
+        """ Leave any temporary files upon exiting, close pooled connections """
+        if self._session:
+            self._session.close()
+            self._session = None
 
     ##
     ## SDK v1 methods
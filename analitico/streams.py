@@ -0,0 +1,218 @@
+""" Stream utilities used to read, copy and cache data coming from the network """
+
+import io
+import os
+import requests
+
+from analitico.exceptions import AnaliticoException
+from analitico.utilities import id_generator
+
+# buffer used when streaming http responses to readers
+HTTP_STREAM_BUFFER_SIZE = 1024 * 1024  # 1 MiB
+
+
+def get_response_stream(response, buffer_size: int = HTTP_STREAM_BUFFER_SIZE):
+    """
+    Returns a buffered file-like object reading the body of a streamed requests.Response
+    straight from the socket. urllib3 takes care of decoding gzip or deflate content-encoding
+    as the stream is read. auto_close is disabled so the raw stream can be wrapped in a buffer.
+    """
+    response.raw.decode_content = True
+    response.raw.auto_close = False
+    return io.BufferedReader(response.raw, buffer_size)
+
+
+class TeeStream(io.RawIOBase):
+    """
+    A readable stream that passes through data read from a source stream (eg. an http
+    response) and at the same time copies it into a file. Data is written to a temporary
+    file which is renamed to the given filepath only once the source has been read completely
+    so that a partially read stream will never leave a truncated file behind. An optional
+    on_completed callback is called after the file has been saved.
+    """
+
+    def __init__(self, stream, filepath: str, on_completed=None):
+        super().__init__()
+        self._stream = stream
+        self._filepath = filepath
+        self._on_completed = on_completed
+        self._temp_filepath = filepath + ".tmp_" + id_generator()
+        self._temp_file = open(self._temp_filepath, "wb")
+
+    @property
+    def filepath(self) -> str:
+        """ Path of the file where the contents of the stream are copied """
+        return self._filepath
+
+    @property
+    def completed(self) -> bool:
+        """ True if the source stream was read to the end and the file was saved """
+        return self._temp_file is None and os.path.isfile(self._filepath)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        chunk = self._stream.read(len(b))
+        if not chunk:
+            self._complete()
+            return 0
+        n = len(chunk)
+        b[:n] = chunk
+        self._temp_file.write(chunk)
+        return n
+
+    def _complete(self):
+        """ Source stream has been read completely, move temp file to its final position """
+        if self._temp_file:
+            self._temp_file.close()
+            self._temp_file = None
+            os.replace(self._temp_filepath, self._filepath)
+            if self._on_completed:
+                self._on_completed()
+
+    def _discard(self):
+        """ Source stream was not read to the end, remove the partial copy """
+        if self._temp_file:
+            self._temp_file.close()
+            self._temp_file = None
+            try:
+                os.remove(self._temp_filepath)
+            except OSError:
+                pass
+
+    def close(self):
+        if not self.closed:
+            self._discard()
+            try:
+                self._stream.close()
+            except Exception:
+                pass
+        super().close()
+
+
+class IterableStream(io.RawIOBase):
+    """ A readable stream that returns data from an iterable of bytes chunks (eg. a generator of chunks) """
+
+    def __init__(self, iterable):
+        super().__init__()
+        self._iterator = iter(iterable)
+        self._chunk = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._chunk:
+            try:
+                self._chunk = next(self._iterator)
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._chunk))
+        b[:n] = self._chunk[:n]
+        self._chunk = self._chunk[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            close = getattr(self._iterator, "close", None)
+            if close:
+                close()  # generators release their connection
+        super().close()
+
+
+class RemoteFile(io.RawIOBase):
+    """
+    A seekable, read-only file whose contents are read from a url with http range requests.
+    Readers like pyarrow can read just the parts of a file they need (eg. a parquet footer
+    and some of its columns) and csv readers can stop after the first rows without the whole
+    file being downloaded. Each read is a GET for exactly the requested bytes so the file
+    should be wrapped in a buffer to read ahead in larger blocks, see open_remote_file.
+    """
+
+    def __init__(self, url: str, session=None, headers: dict = None, size: int = None, timeout=None):
+        super().__init__()
+        self._url = url
+        self._session = session if session else requests
+        # ranges refer to the content as stored, not to a compressed encoding of it
+        self._headers = dict(headers) if headers else {}
+        self._headers["Accept-Encoding"] = "identity"
+        self._timeout = timeout
+        self._size = size
+        self._position = 0
+        # number of range requests made and bytes received
+        self.requests = 0
+        self.bytes_read = 0
+
+    @property
+    def url(self) -> str:
+        return self._url
+
+    @property
+    def size(self) -> int:
+        """ Size of the remote file in bytes """
+        if self._size is None:
+            response = self._get_range(0, 0)
+            content_range = response.headers.get("content-range", "")
+            if response.status_code == 206 and "/" in content_range and not content_range.endswith("*"):
+                self._size = int(content_range.split("/")[-1])
+            elif response.status_code == 416:
+                self._size = 0
+            else:
+                raise self._unsupported(response)
+        return self._size
+
+    def _get_range(self, start: int, end: int):
+        headers = dict(self._headers)
+        headers["Range"] = f"bytes={start}-{end}"
+        response = self._session.get(self._url, headers=headers, timeout=self._timeout)
+        self.requests += 1
+        return response
+
+    def _unsupported(self, response) -> AnaliticoException:
+        msg = f"{self._url} does not support range requests (status: {response.status_code})"
+        return AnaliticoException(msg, status_code=response.status_code if response.status_code >= 400 else 501)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if position < 0:
+            raise ValueError(f"Negative seek position {position}")
+        self._position = position
+        return position
+
+    def readinto(self, b):
+        if not len(b) or self._position >= self.size:
+            return 0
+        end = min(self._position + len(b), self.size) - 1
+        response = self._get_range(self._position, end)
+        if response.status_code != 206:
+            raise self._unsupported(response)
+        data = response.content
+        n = len(data)
+        b[:n] = data
+        self._position += n
+        self.bytes_read += n
+        return n
+
+
+def open_remote_file(
+    url: str, session=None, headers: dict = None, buffer_size: int = HTTP_STREAM_BUFFER_SIZE, **kwargs
+):
+    """ Returns a seekable buffered file reading from the given url with range requests, see RemoteFile """
+    return io.BufferedReader(RemoteFile(url, session=session, headers=headers, **kwargs), buffer_size)
@@ -1,6 +1,7 @@
 import unittest
 import os
 import os.path
+import tempfile
 import pytest
 import pandas as pd
 
@@ -223,6 +224,193 @@ class CatBoostTests(unittest.TestCase, TestMixin):
             factory.error("test_catboost_multiclass_classifier_training_classification_report - " + str(exc))
             pass
 
+    def test_catboost_resources_and_early_stopping(self):
+        """ Test passing thread count, memory limits and early stopping to catboost """
+        with self.get_temporary_factory() as factory:
+            df = pd.read_csv(self.get_asset_path("titanic_1.csv"))
+            parameters = {
+                "iterations": 500,
+                "learning_rate": 0.5,
+                "thread_count": 1,
+                "used_ram_limit": "1Gi",
+                "border_count": 32,
+                "early_stopping_rounds": 5,
+            }
+            catboost = CatBoostPlugin(factory=factory, parameters=parameters)
+            training = catboost.run(df, action="recipe/train")
+
+            self.assertEqual(training["parameters"]["thread_count"], 1)
+            self.assertEqual(training["parameters"]["used_ram_limit"], "1048576kb")
+            self.assertEqual(training["parameters"]["border_count"], 32)
+            self.assertEqual(training["parameters"]["early_stopping_rounds"], 5)
+            # validation score stopped improving well before the last iteration
+            self.assertLess(len(training["scores"]["iterations"]["validation"]["RMSE"]), 500)
+
+    def test_catboost_training_missing_labels_and_categories(self):
+        """ Test training without changing the input data when labels and categorical values are missing """
+        with self.get_temporary_factory() as factory:
+            df = pd.read_csv(self.get_asset_path("titanic_1.csv"))
+            df = df[["Pclass", "Sex", "Age", "Fare", "Name", "Survived"]]
+            df["Sex"] = df["Sex"].astype("category")
+            df["Survived"] = df["Survived"].map({0: "no", 1: "yes"}).astype("category")
+            df.loc[[3, 5], "Survived"] = None
+            df.loc[[7, 9], "Sex"] = None
+
+            catboost = CatBoostPlugin(factory=factory, parameters={"iterations": 20})
+            training = catboost.run(df, action="recipe/train")
+            self.assertEqual(training["algorithm"], "ml/binary-classification")
+            self.assertEqual(training["data"]["dropped_records"], 2)
+            self.assertEqual(training["data"]["training_records"] + training["data"]["test_records"], 889)
+
+            # string column was dropped, label is saved with the codes of its classes
+            schema = training["data"]["schema"]["columns"]
+            self.assertEqual([column["name"] for column in schema], ["Pclass", "Sex", "Age", "Fare", "Survived"])
+            self.assertEqual(schema[-1]["type"], "integer")
+
+            # input data was not modified
+            self.assertEqual(df["Sex"].isna().sum(), 2)
+            self.assertEqual(list(df["Survived"].cat.categories), ["no", "yes"])
+
+    def test_catboost_training_samples(self):
+        """ Test saving samples of training and test data, or not """
+        df = pd.read_csv(self.get_asset_path("titanic_1.csv"))
+        with tempfile.TemporaryDirectory() as artifacts_path:
+            with Factory(artifacts_directory=artifacts_path) as factory:
+                catboost = CatBoostPlugin(factory=factory, parameters={"iterations": 5})
+                catboost.run(df.copy(), action="recipe/train")
+
+                # samples written in the background are saved by the time training completes
+                samples = pd.read_csv(os.path.join(artifacts_path, "training-samples.csv"))
+                self.assertEqual(len(samples), 200)
+                self.assertIn("Survived", samples.columns)
+                samples = pd.read_csv(os.path.join(artifacts_path, "test.csv"))
+                self.assertEqual(len(samples), 179)
+                self.assertEqual(list(samples.columns[-2:]), ["Survived", "prediction"])
+
+            samples_files = ("training-samples.json", "training-samples.csv", "test.csv")
+            for filename in samples_files:
+                os.remove(os.path.join(artifacts_path, filename))
+            with Factory(artifacts_directory=artifacts_path) as factory:
+                artifacts = {"samples": 0}
+                catboost = CatBoostPlugin(factory=factory, parameters={"iterations": 5}, artifacts=artifacts)
+                catboost.run(df.copy(), action="recipe/train")
+                for filename in samples_files:
+                    self.assertFalse(os.path.exists(os.path.join(artifacts_path, filename)))
+                self.assertTrue(os.path.exists(os.path.join(artifacts_path, "model.cbm")))
+
+    def test_catboost_quantized_pool_cache(self):
+        """ Test reusing the quantized training pool when training again on the same data """
+        with self.get_temporary_factory() as factory:
+            df = pd.read_csv(self.get_asset_path("titanic_1.csv"))
+            parameters = {"iterations": 20, "border_count": 64}
+            catboost = CatBoostPlugin(factory=factory, parameters=parameters)
+            training1 = catboost.run(df.copy(), action="recipe/train")
+            catboost = CatBoostPlugin(factory=factory, parameters=parameters)
+            training2 = catboost.run(df.copy(), action="recipe/train")
+            self.assertTrue(training2["performance"]["pool_cached"])
+            self.assertEqual(training1["scores"]["best_score"], training2["scores"]["best_score"])
+
+            # different data or quantization settings are not served from the same pool
+            catboost = CatBoostPlugin(factory=factory, parameters=parameters)
+            key = catboost.get_pool_key(df, df["Survived"], [])
+            key_data = catboost.get_pool_key(df[1:], df["Survived"][1:], [])
+            catboost = CatBoostPlugin(factory=factory, parameters={"border_count": 65})
+            key_border = catboost.get_pool_key(df, df["Survived"], [])
+            self.assertNotEqual(key, key_border)
+            self.assertNotEqual(key, key_data)
+
+            # caching can be disabled
+            data = {"pool_cache": False}
+            catboost = CatBoostPlugin(factory=factory, parameters=parameters, data=data)
+            training4 = catboost.run(df.copy(), action="recipe/train")
+            self.assertNotIn("pool_cached", training4["performance"])
+
+    def test_catboost_cross_validation(self):
+        """ Test cross validating with folds trained in parallel, then keeping the best fold's model """
+        df = pd.read_csv(self.get_asset_path("titanic_1.csv"))
+        df = df[["Pclass", "Sex", "Age", "Fare", "Survived"]]
+        df["Sex"] = df["Sex"].astype("category")
+        df["Survived"] = df["Survived"].map({0: "no", 1: "yes"}).astype("category")
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as artifacts_path:
+            with Factory(artifacts_directory=artifacts_path) as factory:
+                cv = {"folds": 3, "max_workers": 2}
+                catboost = CatBoostPlugin(factory=factory, parameters={"iterations": 10}, cv=cv)
+                training = catboost.run(df.copy(), action="recipe/train")
+
+                # each record is tested in one fold, final model is then trained on the usual 80% train split
+                cv = training["scores"]["cv"]
+                self.assertEqual(cv["metric"], "log_loss")
+                self.assertEqual(len(cv["scores"]), 3)
+                self.assertEqual(sum(fold["test_records"] for fold in cv["scores"]), 891)
+                self.assertIn("log_loss", cv["mean"])
+                self.assertIn("log_loss", cv["std"])
+                self.assertIn(cv["best_fold"], (0, 1, 2))
+                for fold in cv["scores"]:
+                    self.assertGreater(fold["total_ms"], 0)
+                self.assertEqual(training["data"]["training_records"], 712)
+
+            with Factory(artifacts_directory=artifacts_path) as factory:
+                cv = {"folds": 3, "keep_best": True, "max_workers": 1}
+                data = {"chronological": True}
+                catboost = CatBoostPlugin(factory=factory, parameters={"iterations": 10}, data=data, cv=cv)
+                training = catboost.run(df.copy(), action="recipe/train")
+
+                # folds trained inline save their artifacts without changing the working directory
+                self.assertEqual(os.getcwd(), cwd)
+                self.assertIs(catboost.factory, factory)
+
+                # model trained on the best fold is kept, chronological folds test the following periods
+                cv = training["scores"]["cv"]
+                best = cv["scores"][cv["best_fold"]]
+                self.assertEqual([fold["training_records"] for fold in cv["scores"]], [225, 447, 669])
+                self.assertEqual(training["data"]["training_records"], best["training_records"])
+                self.assertEqual(training["scores"]["log_loss"], best["score"])
+                self.assertTrue(os.path.isfile(os.path.join(artifacts_path, "model.cbm")))
+
+    def test_catboost_tuner_successive_halving(self):
+        """ Test searching parameters with successive halving then training with the best ones """
+        with self.get_temporary_factory() as factory:
+            df = pd.read_csv(self.get_asset_path("titanic_1.csv"))
+            tuning = {"parameters": {"depth": [2, 4, 6], "learning_rate": [0.1, 0.3, 1]}, "max_workers": 2}
+            catboost = CatBoostTunerPlugin(factory=factory, parameters={"iterations": 27}, tuning=tuning)
+            training = catboost.run(df, action="recipe/train")
+
+            # 9 candidates with 3 iterations, best 3 with 9 iterations, best one with 27 iterations
+            rungs = training["tuning"]["rungs"]
+            self.assertEqual(len(rungs), 3)
+            self.assertEqual(rungs[0], {"candidates": 9, "iterations": 3})
+            self.assertEqual(rungs[1], {"candidates": 3, "iterations": 9})
+            self.assertEqual(rungs[2], {"candidates": 1, "iterations": 27})
+            self.assertEqual(len(training["tuning"]["trials"]), 13)
+
+            best = training["tuning"]["best"]
+            self.assertEqual(training["parameters"]["depth"], best["parameters"]["depth"])
+            self.assertEqual(training["parameters"]["learning_rate"], best["parameters"]["learning_rate"])
+
+            # trials are scored on a split of the training data, final model is trained on all of it
+            self.assertEqual(training["data"]["validation_records"], 142)
+            self.assertEqual(training["data"]["tuning_records"], 570)
+            self.assertEqual(training["data"]["training_records"], 712)
+
+    def test_catboost_tuner_no_threads_when_forking(self):
+        """ Test that building pools and fitting models leaves no threads running when trials are forked """
+        if not os.path.isdir("/proc/self/task"):
+            self.skipTest("threads of the process can't be counted on this platform")
+        with self.get_temporary_factory() as factory:
+            df = pd.read_csv(self.get_asset_path("titanic_1.csv"))
+            df = df[["Pclass", "Sex", "Age", "Fare", "Survived"]]
+            threads = len(os.listdir("/proc/self/task"))
+
+            # same steps as CatBoostTunerPlugin.train before run_trials forks its workers
+            artifacts = {"background": False}
+            catboost = CatBoostTunerPlugin(factory=factory, parameters={"iterations": 5}, artifacts=artifacts)
+            results = catboost.get_training_results()
+            train_pool, test_pool, _, _ = catboost.create_pools(df, None, results)
+            tuning_pool, validation_pool = catboost.get_validation_pools(train_pool, results)
+            catboost.create_model(results).fit(tuning_pool, eval_set=validation_pool, verbose=False)
+            self.assertEqual(len(os.listdir("/proc/self/task")), threads)
+
     def test_catboost_multiclass_classifier_prediction(self):
         """ Test predictions with catboost as a binary classifier """
         try:
@@ -307,6 +495,26 @@ class CatBoostTests(unittest.TestCase, TestMixin):
             factory.error("test_catboost_regressor - " + str(exc))
             pass
 
+    def test_catboost_prediction_keeps_cached_training(self):
+        """ Test that loading a model for predictions does not modify the cached training metadata """
+        from analitico.cache import model_cache
+
+        df = pd.read_csv(self.get_asset_path("titanic_1.csv"))
+        df = df[["Pclass", "Sex", "Age", "Fare", "Survived"]]
+        with tempfile.TemporaryDirectory() as artifacts_path:
+            with Factory(artifacts_directory=artifacts_path) as factory:
+                parameters = {"iterations": 5, "thread_count": 2}
+                CatBoostPlugin(factory=factory, parameters=parameters).run(df, action="recipe/train")
+
+                # model is loaded by a plugin with other parameters, cached training is left as it was
+                model_cache.clear()
+                catboost = CatBoostPlugin(factory=factory, parameters={"iterations": 7, "thread_count": 1})
+                catboost.run(df.drop(columns=["Survived"]), action="endpoint/predict")
+                training, _ = catboost.get_training()
+                self.assertEqual(training["parameters"]["iterations"], 5)
+                self.assertEqual(training["parameters"]["thread_count"], 2)
+                self.assertNotIn("train_dir", training["parameters"])
+
     def test_catboost_regressor_prediction(self):
         """ Test predictions with catboost as a regressor """
         try:
@@ -2,7 +2,7 @@ import unittest
 import pytest
 import pandas as pd
 
-from analitico.schema import generate_schema, apply_schema
+from analitico.schema import generate_schema, apply_schema, compile_schema
 
 from .test_mixin import TestMixin
 
@@ -423,6 +423,33 @@ class DatasetTests(unittest.TestCase, TestMixin):
         except Exception as exc:
             raise exc
 
+    def test_dataset_compiled_schema_applied_repeatedly(self):
+        """ Test compiling a schema once then applying it to dataframes with raw and already typed values """
+        schema = {
+            "columns": [
+                {"name": "When", "type": "datetime"},
+                {"name": "Count", "type": "integer", "rename": "Total"},
+                {"name": "Color", "type": "category"},
+                {"name": "Missing", "type": "float"},
+            ]
+        }
+        plan = compile_schema(schema)
+        self.assertIs(compile_schema(plan), plan)
+
+        raw = {"Color": ["red", "blue", "red"], "When": ["2019-01-01", "null", "0"], "Count": [1.0, None, 3.0]}
+        df = apply_schema(pd.DataFrame(raw), plan)
+        self.assertEqual(list(df.columns), ["When", "Total", "Color", "Missing"])
+        self.assertEqual(df.dtypes[0], "datetime64[ns]")
+        self.assertTrue(pd.isnull(df.iloc[1, 0]))
+        self.assertTrue(pd.isnull(df.iloc[2, 0]))
+        self.assertEqual(df.iloc[1, 1], 0)
+        self.assertEqual(df.dtypes[2], "category")
+        self.assertTrue(pd.isnull(df.iloc[0, 3]))
+
+        # a dataframe that already matches the schema is returned as is
+        typed = df.rename(columns={"Total": "Count"})
+        self.assertIs(apply_schema(typed, generate_schema(typed)), typed)
+
     # TODO: test reading number that use . for thousands (eg: en-us, locale)
 
     # TODO: test datetime in localized formats
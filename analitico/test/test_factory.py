@@ -5,8 +5,15 @@ import random
 import string
 import io
 import json
+import re
+import tempfile
+import threading
+import time
+import http.server
 
 from analitico.factory import Factory
+from analitico.streams import TeeStream, open_remote_file
+from analitico.cache import HttpCache, ModelCache
 from analitico.schema import generate_schema
 
 from .test_mixin import TestMixin
@@ -16,6 +23,32 @@ from .test_mixin import TestMixin
 TITANIC_PUBLIC_URL = "https://storage.googleapis.com/eu.artifacts.analitico-api.appspot.com/data/train-titanic.csv"
 
 
+class RangeRequestHandler(http.server.BaseHTTPRequestHandler):
+    """ Serves the server's content at any path, honoring the Range header of GET requests like a storage bucket """
+
+    def do_GET(self):
+        content = self.server.content
+        self.server.ranges.append(self.headers.get("Range"))
+        match = re.match(r"bytes=(\d+)-(\d+)$", self.headers.get("Range", ""))
+        if not match:
+            self.send_response(200)
+        elif int(match[1]) >= len(content):
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{len(content)}")
+            content = b""
+        else:
+            start, end = int(match[1]), min(int(match[2]), len(content) - 1)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(content)}")
+            content = content[start : end + 1]
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
 class FactoryTests(unittest.TestCase, TestMixin):
     """ Unit testing of Factory functionality: caching, creating items, plugins, etc """
 
@@ -66,3 +99,188 @@ class FactoryTests(unittest.TestCase, TestMixin):
         self.assertTrue("hardware" in data)
         self.assertTrue("platform" in data)
         self.assertTrue("python" in data)
+
+    def test_factory_tee_stream_cached_when_completed(self):
+        data = os.urandom(256 * 1024)
+        cache_file = self.factory.get_cache_filename(self.random_long_name())
+        with io.BufferedReader(TeeStream(io.BytesIO(data), cache_file), 16 * 1024) as stream:
+            self.assertFalse(os.path.isfile(cache_file))
+            self.assertEqual(stream.read(), data)
+            self.assertTrue(os.path.isfile(cache_file))
+        with open(cache_file, "rb") as f:
+            self.assertEqual(f.read(), data)
+
+    def test_factory_tee_stream_discarded_when_partial(self):
+        data = os.urandom(256 * 1024)
+        cache_file = self.factory.get_cache_filename(self.random_long_name())
+        with io.BufferedReader(TeeStream(io.BytesIO(data), cache_file), 16 * 1024) as stream:
+            self.assertEqual(stream.read(1024), data[:1024])
+        self.assertFalse(os.path.isfile(cache_file))
+        cache_name = os.path.basename(cache_file)
+        leftovers = [f for f in os.listdir(self.factory.get_cache_directory()) if f.startswith(cache_name)]
+        self.assertEqual(leftovers, [])
+
+    def test_factory_cache_conditional_headers(self):
+        url = "https://analitico.ai/" + self.random_long_name()
+        self.assertEqual(self.factory.cache.get_conditional_headers(url), {})
+
+        # validators are only used once the content itself is in cache
+        headers = {"etag": '"abc"', "last-modified": "Wed, 21 Oct 2015 07:28:00 GMT"}
+        self.factory.cache.save_validators(url, headers)
+        self.assertEqual(self.factory.cache.get_conditional_headers(url), {})
+
+        with open(self.factory.get_cache_filename(url), "wb") as f:
+            f.write(b"cached")
+        conditional = self.factory.cache.get_conditional_headers(url)
+        self.assertEqual(conditional["If-None-Match"], '"abc"')
+        self.assertEqual(conditional["If-Modified-Since"], "Wed, 21 Oct 2015 07:28:00 GMT")
+
+    def test_factory_cache_stats(self):
+        stats1 = self.factory.get_cache_stats()
+        unique_id = self.random_long_name()
+        stream, _ = self.factory.get_cached_stream(io.BytesIO(b"x" * 1000), unique_id)
+        stream.close()
+        stream, _ = self.factory.get_cached_stream(io.BytesIO(b"x" * 1000), unique_id)
+        stream.close()
+        stats2 = self.factory.get_cache_stats()
+        self.assertEqual(stats2["misses"], stats1["misses"] + 1)
+        self.assertEqual(stats2["hits"], stats1["hits"] + 1)
+        self.assertEqual(stats2["hit_bytes"], stats1["hit_bytes"] + 1000)
+        self.assertEqual(stats2["miss_bytes"], stats1["miss_bytes"] + 1000)
+
+    def test_factory_cache_trim_least_recently_used(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = HttpCache(directory=cache_dir, max_size="13K")
+            filenames = []
+            for i in range(4):
+                stream, filename = cache.get_cached_stream(io.BytesIO(os.urandom(3000)), f"file{i}")
+                stream.close()
+                os.utime(filename, (time.time() - 100 + i, time.time() - 100 + i))
+                filenames.append(filename)
+            # file0 is the oldest but it is used again so file1 becomes the least recently used
+            stream, _ = cache.get_cached_stream(None, "file0")
+            stream.close()
+
+            stream, filename = cache.get_cached_stream(io.BytesIO(os.urandom(3000)), "file4")
+            stream.close()
+            self.assertTrue(os.path.isfile(filenames[0]))
+            self.assertFalse(os.path.isfile(filenames[1]))
+            self.assertTrue(os.path.isfile(filenames[2]))
+            self.assertTrue(os.path.isfile(filenames[3]))
+            self.assertTrue(os.path.isfile(filename))
+
+            stats = cache.get_stats()
+            self.assertEqual(stats["evictions"], 1)
+            self.assertLessEqual(stats["size"], cache.max_size)
+
+    def test_factory_model_cache(self):
+        with tempfile.TemporaryDirectory() as models_dir:
+            cache = ModelCache(max_count=2, max_size="1K")
+            loads = []
+
+            def loader(model_path):
+                loads.append(model_path)
+                with open(model_path, "rb") as f:
+                    return f.read()
+
+            paths = [os.path.join(models_dir, f"model{i}.cbm") for i in range(3)]
+            for path in paths:
+                with open(path, "wb") as f:
+                    f.write(b"x" * 100)
+
+            self.assertEqual(cache.get_model(paths[0], loader), (b"x" * 100, False))
+            self.assertEqual(cache.get_model(paths[0], loader), (b"x" * 100, True))
+            self.assertEqual(len(loads), 1)
+
+            # a model saved again is reloaded
+            with open(paths[0], "wb") as f:
+                f.write(b"y" * 200)
+            self.assertEqual(cache.get_model(paths[0], loader), (b"y" * 200, False))
+
+            # least recently used model is evicted when there are too many
+            cache.get_model(paths[1], loader)
+            cache.get_model(paths[0], loader)
+            cache.get_model(paths[2], loader)
+            self.assertTrue(cache.get_model(paths[0], loader)[1])
+            self.assertFalse(cache.get_model(paths[1], loader)[1])
+
+            # or when they are too large
+            with open(paths[2], "wb") as f:
+                f.write(b"z" * 1000)
+            cache.get_model(paths[2], loader)
+            stats = cache.get_stats()
+            self.assertEqual(stats["count"], 1)
+            self.assertEqual(stats["hits"], 3)
+            self.assertEqual(stats["misses"], 6)
+            self.assertEqual(stats["evictions"], 4)
+
+    def test_factory_write_artifacts(self):
+        with Factory() as factory:
+            written = []
+
+            def writer(name, delay=0):
+                time.sleep(delay)
+                if name == "broken":
+                    raise IOError("disk full")
+                written.append(name)
+
+            # artifacts are written in the background, in order, errors are logged but not raised
+            factory.write_artifact(writer, "first", delay=0.1)
+            factory.write_artifact(writer, "broken")
+            factory.write_artifact(writer, "second")
+            self.assertEqual(written, [])
+            factory.flush_artifacts()
+            self.assertEqual(written, ["first", "second"])
+
+            # or immediately if requested
+            factory.write_artifact(writer, "third", background=False)
+            self.assertEqual(written, ["first", "second", "third"])
+            with self.assertRaises(IOError):
+                factory.write_artifact(writer, "broken", background=False)
+
+            # queued artifacts are written when the factory is closed
+            factory.write_artifact(writer, "fourth", delay=0.1)
+        self.assertEqual(written, ["first", "second", "third", "fourth"])
+
+    def test_factory_session_pooled(self):
+        with Factory() as factory:
+            session = factory.session
+            self.assertIs(session, factory.session)  # same session reused for all calls
+            adapter = session.get_adapter("https://analitico.ai/api/")
+            self.assertEqual(adapter.max_retries.total, 3)
+            self.assertIn(503, adapter.max_retries.status_forcelist)
+            self.assertIsNotNone(session.timeout)
+        self.assertIsNone(factory._session)  # closed on exit
+
+    def test_factory_remote_file_range_reads(self):
+        with open(self.get_asset_path("titanic_1.csv"), "rb") as f:
+            content = f.read()
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RangeRequestHandler)
+        server.content = content
+        server.ranges = []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            url = f"http://127.0.0.1:{server.server_port}/titanic_1.csv"
+            with open_remote_file(url, buffer_size=1024) as f:
+                head = f.read(11)
+                self.assertEqual(head, b"PassengerId")
+                self.assertEqual(f.raw.size, len(content))
+
+                # seek near the end and read without downloading what's in between
+                f.seek(-10, io.SEEK_END)
+                tail = f.read()
+                self.assertEqual(tail, content[-10:])
+                self.assertEqual(f.raw.requests, 3)  # size, first block, tail
+                self.assertEqual(f.raw.bytes_read, 1024 + 10)
+            end = len(content) - 1
+            self.assertEqual(server.ranges, ["bytes=0-0", "bytes=0-1023", f"bytes={end - 9}-{end}"])
+
+            # preview rows by reading only the first block of the file
+            with open_remote_file(url, buffer_size=4096) as f:
+                lines = [f.readline() for _ in range(10)]
+                self.assertEqual(b"".join(lines), b"".join(content.splitlines(keepends=True)[:10]))
+                self.assertEqual(f.raw.requests, 2)
+                self.assertEqual(f.raw.bytes_read, 4096)
+        finally:
+            server.shutdown()
+            server.server_close()
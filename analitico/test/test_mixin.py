@@ -1,12 +1,15 @@
+import contextlib
 import json
 import os
 import os.path
+import tempfile
 
 import analitico.dataset
 import analitico.utilities
 import analitico.plugin
 
 from analitico.dataset import Dataset
+from analitico.factory import Factory
 
 ASSETS_PATH = os.path.dirname(os.path.realpath(__file__)) + "/assets"
 
@@ -21,6 +24,13 @@ class TestMixin:
         """ Returns absolute path of file in test /assets directory """
         return os.path.join(ASSETS_PATH, path)
 
+    @contextlib.contextmanager
+    def get_temporary_factory(self):
+        """ Yields a factory saving its artifacts in a temporary directory which is removed afterwards """
+        with tempfile.TemporaryDirectory() as artifacts_path:
+            with Factory(artifacts_directory=artifacts_path) as factory:
+                yield factory
+
     def read_json_asset(self, path):
         with open(self.get_asset_path(path), "r") as f:
             text = f.read()
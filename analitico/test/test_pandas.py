@@ -1,4 +1,5 @@
 import unittest
+import os
 import tempfile
 import numpy as np
 import pytest
@@ -168,3 +169,123 @@ class PandasTests(unittest.TestCase):
         self.assertEqual(df2["Dates1.day"].dtype, "category")
         self.assertEqual(df2["Dates1.hour"].dtype, "category")
         self.assertEqual(df2["Dates1.minute"].dtype, "category")
+
+    def test_pandas_to_bytes_parquet(self):
+        import io
+        import pyarrow.parquet
+
+        df1 = self.get_random_dates_df()
+        data = pd_to_bytes(df1, ".parquet", compression="gzip", row_group_size=100)
+        parquet = pyarrow.parquet.ParquetFile(io.BytesIO(data))
+        self.assertEqual(parquet.num_row_groups, (len(df1) + 99) // 100)
+        self.assertEqual(parquet.metadata.row_group(0).column(0).compression, "GZIP")
+
+        df2 = pd.read_parquet(io.BytesIO(data))
+        self.assertTrue(df1.equals(df2))
+
+    def test_pandas_to_parquet_and_feather_with_schema(self):
+        df1 = self.get_random_dates_df()
+        df1["Color"] = pd.Series(np.random.choice(["red", "blue"], len(df1))).astype("category")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            parquet_path = os.path.join(tmpdir, "data.parquet")
+            pd_to_parquet(df1, parquet_path, row_group_size=100)
+            feather_path = os.path.join(tmpdir, "data.feather")
+            pd_to_feather(df1, feather_path)
+
+            read_feather = lambda path: pyarrow.feather.read_feather(path, memory_map=True)
+            for path, read in ((parquet_path, pd.read_parquet), (feather_path, read_feather)):
+                # types are preserved and the schema can be read without loading the data
+                schema = pd_read_schema(path)
+                self.assertEqual(schema, analitico.schema.generate_schema(df1))
+                df2 = read(path)
+                self.assertEqual(df2["Color"].dtype, "category")
+                self.assertEqual(df2["Dates1"].dtype, "datetime64[ns]")
+                self.assertTrue(df1.equals(df2))
+
+            self.assertIsNone(pd_read_schema(os.path.join(tmpdir, "data.csv")))
+
+    def test_pandas_to_bytes_csv(self):
+        import io
+
+        df1 = self.get_random_dates_df()
+        df2 = pd.read_csv(io.BytesIO(pd_to_bytes(df1, ".csv")), index_col=0)
+        self.assertEqual(list(df1.columns), list(df2.columns))
+        self.assertTrue((df1["Data1"] == df2["Data1"]).all())
+
+        with self.assertRaises(AnaliticoException):
+            pd_to_bytes(df1, ".xls")
+
+    def get_categories_csv(self, rows=1000):
+        """ Csv with a categorical column where some categories only appear in the first or last rows """
+        df = pd.DataFrame(
+            {"id": range(rows), "value": np.random.rand(rows), "color": np.random.choice(["red", "blue"], rows)}
+        )
+        df.loc[:10, "color"] = "yellow"
+        df.loc[rows - 10 :, "color"] = "black"
+        schema = {
+            "columns": [
+                {"name": "id", "type": "integer"},
+                {"name": "value", "type": "float"},
+                {"name": "color", "type": "category"},
+            ]
+        }
+        return df.to_csv(index=False), schema
+
+    def test_pandas_read_csv_chunks_unified_categories(self):
+        from io import StringIO
+
+        csv, schema = self.get_categories_csv()
+        chunks = list(pd_read_csv_chunks(StringIO(csv), schema, chunksize=300))
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(sum(len(chunk) for chunk in chunks), 1000)
+
+        # categories of each chunk extend those of the previous chunks
+        for chunk1, chunk2 in zip(chunks, chunks[1:]):
+            categories1 = list(chunk1["color"].cat.categories)
+            categories2 = list(chunk2["color"].cat.categories)
+            self.assertEqual(categories1, categories2[: len(categories1)])
+        self.assertIn("black", list(chunks[-1]["color"].cat.categories))
+        self.assertNotIn("black", list(chunks[0]["color"].cat.categories))
+
+    def test_pandas_read_csv_chunksize_same_as_single_pass(self):
+        from io import StringIO
+
+        csv, schema = self.get_categories_csv()
+        df1 = pd_read_csv(StringIO(csv), schema)
+        df2 = pd_read_csv(StringIO(csv), schema, chunksize=300)
+        self.assertEqual(df2["color"].dtype.name, "category")
+        self.assertEqual(list(df1["color"].cat.categories), list(df2["color"].cat.categories))
+        self.assertTrue(df1.equals(df2))
+
+    def test_pandas_read_csv_chunksize_no_rows(self):
+        from io import StringIO
+
+        # stream is consumed, empty dataframe is typed from the schema
+        csv, schema = self.get_categories_csv()
+        df = pd_read_csv(StringIO(csv), schema, nrows=0, chunksize=300)
+        self.assertEqual(len(df), 0)
+        self.assertEqual(list(df.columns), ["id", "value", "color"])
+        self.assertEqual(df["color"].dtype.name, "category")
+        self.assertEqual(df["value"].dtype.name, "float64")
+
+    def test_pandas_read_csv_pyarrow_engine(self):
+        from io import BytesIO
+
+        csv, schema = self.get_categories_csv()
+        df1 = pd_read_csv(BytesIO(csv.encode()), schema)
+        df2 = pd_read_csv(BytesIO(csv.encode()), schema, engine="pyarrow")
+        self.assertEqual(list(df1.columns), list(df2.columns))
+        self.assertEqual(df2["color"].dtype.name, "category")
+        self.assertEqual(list(df1["color"].cat.categories), list(df2["color"].cat.categories))
+        self.assertTrue(df1["id"].equals(df2["id"]))
+        self.assertTrue(df1["color"].equals(df2["color"]))
+
+    def test_pandas_read_csv_pyarrow_engine_fallback(self):
+        from io import StringIO
+
+        # text streams and nrows are not supported by pyarrow and are read with pandas
+        csv, schema = self.get_categories_csv()
+        df = pd_read_csv(StringIO(csv), schema, engine="pyarrow")
+        self.assertEqual(len(df), 1000)
+        df = pd_read_csv(StringIO(csv), schema, nrows=10, engine="pyarrow")
+        self.assertEqual(len(df), 10)
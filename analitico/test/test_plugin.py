@@ -1,13 +1,17 @@
 import unittest
+import unittest.mock
 import os
 import os.path
 import pytest
 import pandas as pd
+import tempfile
 
 from analitico.plugin import PluginError, PLUGIN_TYPE
 from analitico.plugin import CsvDataframeSourcePlugin, CSV_DATAFRAME_SOURCE_PLUGIN
 from analitico.plugin import CODE_DATAFRAME_PLUGIN
 from analitico.plugin import PipelinePlugin, PIPELINE_PLUGIN
+from analitico.plugin import IAlgorithmPlugin, EndpointPipelinePlugin
+from analitico.factory import Factory
 
 from .test_mixin import TestMixin
 
@@ -16,6 +20,20 @@ from .test_mixin import TestMixin
 ASSETS_PATH = os.path.dirname(os.path.realpath(__file__)) + "/assets"
 
 
+class MeanAlgorithmPlugin(IAlgorithmPlugin):
+    """ An algorithm that predicts the mean of the training data's first column """
+
+    def train(self, train, test, results, *args, **kwargs):
+        results["data"]["schema"] = {"columns": [{"name": name, "type": "float"} for name in train.columns]}
+        results["data"]["mean"] = train.iloc[:, 0].mean()
+        return results
+
+    def predict(self, data, training, results, *args, **kwargs):
+        results["predictions"] = [training["data"]["mean"]] * len(data)
+        results["dtypes"] = [str(dtype) for dtype in data.dtypes]
+        return results
+
+
 @pytest.mark.django_db
 class PluginTests(unittest.TestCase, TestMixin):
     """ Unit testing of Plugin functionalities """
@@ -91,6 +109,74 @@ class PluginTests(unittest.TestCase, TestMixin):
         with self.assertRaises(PluginError):
             df = plugin.run(df, actions="dataset/process")
 
+    def test_plugin_algorithm_reuses_training(self):
+        """ Test that training metadata and its compiled schema are loaded once and reused across predictions """
+        with self.get_temporary_factory() as factory:
+            algorithm = MeanAlgorithmPlugin(factory=factory)
+            algorithm.run(pd.DataFrame({"A": [1, 2, 3], "B": [4, 5, 6]}), action="recipe/train")
+
+            predict1 = algorithm.run(pd.DataFrame({"B": [1, 2], "A": [3, 4]}), action="endpoint/predict")
+            training1, plan1 = algorithm.get_training()
+            predict2 = algorithm.run(pd.DataFrame({"A": [5], "B": [6]}), action="endpoint/predict")
+            training2, plan2 = algorithm.get_training()
+            self.assertIs(training1, training2)
+            self.assertIs(plan1, plan2)
+            self.assertEqual(predict1["predictions"], [2, 2])
+            self.assertEqual(predict2["dtypes"], ["float64", "float64"])
+
+            # training again writes a new metadata.json which is then reloaded
+            algorithm.run(pd.DataFrame({"A": [10, 20]}), action="recipe/train")
+            predict3 = algorithm.run(pd.DataFrame({"A": [1]}), action="endpoint/predict")
+            self.assertEqual(predict3["predictions"], [15])
+            self.assertIsNot(algorithm.get_training()[1], plan1)
+
+    def test_plugin_endpoint_predict_file(self):
+        """ Test scoring a file in chunks with an endpoint pipeline """
+        with tempfile.TemporaryDirectory() as artifacts_path:
+            factory = Factory(artifacts_directory=artifacts_path)
+            algorithm = MeanAlgorithmPlugin(factory=factory)
+            algorithm.run(pd.DataFrame({"A": [1, 2, 3]}), action="recipe/train")
+
+            input_path = os.path.join(artifacts_path, "input.csv")
+            predictions_path = os.path.join(artifacts_path, "predictions.parquet")
+            pd.DataFrame({"Id": range(1000), "A": range(1000)}).to_csv(input_path, index=False)
+            endpoint = EndpointPipelinePlugin(factory=factory, plugins=[algorithm])
+            results = endpoint.predict_file(input_path, predictions_path, chunksize=300, keep_columns=["Id"])
+            self.assertEqual(results["rows"], 1000)
+            self.assertEqual(results["chunks"], 4)
+
+            predictions = pd.read_parquet(predictions_path)
+            self.assertEqual(list(predictions.columns), ["Id", "prediction"])
+            self.assertEqual(list(predictions["Id"]), list(range(1000)))
+            self.assertTrue((predictions["prediction"] == 2).all())
+            # batch predictions are not saved
+            self.assertFalse(os.path.isfile(os.path.join(artifacts_path, "results.json")))
+
+            # chunks scored by worker processes with a factory like this one
+            predictions_path = os.path.join(artifacts_path, "predictions.csv")
+            results = endpoint.predict_file(input_path, predictions_path, chunksize=300, max_workers=2)
+            self.assertEqual(results["chunks"], 4)
+            predictions = pd.read_csv(predictions_path)
+            self.assertEqual(len(predictions), 1000)
+            self.assertTrue((predictions["prediction"] == 2).all())
+
+    def test_plugin_pipeline_status_schemas(self):
+        """ Test that status logs written in the background describe each plugin's output as it was returned """
+        with self.get_temporary_factory() as factory:
+            source = {"url": self.get_asset_path("ds_test_1.csv")}
+            csv_plugin = factory.get_plugin(CSV_DATAFRAME_SOURCE_PLUGIN, source=source)
+            code_plugin = factory.get_plugin(CODE_DATAFRAME_PLUGIN, code="df['Fourth'] = df['First'] * 2")
+            pipeline = PipelinePlugin(factory=factory, plugins=[csv_plugin, code_plugin])
+            with unittest.mock.patch.object(factory, "status") as status:
+                pipeline.run()
+
+            # second plugin added a column to the same dataframe after the first one's output was logged
+            outputs = [call[1]["output"] for call in status.call_args_list if call[1].get("output")]
+            columns = [[column["name"] for column in output[0]["schema"]["columns"]] for output in outputs]
+            self.assertEqual(columns[0], ["First", "Second", "Third"])
+            self.assertEqual(columns[1], ["First", "Second", "Third", "Fourth"])
+            self.assertEqual(len(outputs[0][0]["samples"][0]), 3)
+
     def test_plugin_pipeline(self):
         """ Test grouping plugins into a multi step pipeline to retrieve and process a dataframe """
         pipeline_settings = {
@@ -209,10 +209,71 @@ class SDKTests(unittest.TestCase, TestMixin):
             self.assertEqual(len(boston_df1.index), len(boston_df2.index))
             self.assertTrue(pd.DataFrame.equals(boston_df1, boston_df2))
 
+            # download only some of the columns
+            boston_df3 = dataset.download("boston.parquet", df=True, columns=["CRIM", "TAX"])
+            self.assertEqual(list(boston_df3.columns), ["CRIM", "TAX"])
+            self.assertTrue(pd.Series.equals(boston_df1["TAX"], boston_df3["TAX"]))
+
+        finally:
+            if dataset:
+                dataset.delete()
+
+    def test_sdk_upload_directory_download_many(self):
+        dataset = None
+        try:
+            dataset = self.sdk.create_item(analitico.DATASET_TYPE, title="Upload directory")
+            with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as dst:
+                remotepaths = ["model.cbm", "samples/training.csv", "samples/test.csv", "metadata/metadata.json"]
+                for remotepath in remotepaths:
+                    os.makedirs(os.path.dirname(os.path.join(src, remotepath)), exist_ok=True)
+                    with open(os.path.join(src, remotepath), "wb") as f:
+                        f.write(os.urandom(MB_SIZE))
+
+                # upload whole directory then download all files concurrently
+                dataset.upload(directory=src, remotepath="artifacts")
+                filepaths = dataset.download_many(["artifacts/" + remotepath for remotepath in remotepaths], dst)
+                self.assertEqual(len(filepaths), len(remotepaths))
+                for remotepath, filepath in zip(remotepaths, filepaths):
+                    with open(os.path.join(src, remotepath), "rb") as f1, open(filepath, "rb") as f2:
+                        self.assertEqual(f1.read(), f2.read())
         finally:
             if dataset:
                 dataset.delete()
 
+    def test_sdk_async_upload_download_dataframes(self):
+        """ Upload and download a few dataframes concurrently with the asyncio sdk """
+        import asyncio
+        from analitico.asyncsdk import AsyncAnaliticoSDK
+
+        async def run():
+            async with AsyncAnaliticoSDK(
+                token=ANALITICO_TEST_TOKEN,
+                workspace_id=ANALITICO_TEST_WORKSPACE_ID,
+                endpoint="https://staging.analitico.ai/api/",
+            ) as sdk:
+                dataset = await sdk.create_item(analitico.DATASET_TYPE, title="Async upload")
+                try:
+                    dfs = [pd.DataFrame({"a": range(i * 100), "b": "abc"}) for i in range(1, 5)]
+                    await asyncio.gather(
+                        *[dataset.upload(df=df, remotepath=f"df{i}.parquet") for i, df in enumerate(dfs)]
+                    )
+                    dfs2 = await asyncio.gather(
+                        *[dataset.download(f"df{i}.parquet", df=True) for i in range(len(dfs))]
+                    )
+                    for df1, df2 in zip(dfs, dfs2):
+                        self.assertTrue(pd.DataFrame.equals(df1, df2))
+
+                    # workspace must be awaited, storage was retrieved once for all uploads
+                    with self.assertRaises(AnaliticoException):
+                        dataset.workspace
+                    workspace = await dataset.get_workspace()
+                    self.assertEqual(workspace.id, ANALITICO_TEST_WORKSPACE_ID)
+                    self.assertEqual(list(sdk._storages.keys()), [ANALITICO_TEST_WORKSPACE_ID])
+                finally:
+                    await dataset.delete()
+
+        asyncio.run(run())
+
     def test_sdk_upload_download_8mb(self):
         dataset = None
         try:
@@ -222,6 +283,19 @@ class SDKTests(unittest.TestCase, TestMixin):
             if dataset:
                 dataset.delete()
 
+    def test_sdk_upload_download_8mb_chunked(self):
+        dataset = None
+        chunk_size = self.sdk.get_attribute("http_upload_chunk_size")
+        try:
+            # upload in 1 MB resumable chunks
+            self.sdk.set_attribute("http_upload_chunk_size", "1Mi")
+            dataset = self.sdk.create_item(analitico.DATASET_TYPE, title="Upload 8 MB in chunks")
+            self.upload_random_rainbows(dataset, 8 * MB_SIZE)
+        finally:
+            self.sdk.set_attribute("http_upload_chunk_size", chunk_size)
+            if dataset:
+                dataset.delete()
+
     def test_sdk_upload_download_64mb(self):
         dataset = None
         try:
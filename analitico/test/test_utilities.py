@@ -2,6 +2,7 @@ import unittest
 import tempfile
 import numpy as np
 import os
+import multiprocessing
 
 from analitico.utilities import *
 
@@ -139,3 +140,38 @@ class UtilitiesTests(unittest.TestCase):
         
 
         
+    def test_get_cpu_and_memory_limits(self):
+        with tempfile.TemporaryDirectory() as cgroup_path:
+            # no limits
+            self.assertEqual(get_cpu_limit(cgroup_path), multiprocessing.cpu_count())
+            self.assertIsNone(get_memory_limit(cgroup_path))
+
+            # cgroups v1
+            os.makedirs(os.path.join(cgroup_path, "cpu"))
+            os.makedirs(os.path.join(cgroup_path, "memory"))
+            with open(os.path.join(cgroup_path, "cpu/cpu.cfs_quota_us"), "w") as f:
+                f.write("50000\n")
+            with open(os.path.join(cgroup_path, "cpu/cpu.cfs_period_us"), "w") as f:
+                f.write("100000\n")
+            with open(os.path.join(cgroup_path, "memory/memory.limit_in_bytes"), "w") as f:
+                f.write("9223372036854771712\n")
+            self.assertEqual(get_cpu_limit(cgroup_path), 0.5)
+            self.assertIsNone(get_memory_limit(cgroup_path))
+
+            # cgroups v2
+            with open(os.path.join(cgroup_path, "cpu.max"), "w") as f:
+                f.write("max 100000\n")
+            with open(os.path.join(cgroup_path, "memory.max"), "w") as f:
+                f.write("2147483648\n")
+            self.assertEqual(get_cpu_limit(cgroup_path), multiprocessing.cpu_count())
+            self.assertEqual(get_memory_limit(cgroup_path), 2147483648)
+
+            # environment variables take precedence
+            try:
+                os.environ["ANALITICO_CPU_LIMIT"] = "1500m"
+                os.environ["ANALITICO_MEMORY_LIMIT"] = "1Gi"
+                self.assertEqual(get_cpu_limit(cgroup_path), 1.5)
+                self.assertEqual(get_memory_limit(cgroup_path), 1073741824)
+            finally:
+                del os.environ["ANALITICO_CPU_LIMIT"]
+                del os.environ["ANALITICO_MEMORY_LIMIT"]
@@ -571,3 +571,67 @@ def cpu_unit_to_fractional(n) -> float:
         return n
 
     return n / 1000
+
+
+##
+## Resources
+##
+
+# cgroups hierarchy where containers' cpu and memory limits can be read
+CGROUP_PATH = "/sys/fs/cgroup"
+
+# cgroups v1 reports unlimited memory as a very large number (eg. 9223372036854771712)
+CGROUP_UNLIMITED_MEMORY = 2 ** 60
+
+
+def _read_cgroup_file(cgroup_path: str, filename: str) -> str:
+    """ Returns the stripped contents of a cgroup file or None if it is not available """
+    try:
+        with open(os.path.join(cgroup_path, filename)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def get_cpu_limit(cgroup_path: str = CGROUP_PATH) -> float:
+    """
+    Returns the number of CPUs this process can use. This is the CPU quota of the container when set
+    (cgroups v2 cpu.max or cgroups v1 cpu.cfs_quota_us) or the number of CPUs in the machine otherwise.
+    The limit can also be configured with the ANALITICO_CPU_LIMIT environment variable, eg: 2, 1.5 or 500m.
+    """
+    limit = os.environ.get("ANALITICO_CPU_LIMIT")
+    if limit:
+        return cpu_unit_to_fractional(limit)
+
+    cpu_count = float(multiprocessing.cpu_count())
+    try:
+        cpu_max = _read_cgroup_file(cgroup_path, "cpu.max")  # eg. "200000 100000" or "max 100000"
+        if cpu_max:
+            quota, period = cpu_max.split()[:2]
+            if quota != "max":
+                return min(cpu_count, int(quota) / int(period))
+            return cpu_count
+        quota = _read_cgroup_file(cgroup_path, "cpu/cpu.cfs_quota_us")  # -1 when not limited
+        period = _read_cgroup_file(cgroup_path, "cpu/cpu.cfs_period_us")
+        if quota and period and int(quota) > 0:
+            return min(cpu_count, int(quota) / int(period))
+    except ValueError:
+        pass
+    return cpu_count
+
+
+def get_memory_limit(cgroup_path: str = CGROUP_PATH) -> int:
+    """
+    Returns the memory in bytes this process can use if the container is limited (cgroups v2 memory.max or
+    cgroups v1 memory.limit_in_bytes) or None if it is not. The limit can also be configured with the
+    ANALITICO_MEMORY_LIMIT environment variable, eg: 4Gi or 2048M.
+    """
+    limit = os.environ.get("ANALITICO_MEMORY_LIMIT")
+    if limit:
+        return size_to_bytes(limit)
+
+    for filename in ("memory.max", "memory/memory.limit_in_bytes"):
+        limit = _read_cgroup_file(cgroup_path, filename)
+        if limit and limit.isdigit() and int(limit) < CGROUP_UNLIMITED_MEMORY:
+            return int(limit)
+    return None
@@ -25,8 +25,12 @@ setuptools.setup(
         "simplejson>=3.16.0",
         "pyarrow>=0.14.1",
         "scikit-learn>=0.21.3",
-        "requests>=2.21.0"
+        "requests>=2.21.0",
+        "urllib3>=1.26.0"
         ],
+    extras_require={
+        "async": ["aiohttp>=3.5.4"]
+        },
     classifiers=[
         "Development Status :: 2 - Pre-Alpha",
         "Environment :: Console",